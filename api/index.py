@@ -1 +1,11 @@
-from app.main import app as app
+# Serverless entry point (Vercel). STARTUP_PROFILE=1 prints import and init
+# times per module to stderr when the first response starts.
+from app import startup_profile
+
+startup_profile.install()
+
+from app.main import app as _app, prewarm  # noqa: E402
+
+startup_profile.mark("app imported")
+prewarm()
+app = startup_profile.wrap(_app)
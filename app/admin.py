@@ -0,0 +1,53 @@
+from __future__ import annotations
+from fastapi import APIRouter, Depends, Header, HTTPException
+from typing import Optional
+import secrets
+
+from . import schemas
+from .config import settings
+from .faq_index import faq_index
+
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+	if not settings.admin_token:
+		raise HTTPException(status_code=403, detail="Admin API disabled (set ADMIN_TOKEN)")
+	if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.admin_token):
+		raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+router = APIRouter(prefix="/api/admin", dependencies=[Depends(require_admin)])
+
+
+# Sync endpoints: the ops log fsync and index updates run in the threadpool
+@router.post("/faqs")
+def bulk_update_faqs(payload: schemas.FAQBulkRequest):
+	ops = [{"op": "upsert", **f.model_dump()} for f in payload.upsert]
+	ops += [{"op": "delete", "id": faq_id} for faq_id in payload.delete]
+	if not ops:
+		raise HTTPException(status_code=400, detail="Nothing to upsert or delete")
+	try:
+		return faq_index.apply(ops)
+	except (RuntimeError, OSError) as e:
+		raise HTTPException(status_code=503, detail=f"FAQ changes unavailable: {e}")
+
+
+@router.get("/faqs/status")
+def faqs_status():
+	return {"version": faq_index.version, **faq_index.status()}
+
+
+@router.get("/faqs/{faq_id}", response_model=schemas.FAQItem)
+def get_faq(faq_id: str):
+	faq = faq_index.get().get_faq(faq_id)
+	if faq is None:
+		raise HTTPException(status_code=404, detail="FAQ not found")
+	return schemas.FAQItem(id=faq.id, question=faq.question, answer=faq.answer)
+
+
+@router.post("/faqs/compact")
+def compact_faqs():
+	try:
+		compacted = faq_index.compact()
+	except OSError as e:
+		raise HTTPException(status_code=503, detail=f"Compaction failed: {e}")
+	return {"compacted": compacted, "version": faq_index.version, **faq_index.status()}
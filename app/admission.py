@@ -0,0 +1,141 @@
+from __future__ import annotations
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Hashable, Optional, Tuple
+import asyncio
+import math
+import time
+
+from .config import settings
+from .metrics import Gauge, registry
+from .ratelimit import TokenBucket
+
+
+class Overloaded(Exception):
+	def __init__(self, reason: str, retry_after: int):
+		super().__init__(reason)
+		self.reason = reason
+		self.retry_after = retry_after
+
+
+class AdmissionController:
+	# Caps LLM calls in flight per worker. Callers beyond `max_active` wait in a
+	# FIFO queue of at most `max_queue`. A caller whose expected wait (from the
+	# running average call time) already exceeds its timeout is turned away at
+	# once rather than after the timeout: under a spike, requests fail or
+	# degrade fast instead of piling up behind slow provider calls. Callers
+	# without a timeout (batch jobs) wait in a second queue that only gets a
+	# slot when no chat turn is waiting; a timeout of 0 (background summaries)
+	# only takes a slot that is free right away.
+	def __init__(self, max_active: int, max_queue: int):
+		self.max_active = max_active
+		self.max_queue = max_queue
+		self.active = 0
+		self._waiters: Deque[asyncio.Future] = deque()
+		self._background: Deque[asyncio.Future] = deque()
+		self._latency: Optional[float] = None  # moving average of admitted calls, seconds
+
+	@property
+	def queued(self) -> int:
+		return len(self._waiters) + len(self._background)
+
+	def expected_wait(self, position: int) -> float:
+		if self._latency is None:
+			return 0.0
+		return (position // max(1, self.max_active) + 1) * self._latency
+
+	def retry_after(self) -> int:
+		return max(1, math.ceil(self.expected_wait(len(self._waiters))))
+
+	async def acquire(self, timeout: Optional[float]) -> bool:
+		# True if the caller had to queue for its slot
+		if self.active < self.max_active and not self._waiters and not self._background:
+			self.active += 1
+			return False
+		if timeout is not None:
+			if len(self._waiters) >= self.max_queue:
+				raise Overloaded("queue_full", self.retry_after())
+			if timeout <= 0 or self.expected_wait(len(self._waiters)) > timeout:
+				raise Overloaded("deadline", self.retry_after())
+		queue = self._waiters if timeout is not None else self._background
+		fut = asyncio.get_running_loop().create_future()
+		queue.append(fut)
+		try:
+			await asyncio.wait_for(fut, timeout)
+		except asyncio.TimeoutError:
+			raise Overloaded("timeout", self.retry_after())
+		except asyncio.CancelledError:
+			if fut.done() and not fut.cancelled():
+				# the slot was handed over just as this caller went away
+				self.release()
+			raise
+		finally:
+			if fut in queue:
+				queue.remove(fut)
+		return True
+
+	def release(self, seconds: Optional[float] = None) -> None:
+		if seconds is not None:
+			self._latency = seconds if self._latency is None else 0.8 * self._latency + 0.2 * seconds
+		# hand the slot straight to the next waiter, chat turns first
+		for queue in (self._waiters, self._background):
+			while queue:
+				fut = queue.popleft()
+				if not fut.done():
+					fut.set_result(None)
+					return
+		self.active -= 1
+
+	async def hold(self, timeout: Optional[float]) -> Tuple[Callable[[], None], bool]:
+		# Admits the caller and returns the (idempotent) release and whether it
+		# queued, for streamed responses whose body outlives the handler that admitted them
+		queued = await self.acquire(timeout)
+		start = time.perf_counter()
+		released = False
+
+		def release() -> None:
+			nonlocal released
+			if not released:
+				released = True
+				self.release(time.perf_counter() - start)
+		return release, queued
+
+	@asynccontextmanager
+	async def slot(self, timeout: Optional[float]) -> AsyncIterator[bool]:
+		release, queued = await self.hold(timeout)
+		try:
+			yield queued
+		finally:
+			release()
+
+
+class KeyedRateLimiter:
+	# One token bucket per key (session id, client IP), least recently used keys evicted
+	def __init__(self, per_minute: float, burst: float, max_keys: int = 10000):
+		self.rate = per_minute / 60.0
+		self.burst = max(1.0, burst)
+		self.max_keys = max_keys
+		self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+	@property
+	def enabled(self) -> bool:
+		return self.rate > 0
+
+	def check(self, key: Hashable) -> float:
+		# 0.0 if allowed, else seconds until the next request would be
+		bucket = self._buckets.get(key)
+		if bucket is None:
+			bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+			while len(self._buckets) > self.max_keys:
+				self._buckets.popitem(last=False)
+		else:
+			self._buckets.move_to_end(key)
+		return bucket.try_acquire()
+
+
+llm_admission = AdmissionController(settings.llm_max_active, settings.llm_max_queue)
+session_limiter = KeyedRateLimiter(settings.rate_limit_session_per_minute, settings.rate_limit_session_burst)
+ip_limiter = KeyedRateLimiter(settings.rate_limit_ip_per_minute, settings.rate_limit_ip_burst)
+
+registry.register(Gauge("llm_admission_active", "LLM calls admitted and in flight", lambda: llm_admission.active))
+registry.register(Gauge("llm_admission_queued", "LLM calls waiting for admission", lambda: llm_admission.queued))
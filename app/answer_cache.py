@@ -0,0 +1,169 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from .config import settings
+from .faq_index import faq_index
+from .metrics import CACHE_REQUESTS
+from .retriever import _tokenize_query
+
+
+class MemoryBackend:
+	name = "memory"
+
+	def __init__(self, max_entries: int):
+		self.max_entries = max_entries
+		self._data: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key: str, now: float) -> Optional[str]:
+		with self._lock:
+			item = self._data.get(key)
+			if item is None:
+				return None
+			value, expires_at = item
+			if expires_at <= now:
+				del self._data[key]
+				return None
+			self._data.move_to_end(key)
+			return value
+
+	def set(self, key: str, value: str, expires_at: float) -> None:
+		with self._lock:
+			self._data[key] = (value, expires_at)
+			self._data.move_to_end(key)
+			while len(self._data) > self.max_entries:
+				self._data.popitem(last=False)
+
+	def clear(self) -> None:
+		with self._lock:
+			self._data.clear()
+
+	def __len__(self) -> int:
+		return len(self._data)
+
+
+class SQLiteBackend:
+	# Survives restarts and can be shared by the workers of one host
+	name = "sqlite"
+
+	def __init__(self, path: str, max_entries: int):
+		self.max_entries = max_entries
+		self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+		self._lock = threading.Lock()
+		with self._lock, self._conn:
+			self._conn.execute(
+				"CREATE TABLE IF NOT EXISTS answer_cache ("
+				"key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+			)
+			self._conn.execute("CREATE INDEX IF NOT EXISTS ix_answer_cache_last_used ON answer_cache (last_used)")
+
+	def get(self, key: str, now: float) -> Optional[str]:
+		with self._lock, self._conn:
+			row = self._conn.execute("SELECT value, expires_at FROM answer_cache WHERE key = ?", (key,)).fetchone()
+			if row is None:
+				return None
+			if row[1] <= now:
+				self._conn.execute("DELETE FROM answer_cache WHERE key = ?", (key,))
+				return None
+			self._conn.execute("UPDATE answer_cache SET last_used = ? WHERE key = ?", (now, key))
+			return row[0]
+
+	def set(self, key: str, value: str, expires_at: float) -> None:
+		with self._lock, self._conn:
+			self._conn.execute(
+				"INSERT OR REPLACE INTO answer_cache (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+				(key, value, expires_at, time.time()),
+			)
+			self._conn.execute(
+				"DELETE FROM answer_cache WHERE key IN ("
+				"SELECT key FROM answer_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+				(self.max_entries,),
+			)
+
+	def clear(self) -> None:
+		with self._lock, self._conn:
+			self._conn.execute("DELETE FROM answer_cache")
+
+	def __len__(self) -> int:
+		with self._lock:
+			return self._conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0]
+
+
+class AnswerCache:
+	# LLM answers keyed on the normalized question and the FAQs it was grounded on
+	def __init__(self, backend, ttl: float):
+		self.backend = backend
+		self.ttl = ttl
+		self.hits = 0
+		self.misses = 0
+
+	@staticmethod
+	def make_key(question: str, faq_ids: Sequence[str], history: List[dict], index_digest: str | None = None) -> str:
+		# Prior turns change the answer, so when there are any the key also covers them
+		history_relevant = bool(history)
+		parts = {
+			"q": " ".join(_tokenize_query(question)),
+			"faqs": list(faq_ids),
+			"history": history_relevant,
+			"index": index_digest,
+		}
+		if history_relevant:
+			parts["history_digest"] = hashlib.sha256(
+				json.dumps([[m["role"], m["content"]] for m in history]).encode("utf-8")
+			).hexdigest()
+		return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+	def get(self, key: str) -> Optional[str]:
+		value = self.backend.get(key, time.time())
+		if value is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+		CACHE_REQUESTS.inc(result="miss" if value is None else "hit")
+		return value
+
+	def set(self, key: str, value: str) -> None:
+		self.backend.set(key, value, time.time() + self.ttl)
+
+	def clear(self) -> None:
+		self.backend.clear()
+
+	def stats(self) -> dict:
+		total = self.hits + self.misses
+		return {
+			"backend": self.backend.name,
+			"entries": len(self.backend),
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": (self.hits / total) if total else 0.0,
+		}
+
+
+def _make_cache() -> Optional[AnswerCache]:
+	if not settings.answer_cache_enabled:
+		return None
+	if settings.answer_cache_backend == "sqlite":
+		backend = SQLiteBackend(settings.answer_cache_path, settings.answer_cache_max_entries)
+	elif settings.answer_cache_backend == "memory":
+		backend = MemoryBackend(settings.answer_cache_max_entries)
+	else:
+		raise ValueError(f"Unknown answer cache backend: {settings.answer_cache_backend!r}")
+	return AnswerCache(backend, ttl=settings.answer_cache_ttl)
+
+
+answer_cache = _make_cache()
+
+
+def _on_index_reload(version: int) -> None:
+	# answers were grounded on the previous FAQ content
+	if answer_cache is not None and version > 1:
+		answer_cache.clear()
+
+
+faq_index.add_listener(_on_index_reload)
@@ -0,0 +1,248 @@
+from __future__ import annotations
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Dict, List, Optional
+import asyncio
+import contextvars
+import json
+import os
+import secrets
+import sys
+
+from . import crud
+from .admin import require_admin
+from .config import settings
+from .database import run_db, run_db_write
+from .faq_index import get_retriever
+from .ratelimit import TokenBucket
+from .routers import _answer, _escalate, _make_turn
+
+
+def _job_status(job) -> dict:
+	elapsed = ((job.finished_at or datetime.utcnow()) - job.started_at).total_seconds() if job.started_at else 0.0
+	processed = job.done + job.failed
+	return {
+		"id": job.id,
+		"status": job.status,
+		"total": job.total,
+		"done": job.done,
+		"failed": job.failed,
+		"pending": job.total - processed,
+		"concurrency": job.concurrency,
+		"rate_limit": job.rate_limit,
+		"items_per_second": (processed / elapsed) if elapsed > 0 else 0.0,
+		"created_at": job.created_at,
+		"started_at": job.started_at,
+		"finished_at": job.finished_at,
+	}
+
+
+class BatchRunner:
+	# Runs batch jobs through the chat pipeline (retrieval, prompt, answer cache,
+	# LLM, escalation) without sessions. Items are taken in order, a chunk at a
+	# time: the chunk's questions are retrieved together with retrieve_many, then
+	# answered with at most `concurrency` LLM calls in flight (and at most
+	# `rate_limit` started per second). Results are saved per chunk, so a crash
+	# repeats at most one chunk. Each running job holds a lease in the database;
+	# a supervisor in every process takes over jobs whose lease ran out.
+	def __init__(self):
+		self.owner = f"{os.getpid()}-{secrets.token_hex(4)}"
+		self._jobs: Dict[int, asyncio.Task] = {}
+		self._supervisor: Optional[asyncio.Task] = None
+
+	def start(self) -> None:
+		if self._supervisor is None:
+			self._supervisor = self._spawn(self._supervise(), "batch-supervisor")
+
+	def _spawn(self, coro, name: str) -> asyncio.Task:
+		# a fresh context: jobs must not report into the request that started them
+		return asyncio.get_running_loop().create_task(coro, name=name, context=contextvars.Context())
+
+	async def submit(self, job_id: int) -> None:
+		self.start()
+		await self._claim(job_id)
+
+	async def _claim(self, job_id: Optional[int] = None) -> None:
+		claimed = await run_db_write(crud.claim_batch_jobs, self.owner, settings.batch_lease_seconds, job_id)
+		for jid in claimed:
+			if jid not in self._jobs:
+				task = self._jobs[jid] = self._spawn(self._run_job(jid), f"batch-job-{jid}")
+				task.add_done_callback(lambda _, jid=jid: self._jobs.pop(jid, None))
+
+	async def _supervise(self) -> None:
+		while True:
+			try:
+				await self._claim()
+			except Exception as e:
+				print(f"[Batch supervisor] {type(e).__name__}: {e}", file=sys.stderr)
+			await asyncio.sleep(settings.batch_lease_seconds / 2)
+
+	async def _run_job(self, job_id: int) -> None:
+		try:
+			job = await run_db(crud.get_batch_job, job_id)
+			if job is None:
+				return
+			bucket = TokenBucket(job.rate_limit, burst=1.0) if job.rate_limit else None
+			limit = asyncio.Semaphore(job.concurrency)
+			while await run_db_write(crud.renew_batch_lease, job_id, self.owner, settings.batch_lease_seconds):
+				items = await run_db(crud.pending_batch_items, job_id, max(settings.batch_chunk_size, 4 * job.concurrency))
+				if not items:
+					await run_db_write(crud.finish_batch_job, job_id, self.owner)
+					return
+				renew = self._spawn(self._keep_lease(job_id), f"batch-lease-{job_id}")
+				try:
+					results = await self._run_chunk(items, limit, bucket)
+				finally:
+					renew.cancel()
+				await run_db_write(crud.save_batch_results, job_id, results)
+		except asyncio.CancelledError:
+			raise
+		except Exception as e:
+			# the lease runs out and the job is resumed, here or in another process
+			print(f"[Batch job {job_id} failed] {type(e).__name__}: {e}", file=sys.stderr)
+
+	async def _keep_lease(self, job_id: int) -> None:
+		# a chunk can outlast the lease when the LLM is slow or the rate limit is low
+		while True:
+			await asyncio.sleep(settings.batch_lease_seconds / 3)
+			await run_db_write(crud.renew_batch_lease, job_id, self.owner, settings.batch_lease_seconds)
+
+	async def _run_chunk(self, items, limit: asyncio.Semaphore, bucket: Optional[TokenBucket]) -> List[dict]:
+		retriever = get_retriever()
+		retrieved = await asyncio.to_thread(retriever.retrieve_many, [item.question for item in items], settings.retriever_top_k)
+
+		async def answer(item, faqs) -> dict:
+			async with limit:
+				if bucket is not None:
+					await bucket.acquire()
+				try:
+					turn = _make_turn(0, item.question, datetime.utcnow(), [], 0, None, faqs)
+					text, confidence, needs_escalation = _escalate(turn, await _answer(turn, shed=False))
+				except Exception as e:
+					return {"item_id": item.id, "status": "error", "error": f"{type(e).__name__}: {e}"}
+				return {
+					"item_id": item.id,
+					"status": "done",
+					"answer": text,
+					"confidence": confidence,
+					"needs_escalation": needs_escalation,
+					"faq_ids": json.dumps([r.faq.id for r in faqs]),
+				}
+
+		return await asyncio.gather(*(answer(item, faqs) for item, faqs in zip(items, retrieved)))
+
+	async def stop(self) -> None:
+		tasks = list(self._jobs.values()) + ([self._supervisor] if self._supervisor else [])
+		for task in tasks:
+			task.cancel()
+		await asyncio.gather(*tasks, return_exceptions=True)
+		self._jobs.clear()
+		self._supervisor = None
+		await run_db_write(crud.release_batch_jobs, self.owner)
+
+
+batch_runner = BatchRunner()
+
+
+def _parse_items(body: bytes) -> List[dict]:
+	# NDJSON, one {"question": ..., "id": optional ticket id} object per line
+	items = []
+	for n, line in enumerate(body.splitlines(), start=1):
+		if not line.strip():
+			continue
+		try:
+			obj = json.loads(line)
+		except ValueError:
+			raise HTTPException(status_code=400, detail=f"Line {n}: invalid JSON")
+		question = obj.get("question") if isinstance(obj, dict) else None
+		if not isinstance(question, str) or not question.strip():
+			raise HTTPException(status_code=400, detail=f"Line {n}: \"question\" must be a non-empty string")
+		ticket_id = obj.get("id")
+		items.append({"id": None if ticket_id is None else str(ticket_id)[:128], "question": question})
+		if len(items) > settings.batch_max_items:
+			raise HTTPException(status_code=413, detail=f"At most {settings.batch_max_items} items per job")
+	if not items:
+		raise HTTPException(status_code=400, detail="No items")
+	return items
+
+
+router = APIRouter(prefix="/api/batch", dependencies=[Depends(require_admin)])
+
+
+@router.post("/jobs", status_code=202)
+async def create_job(
+	request: Request,
+	concurrency: Optional[int] = Query(default=None, ge=1),
+	rate_limit: Optional[float] = Query(default=None, ge=0),
+):
+	items = _parse_items(await request.body())
+	concurrency = min(concurrency or settings.batch_concurrency, settings.batch_max_concurrency)
+	rate_limit = settings.batch_rate_limit if rate_limit is None else rate_limit
+	job = await run_db_write(crud.create_batch_job, items, concurrency, rate_limit or None)
+	await batch_runner.submit(job.id)
+	job = await run_db(crud.get_batch_job, job.id)
+	return _job_status(job)
+
+
+async def _get_job(job_id: int):
+	job = await run_db(crud.get_batch_job, job_id)
+	if job is None:
+		raise HTTPException(status_code=404, detail="Job not found")
+	return job
+
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: int):
+	return _job_status(await _get_job(job_id))
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: int):
+	await _get_job(job_id)
+	return _job_status(await run_db_write(crud.cancel_batch_job, job_id))
+
+
+@router.get("/jobs/{job_id}/results")
+async def job_results(
+	job_id: int,
+	after: int = Query(default=-1, ge=-1),
+	follow: bool = Query(default=False),
+):
+	# Finished items in input order as NDJSON, from seq `after` + 1. Output stops
+	# at the first unfinished item; with follow=true it waits for more until the
+	# job ends. A client that drops the connection resumes with after=<last seq>.
+	await _get_job(job_id)
+
+	async def lines():
+		cursor = after
+		while True:
+			rows = await run_db(crud.list_batch_results, job_id, cursor, 500)
+			waiting = False
+			for row in rows:
+				if row.status == "pending":
+					waiting = True
+					break
+				cursor = row.seq
+				yield json.dumps({
+					"seq": row.seq,
+					"id": row.ticket_id,
+					"status": row.status,
+					"answer": row.answer,
+					"confidence": row.confidence,
+					"needs_escalation": None if row.needs_escalation is None else bool(row.needs_escalation),
+					"faq_ids": json.loads(row.faq_ids) if row.faq_ids else [],
+					"error": row.error,
+				}, ensure_ascii=False) + "\n"
+			if not waiting:
+				if len(rows) == 500:
+					continue
+				return
+			if not follow:
+				return
+			job = await run_db(crud.get_batch_job, job_id)
+			if job is None or job.status == "cancelled":
+				return
+			await asyncio.sleep(0.5)
+
+	return StreamingResponse(lines(), media_type="application/x-ndjson")
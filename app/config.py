@@ -5,19 +5,128 @@ from pydantic import Field
 class Settings(BaseSettings):
 	app_name: str = Field(default="AI Customer Support Bot")
 	database_url: str = Field(default="sqlite:////tmp/app.db")
+	# Create missing tables/columns on first use; turn off when the schema is
+	# migrated at deploy time (python -m app.database)
+	db_auto_create: bool = Field(default=True)
+	db_threadpool_size: int = Field(default=8)
+	db_pool_size: int = Field(default=5)
+	db_max_overflow: int = Field(default=10)
+	db_pool_timeout: float = Field(default=30.0)
+	# Serialize chat-path writes through one writer thread
+	db_single_writer: bool = Field(default=True)
+
+	# SQLite: "production" applies WAL + tuned pragmas on connect, "default" leaves SQLite defaults
+	sqlite_profile: str = Field(default="production")
+	sqlite_busy_timeout_ms: int = Field(default=5000)
+	sqlite_mmap_size: int = Field(default=256 * 1024 * 1024)
+	sqlite_cache_size: int = Field(default=-64000)  # negative = KiB
 	retriever_top_k: int = Field(default=5)
+	# MaxScore top-k pruning in retrieve() (same ranking as exhaustive scoring)
+	retriever_pruning: bool = Field(default=True)
+	# LRU of query -> top-k results per index snapshot, and of query -> tokens (0 disables)
+	retrieval_cache_max_entries: int = Field(default=4096)
+	tokenize_cache_size: int = Field(default=8192)
 	escalation_threshold: float = Field(default=0.45)
 	summary_after_messages: int = Field(default=12)
+	# Session summaries are written off the request path by this many worker tasks
+	# (0: inline with the turn). Turns within summary_debounce seconds of each
+	# other share one update; each summary extends the previous one with only the
+	# messages since it.
+	summary_workers: int = Field(default=2)
+	summary_debounce: float = Field(default=2.0)
+	summary_queue_size: int = Field(default=1000)
+	summary_max_chars: int = Field(default=1200)
+	# Have the LLM write the summary while fewer than this many chat calls are in flight (0: extractive only)
+	summary_llm_max_active: int = Field(default=0)
+
+	# Prompt assembly: token budget, and how many recent user/assistant turns are
+	# sent verbatim (older ones are represented by the session summary)
+	prompt_max_tokens: int = Field(default=3000)
+	prompt_history_turns: int = Field(default=4)
+
+	# FAQ index (shared per process, reloaded when the source file changes)
+	faq_path: str = Field(default="data/faqs.jsonl")
+	faq_reload_interval: float = Field(default=2.0)
+	# Prebuilt binary index, memory-mapped and rebuilt when older than faq_path ("" disables)
+	faq_index_path: str = Field(default="data/faqs.bm25")
+	# Without a usable index file, keep only JSONL byte offsets in memory and
+	# decode FAQ text on demand (top-k results) instead of holding every FAQ
+	faq_compact_store: bool = Field(default=True)
+	# Admin FAQ changes: durable ops log replayed on startup ("" disables the admin
+	# write API), folded into faq_path once this many docs are pending
+	faq_ops_path: str = Field(default="data/faqs.ops.jsonl")
+	faq_compact_threshold: int = Field(default=1000)
+	# X-Admin-Token required by /api/admin endpoints (unset: admin API disabled)
+	admin_token: str | None = Field(default=None)
+
+	# Answer cache for repeated questions ("memory" or "sqlite")
+	answer_cache_enabled: bool = Field(default=True)
+	answer_cache_backend: str = Field(default="memory")
+	answer_cache_path: str = Field(default="/tmp/answer_cache.db")
+	answer_cache_max_entries: int = Field(default=1024)
+	answer_cache_ttl: float = Field(default=3600.0)
 
 	# Hugging Face (kept but not used when OpenRouter configured)
 	hf_api_key: str | None = Field(default=None, alias="HUGGINGFACE_API_KEY")
 	hf_model_name: str = Field(default="huggingfaceh4/zephyr-7b-beta", alias="HF_MODEL_NAME")
+	hf_api_base: str = Field(default="https://api-inference.huggingface.co/models", alias="HF_API_BASE")
 
 	# OpenRouter
 	openrouter_api_key: str | None = Field(default=None, alias="OPENROUTER_API_KEY")
 	openrouter_model_name: str = Field(default="meta-llama/llama-3.1-8b-instruct", alias="OR_MODEL_NAME")
 	openrouter_base_url: str = Field(default="https://openrouter.ai/api/v1", alias="OR_BASE_URL")
 
+	# Shared HTTP client for LLM providers (one pool per process)
+	llm_timeout: float = Field(default=60.0)
+	llm_connect_timeout: float = Field(default=10.0)
+	llm_max_connections: int = Field(default=100)
+	llm_max_keepalive_connections: int = Field(default=20)
+	llm_keepalive_expiry: float = Field(default=30.0)
+	llm_http2: bool = Field(default=True)
+	# Share one upstream call between concurrent identical prompts, waiting at most this long
+	llm_coalesce: bool = Field(default=True)
+	llm_coalesce_wait: float = Field(default=90.0)
+
+	# Admission control in front of the LLM stage: calls in flight per worker, callers
+	# allowed to queue, and how long a chat turn may wait. Turns that can't be
+	# admitted get a FAQ-only answer ("faq") or 503 + Retry-After ("reject").
+	llm_max_active: int = Field(default=32)
+	llm_max_queue: int = Field(default=64)
+	llm_queue_timeout: float = Field(default=5.0)
+	llm_overload_mode: str = Field(default="faq")
+	# Chat requests per minute per session and per client IP (0 disables), with bursts
+	rate_limit_session_per_minute: float = Field(default=30.0)
+	rate_limit_session_burst: float = Field(default=10.0)
+	rate_limit_ip_per_minute: float = Field(default=120.0)
+	rate_limit_ip_burst: float = Field(default=30.0)
+	# Take the client IP from X-Forwarded-For (only behind a trusted proxy)
+	rate_limit_trust_forwarded: bool = Field(default=False)
+
+	# Provider routing: one deadline per turn across the whole fallback chain,
+	# per-provider circuit breakers and optional hedged requests
+	llm_deadline: float = Field(default=30.0)
+	llm_hedge: bool = Field(default=False)
+	llm_hedge_min_delay: float = Field(default=0.5)
+	llm_hedge_default_delay: float = Field(default=5.0)
+	llm_breaker_window: float = Field(default=60.0)
+	llm_breaker_min_calls: int = Field(default=5)
+	llm_breaker_error_rate: float = Field(default=0.5)
+	llm_breaker_slow_call: float = Field(default=20.0)
+	llm_breaker_cooldown: float = Field(default=30.0)
+
+	# Batch jobs (/api/batch): default and max LLM calls in flight per job, default
+	# rate limit in items/s (0: none), items fetched per round, and the lease after
+	# which another process resumes a job whose runner stopped
+	batch_concurrency: int = Field(default=8)
+	batch_max_concurrency: int = Field(default=64)
+	batch_rate_limit: float = Field(default=0.0)
+	batch_max_items: int = Field(default=100000)
+	batch_chunk_size: int = Field(default=64)
+	batch_lease_seconds: float = Field(default=60.0)
+
+	# Per-stage timers: Server-Timing header and Prometheus histograms on /metrics
+	metrics_enabled: bool = Field(default=True)
+
 	# Pydantic v2 config
 	model_config = SettingsConfigDict(
 		protected_namespaces=("settings_",),
@@ -1,9 +1,10 @@
 from __future__ import annotations
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, timedelta
+from typing import List, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import func, insert, or_, select, tuple_, update
 from . import models
+from .metrics import timed
 
 
 def create_session(db: Session, external_id: Optional[str]) -> models.ChatSession:
@@ -14,6 +15,7 @@ def create_session(db: Session, external_id: Optional[str]) -> models.ChatSessio
 	return session
 
 
+@timed("db.get_session")
 def get_session(db: Session, session_id: int) -> Optional[models.ChatSession]:
 	return db.get(models.ChatSession, session_id)
 
@@ -28,6 +30,70 @@ def list_messages(db: Session, session_id: int):
 	return list(db.scalars(stmt))
 
 
+_MESSAGE_COLUMNS = (
+	models.Message.id,
+	models.Message.role,
+	models.Message.content,
+	models.Message.created_at,
+	models.Message.confidence,
+	models.Message.needs_escalation,
+)
+
+
+@timed("db.list_messages_page")
+def list_messages_page(
+	db: Session,
+	session_id: int,
+	before: Optional[int] = None,
+	after: Optional[int] = None,
+	limit: int = 50,
+):
+	# Keyset pagination on (created_at, id) served by ix_messages_session_created_id.
+	# Cursors are message ids: `after` pages forward (after=0 from the first
+	# message), `before` (or no cursor, the newest messages) pages backward. Returns (rows oldest first, has_more) where
+	# has_more says whether further rows exist in the paging direction.
+	Message = models.Message
+	stmt = select(*_MESSAGE_COLUMNS).where(Message.session_id == session_id)
+	for cursor, newer in ((after, True), (before, False)):
+		if cursor is None or (newer and cursor == 0):
+			continue
+		created_at = db.scalar(select(Message.created_at).where(Message.id == cursor, Message.session_id == session_id))
+		if created_at is None:
+			raise LookupError(cursor)
+		key = tuple_(Message.created_at, Message.id)
+		stmt = stmt.where(key > tuple_(created_at, cursor) if newer else key < tuple_(created_at, cursor))
+	if after is not None:
+		stmt = stmt.order_by(Message.created_at.asc(), Message.id.asc())
+	else:
+		stmt = stmt.order_by(Message.created_at.desc(), Message.id.desc())
+	rows = list(db.execute(stmt.limit(limit + 1)))
+	has_more = len(rows) > limit
+	rows = rows[:limit]
+	if after is None:
+		rows.reverse()
+	return rows, has_more
+
+
+@timed("db.list_recent_messages")
+def list_recent_messages(db: Session, session_id: int, limit: int):
+	# newest `limit` messages, returned oldest first
+	if limit <= 0:
+		return []
+	stmt = (
+		select(models.Message)
+		.where(models.Message.session_id == session_id)
+		.order_by(models.Message.created_at.desc(), models.Message.id.desc())
+		.limit(limit)
+	)
+	return list(reversed(list(db.scalars(stmt))))
+
+
+@timed("db.count_messages")
+def count_messages(db: Session, session_id: int) -> int:
+	stmt = select(func.count()).select_from(models.Message).where(models.Message.session_id == session_id)
+	return db.scalar(stmt) or 0
+
+
 def add_message(
 	db: Session,
 	session_id: int,
@@ -49,6 +115,58 @@ def add_message(
 	return msg
 
 
+@timed("db.commit_turn")
+def commit_turn(
+	db: Session,
+	session_id: int,
+	messages: List[dict],
+	summary: Optional[str] = None,
+	summary_through: Optional[int] = None,
+):
+	# Unit of work for one chat turn: bulk insert of the turn's messages and the
+	# optional summary update (with its watermark) in a single transaction.
+	# Returns (id, created_at) per message via RETURNING instead of refresh()
+	# round trips; ids follow the insertion order, so sorting by id lines the
+	# rows up with `messages`.
+	rows = [
+		{
+			"session_id": session_id,
+			"role": m["role"],
+			"content": m["content"],
+			"created_at": m.get("created_at") or datetime.utcnow(),
+			"confidence": m.get("confidence"),
+			"needs_escalation": m.get("needs_escalation"),
+		}
+		for m in messages
+	]
+	# Core insert: the ORM bulk path would split rows with NULL columns into separate statements
+	stmt = insert(models.Message.__table__).returning(models.Message.id, models.Message.created_at)
+	inserted = sorted(tuple(r) for r in db.execute(stmt, rows))
+	if summary:
+		values = {"user_summary": summary, "updated_at": datetime.utcnow()}
+		if summary_through is not None:
+			values["summary_message_id"] = summary_through
+		db.execute(update(models.ChatSession).where(models.ChatSession.id == session_id).values(**values))
+	db.commit()
+	return inserted
+
+
+@timed("db.commit_summary")
+def commit_summary(db: Session, session_id: int, summary: str, through_id: int, previous_id: Optional[int]) -> bool:
+	# Compare-and-set on the summary watermark: False if another worker moved it
+	# since previous_id was read, in which case this summary is stale
+	ChatSession = models.ChatSession
+	stmt = (
+		update(ChatSession)
+		.where(ChatSession.id == session_id)
+		.where(ChatSession.summary_message_id.is_(None) if previous_id is None else ChatSession.summary_message_id == previous_id)
+		.values(user_summary=summary, summary_message_id=through_id, updated_at=datetime.utcnow())
+	)
+	updated = db.execute(stmt).rowcount
+	db.commit()
+	return bool(updated)
+
+
 def update_session_summary(db: Session, session_id: int, summary: str) -> None:
 	session = get_session(db, session_id)
 	if not session:
@@ -59,6 +177,158 @@ def update_session_summary(db: Session, session_id: int, summary: str) -> None:
 	db.commit()
 
 
+def create_batch_job(db: Session, items: List[dict], concurrency: int, rate_limit: Optional[float]) -> models.BatchJob:
+	# items: {"id": optional ticket id, "question"}; one transaction for the job and all its items
+	job = models.BatchJob(status="queued", concurrency=concurrency, rate_limit=rate_limit, total=len(items), done=0, failed=0)
+	db.add(job)
+	db.flush()
+	rows = [
+		{"job_id": job.id, "seq": seq, "ticket_id": item.get("id"), "question": item["question"], "status": "pending"}
+		for seq, item in enumerate(items)
+	]
+	if rows:
+		db.execute(insert(models.BatchItem.__table__), rows)
+	db.commit()
+	db.refresh(job)
+	return job
+
+
+def get_batch_job(db: Session, job_id: int) -> Optional[models.BatchJob]:
+	return db.get(models.BatchJob, job_id)
+
+
+def claim_batch_jobs(db: Session, owner: str, lease_seconds: float, job_id: Optional[int] = None) -> List[int]:
+	# Unfinished jobs with no live lease (never started, released on shutdown, or
+	# whose runner died) are taken over by `owner`. Returns the claimed job ids.
+	BatchJob = models.BatchJob
+	now = datetime.utcnow()
+	stmt = (
+		update(BatchJob)
+		.where(BatchJob.status.in_(("queued", "running")))
+		.where(or_(BatchJob.owner.is_(None), BatchJob.lease_expires_at < now))
+		.values(
+			status="running",
+			owner=owner,
+			lease_expires_at=now + timedelta(seconds=lease_seconds),
+			started_at=func.coalesce(BatchJob.started_at, now),
+		)
+		.returning(BatchJob.id)
+	)
+	if job_id is not None:
+		stmt = stmt.where(BatchJob.id == job_id)
+	claimed = [row[0] for row in db.execute(stmt)]
+	db.commit()
+	return claimed
+
+
+def renew_batch_lease(db: Session, job_id: int, owner: str, lease_seconds: float) -> bool:
+	# False once the job was cancelled, finished or taken over by another process
+	BatchJob = models.BatchJob
+	stmt = (
+		update(BatchJob)
+		.where(BatchJob.id == job_id, BatchJob.owner == owner, BatchJob.status == "running")
+		.values(lease_expires_at=datetime.utcnow() + timedelta(seconds=lease_seconds))
+	)
+	renewed = db.execute(stmt).rowcount
+	db.commit()
+	return bool(renewed)
+
+
+def release_batch_jobs(db: Session, owner: str) -> None:
+	# graceful shutdown: let the next process resume these jobs right away
+	BatchJob = models.BatchJob
+	db.execute(update(BatchJob).where(BatchJob.owner == owner).values(owner=None, lease_expires_at=None))
+	db.commit()
+
+
+def pending_batch_items(db: Session, job_id: int, limit: int):
+	BatchItem = models.BatchItem
+	stmt = (
+		select(BatchItem.id, BatchItem.seq, BatchItem.ticket_id, BatchItem.question)
+		.where(BatchItem.job_id == job_id, BatchItem.status == "pending")
+		.order_by(BatchItem.seq)
+		.limit(limit)
+	)
+	return list(db.execute(stmt))
+
+
+@timed("db.save_batch_results")
+def save_batch_results(db: Session, job_id: int, results: List[dict]) -> None:
+	# results: {"item_id", "status", "answer", "confidence", "needs_escalation", "faq_ids", "error"}.
+	# Only still-pending items are updated, so a job resumed by another process
+	# after a lost lease can't count an item twice.
+	BatchItem = models.BatchItem
+	now = datetime.utcnow()
+	done = failed = 0
+	for r in results:
+		updated = db.execute(
+			update(BatchItem)
+			.where(BatchItem.id == r["item_id"], BatchItem.status == "pending")
+			.values(
+				status=r["status"],
+				answer=r.get("answer"),
+				confidence=r.get("confidence"),
+				needs_escalation=r.get("needs_escalation"),
+				faq_ids=r.get("faq_ids"),
+				error=r.get("error"),
+				finished_at=now,
+			)
+		).rowcount
+		if updated:
+			if r["status"] == "done":
+				done += 1
+			else:
+				failed += 1
+	BatchJob = models.BatchJob
+	db.execute(update(BatchJob).where(BatchJob.id == job_id).values(done=BatchJob.done + done, failed=BatchJob.failed + failed))
+	db.commit()
+
+
+def finish_batch_job(db: Session, job_id: int, owner: str) -> bool:
+	BatchJob, BatchItem = models.BatchJob, models.BatchItem
+	pending = select(BatchItem.id).where(BatchItem.job_id == job_id, BatchItem.status == "pending").exists()
+	stmt = (
+		update(BatchJob)
+		.where(BatchJob.id == job_id, BatchJob.owner == owner, BatchJob.status == "running", ~pending)
+		.values(status="completed", finished_at=datetime.utcnow(), owner=None, lease_expires_at=None)
+	)
+	finished = db.execute(stmt).rowcount
+	db.commit()
+	return bool(finished)
+
+
+def cancel_batch_job(db: Session, job_id: int) -> Optional[models.BatchJob]:
+	BatchJob = models.BatchJob
+	db.execute(
+		update(BatchJob)
+		.where(BatchJob.id == job_id, BatchJob.status.in_(("queued", "running")))
+		.values(status="cancelled", finished_at=datetime.utcnow(), owner=None, lease_expires_at=None)
+	)
+	db.commit()
+	return get_batch_job(db, job_id)
+
+
+def list_batch_results(db: Session, job_id: int, after: int, limit: int):
+	# items after seq `after` in order, finished or not (the caller stops at the first pending one)
+	BatchItem = models.BatchItem
+	stmt = (
+		select(
+			BatchItem.seq,
+			BatchItem.ticket_id,
+			BatchItem.status,
+			BatchItem.answer,
+			BatchItem.confidence,
+			BatchItem.needs_escalation,
+			BatchItem.faq_ids,
+			BatchItem.error,
+		)
+		.where(BatchItem.job_id == job_id, BatchItem.seq > after)
+		.order_by(BatchItem.seq)
+		.limit(limit)
+	)
+	return list(db.execute(stmt))
+
+
 def _generate_external_id() -> str:
 	from secrets import token_urlsafe
 	return token_urlsafe(16)
@@ -1,4 +1,12 @@
-from sqlalchemy import create_engine
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+import asyncio
+import contextvars
+import threading
+import zlib
+
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from .config import settings
 
@@ -7,30 +15,176 @@ class Base(DeclarativeBase):
 	pass
 
 
-engine = create_engine(
-	settings.database_url,
-	connect_args={"check_same_thread": False} if settings.database_url.startswith("sqlite") else {},
-	pool_pre_ping=True,
-)
+def _is_memory_sqlite(url: str) -> bool:
+	return url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url
+
+
+def create_db_engine(url: str, sqlite_profile: str | None = None) -> Engine:
+	sqlite_profile = sqlite_profile or settings.sqlite_profile
+	kwargs: dict = {"pool_pre_ping": True}
+	if url.startswith("sqlite"):
+		kwargs["connect_args"] = {"check_same_thread": False}
+	if not _is_memory_sqlite(url):
+		kwargs.update(
+			pool_size=settings.db_pool_size,
+			max_overflow=settings.db_max_overflow,
+			pool_timeout=settings.db_pool_timeout,
+		)
+	eng = create_engine(url, **kwargs)
+	if url.startswith("sqlite") and sqlite_profile == "production":
+		event.listen(eng, "connect", _apply_sqlite_pragmas)
+	return eng
+
+
+def _apply_sqlite_pragmas(dbapi_conn, _record):
+	# WAL lets readers run alongside the writer, NORMAL sync skips the fsync per
+	# commit (still durable at checkpoints), busy_timeout waits for the lock
+	# instead of failing with "database is locked".
+	cur = dbapi_conn.cursor()
+	cur.execute("PRAGMA journal_mode=WAL")
+	cur.execute("PRAGMA synchronous=NORMAL")
+	cur.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+	cur.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+	cur.execute(f"PRAGMA cache_size={int(settings.sqlite_cache_size)}")
+	cur.execute("PRAGMA temp_store=MEMORY")
+	cur.close()
+
+
+engine = create_db_engine(settings.database_url)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 _initialized = False
+_init_lock = threading.Lock()
 
 
-def _ensure_tables_once():
-	global _initialized
-	if _initialized:
-		return
+def _schema_version() -> int:
+	# fingerprint of the declared tables, columns and indexes
+	parts = [
+		f"{t.name}:{','.join(c.name for c in t.columns)}:{','.join(sorted(i.name for i in t.indexes))}"
+		for t in Base.metadata.sorted_tables
+	]
+	return zlib.crc32("\n".join(parts).encode()) & 0x7FFFFFFF or 1
+
+
+def init_db():
 	# Import models here to avoid circular import at module load
 	from . import models  # noqa: F401
+	# SQLite stamps the schema it was migrated to in user_version, so a database
+	# that is already current costs one PRAGMA instead of inspecting every table
+	version = _schema_version() if engine.dialect.name == "sqlite" else None
+	if version is not None:
+		with engine.connect() as conn:
+			if conn.exec_driver_sql("PRAGMA user_version").scalar() == version:
+				return
 	Base.metadata.create_all(bind=engine)
-	_initialized = True
+	run_migrations()
+	if version is not None:
+		with engine.begin() as conn:
+			conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+
+
+def run_migrations():
+	# create_all only creates missing tables; nullable columns and indexes added
+	# to existing tables (e.g. an app.db from before they were declared) are
+	# created here. Idempotent.
+	inspector = inspect(engine)
+	for table in Base.metadata.sorted_tables:
+		existing = {c["name"] for c in inspector.get_columns(table.name)}
+		missing = [c for c in table.columns if c.name not in existing and c.nullable]
+		if missing:
+			with engine.begin() as conn:
+				for column in missing:
+					conn.execute(text(
+						f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+					))
+		for index in table.indexes:
+			index.create(bind=engine, checkfirst=True)
+
+
+def ensure_schema():
+	# Once per process, before the first session is used. With DB_AUTO_CREATE=false
+	# the schema is left to the deploy step (python -m app.database).
+	global _initialized
+	if _initialized:
+		return
+	with _init_lock:
+		if not _initialized:
+			if settings.db_auto_create:
+				init_db()
+			_initialized = True
 
 
 def get_db():
-	_ensure_tables_once()
+	ensure_schema()
 	db = SessionLocal()
 	try:
 		yield db
 	finally:
 		db.close()
+
+
+# Blocking SQLAlchemy work from async endpoints runs here instead of on the event
+# loop; the pool is bounded so a slow commit can't spawn unbounded threads.
+# Writes go through their own single-thread queue: SQLite has one writer at a
+# time anyway, and queueing in-process beats threads contending for the lock.
+_executor: Optional[ThreadPoolExecutor] = None
+_writer: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+	global _executor
+	if _executor is None:
+		_executor = ThreadPoolExecutor(max_workers=settings.db_threadpool_size, thread_name_prefix="db")
+	return _executor
+
+
+def _get_writer() -> ThreadPoolExecutor:
+	global _writer
+	if not settings.db_single_writer:
+		return _get_executor()
+	if _writer is None:
+		_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+	return _writer
+
+
+def _call_with_session(fn: Callable[..., Any], args: tuple, kwargs: dict) -> Any:
+	# fn's result is used after the session closes: ORM objects it returns must
+	# stay readable even if fn committed (no expiry, so no lazy reload when detached)
+	ensure_schema()
+	db = SessionLocal(expire_on_commit=False)
+	try:
+		return fn(db, *args, **kwargs)
+	finally:
+		db.close()
+
+
+async def run_db(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+	# fn(db, *args, **kwargs) on a fresh Session in a DB worker thread
+	loop = asyncio.get_running_loop()
+	ctx = contextvars.copy_context()
+	return await loop.run_in_executor(_get_executor(), ctx.run, _call_with_session, fn, args, kwargs)
+
+
+async def run_db_write(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+	# like run_db, but serialized through the single writer queue
+	loop = asyncio.get_running_loop()
+	ctx = contextvars.copy_context()
+	return await loop.run_in_executor(_get_writer(), ctx.run, _call_with_session, fn, args, kwargs)
+
+
+def shutdown_db() -> None:
+	global _executor, _writer
+	for pool in (_writer, _executor):
+		if pool is not None:
+			pool.shutdown(wait=True)
+	_executor = None
+	_writer = None
+
+
+if __name__ == "__main__":
+	# python -m app.database: create/migrate the schema ahead of time (deploy step).
+	# Run through the package module: as __main__ this file has a Base of its own
+	from app import database
+
+	database.init_db()
+	print(f"schema ready: {database.engine.url.render_as_string(hide_password=True)}")
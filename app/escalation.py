@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import List
+from typing import List, Optional
 
 from .config import settings
 
@@ -15,6 +15,14 @@ def build_escalation_message() -> str:
 	)
 
 
+def build_faq_only_answer(question: str, answer: str) -> str:
+	# stands in for the LLM answer when the service is overloaded
+	return (
+		"Our assistant is busy right now, so here is the closest answer from our FAQ.\n\n"
+		f"Q: {question}\nA: {answer}"
+	)
+
+
 def summarize_conversation(messages: List[dict]) -> str:
 	# Lightweight extractive summary: last user + assistant condensed
 	user_latest = next((m for m in reversed(messages) if m["role"] == "user"), None)
@@ -25,3 +33,17 @@ def summarize_conversation(messages: List[dict]) -> str:
 	if assistant_latest:
 		parts.append(f"Agent replied: {assistant_latest['content'][:200]}")
 	return " | ".join(parts) if parts else ""
+
+
+def summarize_incremental(previous: Optional[str], messages: List[dict], max_chars: int = 1200) -> str:
+	# Extends a previous summary with newer messages, one condensed line per
+	# message, dropping the oldest parts once it grows past max_chars
+	parts = previous.split(" | ") if previous else []
+	for m in messages:
+		if m["role"] == "user":
+			parts.append(f"User asked: {m['content'][:200]}")
+		elif m["role"] == "assistant":
+			parts.append(f"Agent replied: {m['content'][:200]}")
+	while len(parts) > 2 and len(" | ".join(parts)) > max_chars:
+		parts.pop(0)
+	return " | ".join(parts)
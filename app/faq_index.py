@@ -0,0 +1,242 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import sys
+import threading
+
+from .incremental_index import IncrementalRetriever, OpsLog, write_faqs
+from .index_store import load_retriever, source_digests
+from .config import settings
+
+
+# Process-wide BM25 index over the FAQ file plus the admin changes in the ops
+# log. Every change produces a new retriever snapshot that is swapped in with a
+# single reference assignment, so readers see either the old or the new index,
+# never a partially built one.
+class FAQIndex:
+	def __init__(
+		self,
+		path: str | Path,
+		reload_interval: float = 2.0,
+		index_path: str | Path | None = None,
+		ops_path: str | Path | None = None,
+		compact_threshold: int = 1000,
+	):
+		self.path = Path(path)
+		self.index_path = index_path
+		self.reload_interval = reload_interval
+		self.compact_threshold = compact_threshold
+		self.version = 0
+		self._retriever: Optional[IncrementalRetriever] = None
+		self._stat: Optional[Tuple[int, int]] = None
+		self._ops_stat: Optional[Tuple[int, int]] = None
+		self._file_digest: Optional[str] = None
+		self._digest: Optional[str] = None
+		self._ops = OpsLog(ops_path) if ops_path else None
+		self._lock = threading.Lock()
+		self._compact_lock = threading.Lock()
+		self._compacting = False
+		self._listeners: List[Callable[[int], None]] = []
+		self._task: Optional[asyncio.Task] = None
+
+	def get(self) -> IncrementalRetriever:
+		retriever = self._retriever
+		if retriever is None:
+			# not forced: a concurrent first load (e.g. the prewarm thread) is reused
+			self.reload()
+			retriever = self._retriever
+		return retriever
+
+	@property
+	def digest(self) -> Optional[str]:
+		return self._digest
+
+	def add_listener(self, callback: Callable[[int], None]) -> None:
+		self._listeners.append(callback)
+
+	def reload(self, force: bool = False) -> bool:
+		with self._lock:
+			if not force and self._compacting:
+				# the compaction is rewriting the file and swaps in its own index
+				return False
+			stat = self._stat_file()
+			# the ops log changes under us when another worker applies admin changes
+			ops_stat = self._ops.stat() if self._ops else None
+			if not force and self._retriever is not None and stat == self._stat and ops_stat == self._ops_stat:
+				return False
+			# the log before the file: a compaction elsewhere replaces the file, then
+			# drops the folded batches, so this never misses a batch (replaying one
+			# that is already in the file changes nothing)
+			batches = self._ops.read() if self._ops else []
+			# hashed in chunks, never held in memory whole
+			file_digest, crc = source_digests(self.path)
+			if not force and self._retriever is not None and file_digest == self._file_digest and ops_stat == self._ops_stat:
+				# touched but unchanged
+				self._stat = stat
+				return False
+			retriever = IncrementalRetriever(load_retriever(self.path, self.index_path, crc))
+			digest = file_digest
+			# replay admin changes not yet compacted into the file
+			for ops in batches:
+				retriever, _, _ = retriever.apply(ops)
+				digest = self._chain_digest(digest, ops)
+			# single reference swap: in-flight requests keep the retriever they already hold
+			self._retriever = retriever
+			self._stat = stat
+			self._ops_stat = ops_stat
+			self._file_digest = file_digest
+			self._digest = digest
+			self.version += 1
+			version = self.version
+		self._notify(version)
+		return True
+
+	def apply(self, ops: List[dict]) -> dict:
+		# Admin upserts/deletes: logged durably first, then visible to the next query
+		if self._ops is None:
+			raise RuntimeError("FAQ changes are disabled (no ops log path configured)")
+		self.get()
+		with self._lock:
+			retriever, upserted, deleted = self._retriever.apply(ops)
+			if retriever is not self._retriever:
+				before, after = self._ops.append(ops)
+				# if another worker appended since our last look, leave the stat stale
+				# so the watcher reloads and replays its batches too
+				self._ops_stat = after if before == self._ops_stat else None
+				self._retriever = retriever
+				self._digest = self._chain_digest(self._digest, ops)
+				self.version += 1
+			version = self.version
+			pending = retriever.changes
+		if upserted or deleted:
+			self._notify(version)
+		if self.compact_threshold > 0 and pending >= self.compact_threshold:
+			self.compact_in_background()
+		return {"version": version, "upserted": upserted, "deleted": deleted, **self.status()}
+
+	def status(self) -> dict:
+		retriever = self.get()
+		return {
+			"faqs": len(retriever),
+			"pending_changes": retriever.changes,
+			"compacting": self._compacting,
+		}
+
+	def compact(self) -> bool:
+		# Fold the ops log into the FAQ file and a freshly built base index.
+		# Queries and admin writes (from any worker) continue meanwhile. The batches
+		# to fold are read from the log itself, not this worker's snapshot, which
+		# may not have replayed other workers' latest batches yet. Afterwards only
+		# that prefix is dropped from the log; batches appended during the rebuild
+		# stay and are replayed on the new base.
+		if self._ops is None:
+			return False
+		self.get()
+		with self._compact_lock, self._ops.compacting():
+			with self._ops.locked():
+				folded = self._ops.read()
+			if not folded:
+				return False
+			with self._lock:
+				self._compacting = True
+			try:
+				# only compactions replace the file, and this one holds the lock
+				snapshot = IncrementalRetriever(load_retriever(self.path, self.index_path))
+				for ops in folded:
+					snapshot, _, _ = snapshot.apply(ops)
+				write_faqs(self.path, snapshot.faqs())
+				file_digest, crc = source_digests(self.path)
+				base = load_retriever(self.path, self.index_path, crc)
+				with self._lock:
+					with self._ops.locked():
+						# everything in the log was already seen here unless another
+						# worker appended since this worker last looked
+						in_sync = self._ops.stat() == self._ops_stat
+						tail = self._ops.drop_prefix(len(folded))
+						self._ops_stat = self._ops.stat()
+					retriever = IncrementalRetriever(base)
+					for ops in tail:
+						retriever, _, _ = retriever.apply(ops)
+					self._retriever = retriever
+					self._stat = self._stat_file()
+					self._file_digest = file_digest
+					if in_sync:
+						# same corpus, so version and digest stay; only the layout changes
+						version = None
+					else:
+						digest = self._file_digest
+						for ops in tail:
+							digest = self._chain_digest(digest, ops)
+						self._digest = digest
+						self.version += 1
+						version = self.version
+			finally:
+				with self._lock:
+					self._compacting = False
+		if version is not None:
+			self._notify(version)
+		return True
+
+	def compact_in_background(self) -> None:
+		if not self._compacting and not self._compact_lock.locked():
+			threading.Thread(target=self._compact_logged, name="faq-compaction", daemon=True).start()
+
+	def _compact_logged(self) -> None:
+		try:
+			self.compact()
+		except Exception as e:
+			# the ops log still holds every change; the next compaction retries
+			print(f"[FAQ compaction failed] {type(e).__name__}: {e}", file=sys.stderr)
+
+	@staticmethod
+	def _chain_digest(digest: Optional[str], ops: List[dict]) -> str:
+		body = (digest or "") + json.dumps(ops, sort_keys=True, ensure_ascii=False)
+		return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+	def _notify(self, version: int) -> None:
+		for callback in self._listeners:
+			callback(version)
+
+	def _stat_file(self) -> Tuple[int, int]:
+		st = self.path.stat()
+		return (st.st_mtime_ns, st.st_size)
+
+	async def watch(self) -> None:
+		while True:
+			await asyncio.sleep(self.reload_interval)
+			try:
+				await asyncio.to_thread(self.reload)
+			except Exception as e:
+				# keep serving the previous index until the file is readable again
+				print(f"[FAQ reload failed] {type(e).__name__}: {e}", file=sys.stderr)
+
+	def start(self) -> None:
+		self.get()
+		if self._task is None and self.reload_interval > 0:
+			self._task = asyncio.get_running_loop().create_task(self.watch())
+
+	async def stop(self) -> None:
+		if self._task is None:
+			return
+		self._task.cancel()
+		try:
+			await self._task
+		except asyncio.CancelledError:
+			pass
+		self._task = None
+
+
+faq_index = FAQIndex(
+	settings.faq_path,
+	reload_interval=settings.faq_reload_interval,
+	index_path=settings.faq_index_path or None,
+	ops_path=settings.faq_ops_path or None,
+	compact_threshold=settings.faq_compact_threshold,
+)
+
+
+def get_retriever() -> IncrementalRetriever:
+	return faq_index.get()
@@ -1,34 +1,138 @@
 from __future__ import annotations
+from array import array
 from dataclasses import dataclass
-from typing import Iterable, List
+from typing import Iterator, List, Sequence
 import json
+import mmap
 from pathlib import Path
 
+try:
+	import orjson  # type: ignore
+	_loads = orjson.loads
+except Exception:  # pragma: no cover
+	_loads = json.loads
 
-@dataclass
+
+@dataclass(slots=True)
 class FAQ:
 	id: str
 	question: str
 	answer: str
 
 
+class LazyFAQ:
+	# FAQ-shaped handle into a compact repository; the JSONL line is decoded on
+	# first attribute access, so only records that are actually returned (the
+	# top-k of a query) ever materialize their text.
+	__slots__ = ("_repo", "_i", "_faq")
+
+	def __init__(self, repo: "FAQRepository", i: int):
+		self._repo = repo
+		self._i = i
+		self._faq = None
+
+	def _load(self) -> FAQ:
+		if self._faq is None:
+			self._faq = self._repo._decode(self._i)
+		return self._faq
+
+	@property
+	def id(self) -> str:
+		return self._load().id
+
+	@property
+	def question(self) -> str:
+		return self._load().question
+
+	@property
+	def answer(self) -> str:
+		return self._load().answer
+
+	def __repr__(self) -> str:
+		return repr(self._load())
+
+
+class _CompactRecords(Sequence[FAQ]):
+	def __init__(self, repo: "FAQRepository"):
+		self._repo = repo
+
+	def __len__(self) -> int:
+		return len(self._repo._starts)
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [self[j] for j in range(*i.indices(len(self)))]
+		if i < 0:
+			i += len(self)
+		if not 0 <= i < len(self):
+			raise IndexError(i)
+		return LazyFAQ(self._repo, i)
+
+	def __iter__(self) -> Iterator[FAQ]:
+		# sequential scan (index build): decode each line once, keep nothing
+		for i in range(len(self)):
+			yield self._repo._decode(i)
+
+
 class FAQRepository:
-	def __init__(self, path: str | Path):
+	# compact=True keeps only the byte offset of each JSONL line (16 bytes per
+	# FAQ) over a read-only mapping of the file instead of every FAQ's text. The
+	# mapping pins the file that was loaded, so an atomic replace (compaction)
+	# doesn't shift the offsets under a live index.
+	def __init__(self, path: str | Path, compact: bool = False):
 		self.path = Path(path)
+		self.compact = compact
 		self._faqs: List[FAQ] = []
+		self._starts = array("q")
+		self._ends = array("q")
+		self._mm = None
 
-	def load(self) -> List[FAQ]:
+	def load(self) -> Sequence[FAQ]:
+		if self.compact:
+			# the lazy view: the index build decodes each line once, while scanning
+			self._load_offsets()
+			return self.records()
 		self._faqs.clear()
-		with self.path.open("r", encoding="utf-8") as f:
+		with self.path.open("rb") as f:
 			for line in f:
 				if not line.strip():
 					continue
-				obj = json.loads(line)
+				obj = _loads(line)
 				self._faqs.append(FAQ(id=obj["id"], question=obj["question"], answer=obj["answer"]))
 		return list(self._faqs)
 
-	def all(self) -> Iterable[FAQ]:
+	def _load_offsets(self) -> None:
+		starts, ends = array("q"), array("q")
+		with self.path.open("rb") as f:
+			size = f.seek(0, 2)
+			mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+		pos = 0
+		while mm is not None and pos < size:
+			end = mm.find(b"\n", pos)
+			if end < 0:
+				end = size
+			if mm[pos:end].strip():
+				starts.append(pos)
+				ends.append(end)
+			pos = end + 1
+		self._starts, self._ends, self._mm = starts, ends, mm
+
+	def _decode(self, i: int) -> FAQ:
+		obj = _loads(self._mm[self._starts[i]:self._ends[i]])
+		return FAQ(id=obj["id"], question=obj["question"], answer=obj["answer"])
+
+	def records(self) -> Sequence[FAQ]:
+		# the loaded FAQs without copying (lazy handles in compact mode)
+		if self.compact:
+			return _CompactRecords(self)
+		return self._faqs
+
+	def all(self) -> Sequence[FAQ]:
+		if self.compact:
+			return self.records()
 		return list(self._faqs)
 
 	def is_loaded(self) -> bool:
+		if self.compact:
+			return len(self._starts) > 0
 		return len(self._faqs) > 0
@@ -0,0 +1,335 @@
+from __future__ import annotations
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterator, List, Optional, Sequence, Tuple
+import itertools
+import json
+import math
+import os
+import time
+
+try:
+	import fcntl  # type: ignore
+except Exception:  # pragma: no cover - not available on Windows
+	fcntl = None  # type: ignore
+
+from .config import settings
+from .faq_loader import FAQ
+from .metrics import record_stage, timed
+from .retrieval_cache import retrieval_cache
+from .retriever import BM25FAQRetriever, RetrievedFAQ, _tokenize, _tokenize_query
+
+
+# every snapshot gets a new generation, which keys its retrieval cache entries
+_generations = itertools.count()
+
+
+class _BaseStats:
+	# Lookups over a base segment, computed once and shared by every snapshot on it
+	def __init__(self, base: BM25FAQRetriever):
+		self.ids: Dict[str, int] = {f.id: i for i, f in enumerate(base._faqs)}
+		self.total_len = sum(base._doc_len)
+
+
+class IncrementalRetriever:
+	# Immutable snapshot of the FAQ index: a built BM25 base segment plus the
+	# changes made since it was built. Upserted FAQs live in a small in-memory
+	# delta segment and replaced or deleted base documents are tombstoned. N,
+	# document frequencies and the average document length are adjusted for the
+	# changed documents only, and length norms are recomputed lazily when avgdl
+	# moves, so scores and ranking equal a full rebuild over the same corpus
+	# (base survivors in order, then delta documents in upsert order).
+	#
+	# apply() returns a new snapshot, so readers holding the old one are never
+	# affected; only the delta and tombstones are copied, never the base.
+	def __init__(
+		self,
+		base: BM25FAQRetriever,
+		stats: Optional[_BaseStats] = None,
+		dead: FrozenSet[int] = frozenset(),
+		dead_len: int = 0,
+		dead_df: Optional[Dict[int, int]] = None,
+		delta: Optional[Dict[str, Tuple[FAQ, Counter, int]]] = None,
+	):
+		if not base._built:
+			base.build()
+		self.base = base
+		self.generation = next(_generations)
+		self.k1 = base.k1
+		self.b = base.b
+		self._stats = stats
+		self._dead = dead
+		self._dead_len = dead_len
+		self._dead_df: Dict[int, int] = dead_df or {}
+		# faq id -> (faq, term frequencies, doc length), in upsert order
+		self._delta: Dict[str, Tuple[FAQ, Counter, int]] = delta or {}
+		self._base_n = len(base._faqs)
+		self._delta_faqs: List[FAQ] = []
+		# term -> [(doc index, tf, doc length)], delta documents numbered after the base
+		self._delta_postings: Dict[str, List[Tuple[int, int, int]]] = {}
+		for i, (faq, tfs, dl) in enumerate(self._delta.values()):
+			self._delta_faqs.append(faq)
+			for w, tf in tfs.items():
+				self._delta_postings.setdefault(w, []).append((self._base_n + i, tf, dl))
+		self._n_docs = self._base_n - len(dead) + len(self._delta)
+		if self.changes:
+			total_len = self._base_stats().total_len - dead_len + sum(dl for _, _, dl in self._delta.values())
+			self._avgdl = (total_len / self._n_docs) if self._n_docs else 0.0
+		else:
+			self._avgdl = base._avgdl
+		self._norms: Dict[int, float] = {}
+
+	@property
+	def changes(self) -> int:
+		return len(self._dead) + len(self._delta)
+
+	def __len__(self) -> int:
+		return self._n_docs
+
+	def _base_stats(self) -> _BaseStats:
+		if self._stats is None:
+			self._stats = _BaseStats(self.base)
+		return self._stats
+
+	def get_faq(self, faq_id: str) -> Optional[FAQ]:
+		entry = self._delta.get(faq_id)
+		if entry is not None:
+			return entry[0]
+		idx = self._base_stats().ids.get(faq_id)
+		if idx is None or idx in self._dead:
+			return None
+		return self.base._faqs[idx]
+
+	def faqs(self) -> Iterator[FAQ]:
+		# corpus order: what a compaction writes and a rebuild would index
+		dead = self._dead
+		for i in range(self._base_n):
+			if i not in dead:
+				yield self.base._faqs[i]
+		yield from self._delta_faqs
+
+	def apply(self, ops: List[dict]) -> Tuple["IncrementalRetriever", int, int]:
+		# ops: {"op": "upsert", "id", "question", "answer"} or {"op": "delete", "id"},
+		# applied in order. Returns (snapshot, upserted, deleted); upserting an
+		# unchanged FAQ or deleting an unknown id is a no-op, so replaying the
+		# ops log over an already compacted file changes nothing.
+		base = self.base
+		stats = self._base_stats()
+		dead = set(self._dead)
+		dead_df = dict(self._dead_df)
+		dead_len = self._dead_len
+		delta = dict(self._delta)
+		upserted = deleted = 0
+
+		def remove(faq_id: str) -> bool:
+			nonlocal dead_len
+			if delta.pop(faq_id, None) is not None:
+				return True
+			idx = stats.ids.get(faq_id)
+			if idx is None or idx in dead:
+				return False
+			dead.add(idx)
+			dead_len += base._doc_len[idx]
+			f = base._faqs[idx]
+			for w in set(_tokenize(f"{f.question} {f.answer}")):
+				tid = base._vocab.get(w)
+				dead_df[tid] = dead_df.get(tid, 0) + 1
+			return True
+
+		for op in ops:
+			if op["op"] == "delete":
+				deleted += remove(op["id"])
+				continue
+			faq = FAQ(id=op["id"], question=op["question"], answer=op["answer"])
+			current = delta[faq.id][0] if faq.id in delta else None
+			if current is None:
+				idx = stats.ids.get(faq.id)
+				if idx is not None and idx not in dead:
+					current = base._faqs[idx]
+			if current is not None and (current.question, current.answer) == (faq.question, faq.answer):
+				continue
+			remove(faq.id)
+			tokens = _tokenize(f"{faq.question} {faq.answer}")
+			delta[faq.id] = (faq, Counter(tokens), len(tokens))
+			upserted += 1
+
+		if not upserted and not deleted:
+			return self, 0, 0
+		snapshot = IncrementalRetriever(base, stats, frozenset(dead), dead_len, dead_df, delta)
+		return snapshot, upserted, deleted
+
+	def _norm(self, d: int, dl: int) -> float:
+		norm = self._norms.get(d)
+		if norm is None:
+			avgdl = self._avgdl or 1.0
+			norm = self._norms[d] = self.k1 * (1 - self.b + self.b * (dl / avgdl))
+		return norm
+
+	def _score_postings(self, qtokens: Sequence[str]) -> Dict[int, float]:
+		# Same accumulation as BM25FAQRetriever._score_postings, over live base
+		# postings followed by delta postings, with idf from the adjusted df.
+		base = self.base
+		ptr, docs, tfs, doc_len = base._post_ptr, base._post_docs, base._post_tfs, base._doc_len
+		base_norm = base._norm if self._avgdl == base._avgdl else None
+		dead, dead_df = self._dead, self._dead_df
+		N = self._n_docs or 1
+		k1p = self.k1 + 1
+		scores: Dict[int, float] = {}
+		for q in qtokens:
+			tid = base._vocab.get(q)
+			delta_posts = self._delta_postings.get(q, ())
+			base_df = (ptr[tid + 1] - ptr[tid] - dead_df.get(tid, 0)) if tid is not None else 0
+			df = base_df + len(delta_posts)
+			if df == 0:
+				continue
+			idf = math.log(1 + (N - df + 0.5) / (df + 0.5))
+			if base_df:
+				for j in range(ptr[tid], ptr[tid + 1]):
+					d = docs[j]
+					if d in dead:
+						continue
+					fq = tfs[j]
+					norm = base_norm[d] if base_norm is not None else self._norm(d, doc_len[d])
+					scores[d] = scores.get(d, 0.0) + idf * (fq * k1p) / ((fq + norm) or 1.0)
+			for d, fq, dl in delta_posts:
+				scores[d] = scores.get(d, 0.0) + idf * (fq * k1p) / ((fq + self._norm(d, dl)) or 1.0)
+		return scores
+
+	def _faq_at(self, i: int) -> FAQ:
+		return self.base._faqs[i] if i < self._base_n else self._delta_faqs[i - self._base_n]
+
+	def retrieve(self, query: str, top_k: int | None = None) -> List[RetrievedFAQ]:
+		if retrieval_cache is None:
+			return self._retrieve(query, top_k)
+		start = time.perf_counter()
+		k = top_k or settings.retriever_top_k
+		# results depend only on the tokens, so differently cased or punctuated
+		# phrasings of a question share one entry
+		key = (" ".join(_tokenize_query(query)), k)
+		cached = retrieval_cache.get(self.generation, key)
+		if cached is not None:
+			record_stage("retrieve", time.perf_counter() - start, "cache hit")
+			return [RetrievedFAQ(faq, score) for faq, score in cached]
+		results = self._retrieve(query, k)
+		retrieval_cache.set(self.generation, key, tuple((r.faq, r.score) for r in results))
+		return results
+
+	def _retrieve(self, query: str, top_k: int | None = None) -> List[RetrievedFAQ]:
+		if not self.changes:
+			return self.base.retrieve(query, top_k)
+		return self._retrieve_merged(query, top_k)
+
+	@timed("retrieve")
+	def _retrieve_merged(self, query: str, top_k: int | None = None) -> List[RetrievedFAQ]:
+		k = top_k or settings.retriever_top_k
+		scores = self._score_postings(_tokenize_query(query))
+		ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))[:k]
+		if len(ranked) < k:
+			dead = self._dead
+			for i in range(self._base_n + len(self._delta_faqs)):
+				if i not in scores and i not in dead:
+					ranked.append((i, 0.0))
+					if len(ranked) >= k:
+						break
+		return [RetrievedFAQ(self._faq_at(i), float(s)) for i, s in ranked]
+
+	def retrieve_many(self, queries: List[str], top_k: int | None = None) -> List[List[RetrievedFAQ]]:
+		if not self.changes:
+			return self.base.retrieve_many(queries, top_k)
+		# the batched NumPy path needs the flat base arrays; until the next
+		# compaction folds the delta in, score query by query
+		return [self._retrieve_merged(q, top_k) for q in queries]
+
+
+class OpsLog:
+	# Append-only JSONL of admin FAQ changes not yet compacted into the FAQ file,
+	# one batch per line. Each batch is fsynced before it is applied; a torn last
+	# line from a crash mid-write is ignored on replay. Writers serialize on a
+	# separate lock file rather than the log itself: a compaction replaces the
+	# log, and an appender that locked the old inode would write into the void.
+	def __init__(self, path: str | Path):
+		self.path = Path(path)
+		self._lock_path = self.path.with_name(self.path.name + ".lock")
+		self._compact_lock_path = self.path.with_name(self.path.name + ".compact.lock")
+
+	@staticmethod
+	@contextmanager
+	def _flock(path: Path):
+		with path.open("a") as f:
+			if fcntl is not None:
+				fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+			yield
+
+	def locked(self):
+		# exclusive across processes; held for appends and for truncation
+		return self._flock(self._lock_path)
+
+	def compacting(self):
+		# one compaction at a time across processes; appends continue meanwhile
+		return self._flock(self._compact_lock_path)
+
+	def stat(self) -> Optional[Tuple[int, int]]:
+		try:
+			st = self.path.stat()
+		except FileNotFoundError:
+			return None
+		return (st.st_mtime_ns, st.st_size)
+
+	def append(self, ops: List[dict]) -> Tuple[Optional[Tuple[int, int]], Tuple[int, int]]:
+		# Returns the file's (mtime_ns, size) just before and after this batch, so
+		# callers can tell whether another process appended since they last looked.
+		line = json.dumps({"ops": ops}, ensure_ascii=False) + "\n"
+		with self.locked(), self.path.open("a", encoding="utf-8") as f:
+			st = os.fstat(f.fileno())
+			before = (st.st_mtime_ns, st.st_size) if st.st_size else None
+			f.write(line)
+			f.flush()
+			os.fsync(f.fileno())
+			st = os.fstat(f.fileno())
+		return before, (st.st_mtime_ns, st.st_size)
+
+	def read(self) -> List[List[dict]]:
+		try:
+			lines = self.path.read_text(encoding="utf-8").splitlines()
+		except FileNotFoundError:
+			return []
+		batches = []
+		for n, line in enumerate(lines):
+			if not line.strip():
+				continue
+			try:
+				batches.append(json.loads(line)["ops"])
+			except (ValueError, KeyError):
+				if n == len(lines) - 1:
+					break
+				raise
+		return batches
+
+	def drop_prefix(self, n: int) -> List[List[dict]]:
+		# Remove the first n batches (folded into the FAQ file) and keep the rest,
+		# including batches appended since they were read. Call with locked() held.
+		rest = self.read()[n:]
+		self.rewrite(rest)
+		return rest
+
+	def rewrite(self, batches: List[List[dict]]) -> None:
+		tmp = self.path.with_name(self.path.name + ".tmp")
+		with tmp.open("w", encoding="utf-8") as f:
+			for ops in batches:
+				f.write(json.dumps({"ops": ops}, ensure_ascii=False) + "\n")
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp, self.path)
+
+
+def write_faqs(path: str | Path, faqs: Iterator[FAQ]) -> None:
+	# atomic replace of the FAQ JSONL (temp file, fsync, rename)
+	path = Path(path)
+	tmp = path.with_name(path.name + ".tmp")
+	with tmp.open("w", encoding="utf-8") as f:
+		for faq in faqs:
+			f.write(json.dumps({"id": faq.id, "question": faq.question, "answer": faq.answer}, ensure_ascii=False) + "\n")
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(tmp, path)
@@ -0,0 +1,258 @@
+from __future__ import annotations
+from array import array
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+from .config import settings
+from .faq_loader import FAQ, FAQRepository, _loads
+from .retriever import BM25FAQRetriever
+
+
+# Binary BM25 index, little endian, every section 8-byte aligned:
+#   header   magic, version, source crc32, n_docs, n_terms, n_postings, k1, b, avgdl
+#   table    (offset, length) for each section in _SECTIONS order
+# Terms are stored sorted by their UTF-8 bytes, so a term id is its rank and
+# lookups binary-search the mapped term table without building a dict. The
+# CRC-32 of the JSONL the index was built from (0 if unknown) lets a bundled
+# index be trusted after a checkout or deploy that doesn't preserve mtimes.
+MAGIC = b"FAQBM25\x00"
+VERSION = 1
+_HEADER = struct.Struct("<8sIIQQQddd")
+_SECTIONS = (
+	("term_offsets", "q"),
+	("term_blob", "B"),
+	("post_ptr", "q"),
+	("post_docs", "i"),
+	("post_tfs", "i"),
+	("idf", "d"),
+	("doc_len", "i"),
+	("norm", "d"),
+	("rec_offsets", "q"),
+	("rec_blob", "B"),
+)
+_TABLE = struct.Struct("<" + "QQ" * len(_SECTIONS))
+
+
+class IndexFormatError(ValueError):
+	pass
+
+
+class MappedVocab:
+	def __init__(self, offsets: Sequence[int], blob: memoryview):
+		self._offsets = offsets
+		self._blob = blob
+
+	def __len__(self) -> int:
+		return len(self._offsets) - 1
+
+	def __contains__(self, term: str) -> bool:
+		return self.get(term) is not None
+
+	def get(self, term: str, default: Optional[int] = None) -> Optional[int]:
+		key = term.encode("utf-8")
+		offs, blob = self._offsets, self._blob
+		lo, hi = 0, len(offs) - 1
+		while lo < hi:
+			mid = (lo + hi) // 2
+			cur = blob[offs[mid]:offs[mid + 1]].tobytes()
+			if cur == key:
+				return mid
+			if cur < key:
+				lo = mid + 1
+			else:
+				hi = mid
+		return default
+
+
+class MappedRecords(Sequence[FAQ]):
+	# FAQ records are decoded from the mapped file only when a result needs them
+	def __init__(self, offsets: Sequence[int], blob: memoryview):
+		self._offsets = offsets
+		self._blob = blob
+
+	def __len__(self) -> int:
+		return len(self._offsets) - 1
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [self[j] for j in range(*i.indices(len(self)))]
+		if i < 0:
+			i += len(self)
+		obj = _loads(self._blob[self._offsets[i]:self._offsets[i + 1]].tobytes())
+		return FAQ(id=obj["id"], question=obj["question"], answer=obj["answer"])
+
+
+def source_digests(path: str | Path) -> Tuple[str, int]:
+	# (sha256 hex, crc32) of the source JSONL in one pass of 1 MiB chunks
+	sha = hashlib.sha256()
+	crc = 0
+	with open(path, "rb") as f:
+		while chunk := f.read(1 << 20):
+			sha.update(chunk)
+			crc = zlib.crc32(chunk, crc)
+	# 0 is reserved for "unknown"
+	return sha.hexdigest(), crc or 1
+
+
+def source_crc(path: str | Path) -> int:
+	return source_digests(path)[1]
+
+
+def index_source_crc(path: str | Path) -> int:
+	with open(path, "rb") as f:
+		header = f.read(_HEADER.size)
+	if len(header) < _HEADER.size:
+		raise IndexFormatError(f"{path}: truncated index")
+	magic, version, crc = _HEADER.unpack_from(header, 0)[:3]
+	if magic != MAGIC or version != VERSION:
+		raise IndexFormatError(f"{path}: not a v{VERSION} FAQ index")
+	return crc
+
+
+def write_index(retriever: BM25FAQRetriever, path: str | Path, crc: int = 0) -> None:
+	if not retriever._built:
+		retriever.build()
+	order = sorted(retriever._vocab, key=lambda t: t.encode("utf-8"))
+	ptr, docs, tfs = retriever._post_ptr, retriever._post_docs, retriever._post_tfs
+
+	term_offsets = array("q", [0])
+	term_blob = bytearray()
+	post_ptr = array("q", [0])
+	post_docs = array("i")
+	post_tfs = array("i")
+	idf = array("d")
+	for term in order:
+		tid = retriever._vocab[term]
+		term_blob += term.encode("utf-8")
+		term_offsets.append(len(term_blob))
+		post_docs.extend(docs[ptr[tid]:ptr[tid + 1]])
+		post_tfs.extend(tfs[ptr[tid]:ptr[tid + 1]])
+		post_ptr.append(len(post_docs))
+		idf.append(retriever._idf[tid])
+
+	rec_offsets = array("q", [0])
+	rec_blob = bytearray()
+	for i in range(len(retriever._faqs)):
+		f = retriever._faqs[i]
+		rec_blob += json.dumps({"id": f.id, "question": f.question, "answer": f.answer}, ensure_ascii=False).encode("utf-8")
+		rec_offsets.append(len(rec_blob))
+
+	sections = {
+		"term_offsets": term_offsets.tobytes(),
+		"term_blob": bytes(term_blob),
+		"post_ptr": post_ptr.tobytes(),
+		"post_docs": post_docs.tobytes(),
+		"post_tfs": post_tfs.tobytes(),
+		"idf": idf.tobytes(),
+		"doc_len": retriever._doc_len.tobytes(),
+		"norm": array("d", retriever._norm).tobytes(),
+		"rec_offsets": rec_offsets.tobytes(),
+		"rec_blob": bytes(rec_blob),
+	}
+	header = _HEADER.pack(
+		MAGIC, VERSION, crc, len(retriever._faqs), len(order), len(post_docs),
+		retriever.k1, retriever.b, retriever._avgdl,
+	)
+	pos = _align(len(header) + _TABLE.size)
+	table: List[int] = []
+	for name, _ in _SECTIONS:
+		table += [pos, len(sections[name])]
+		pos = _align(pos + len(sections[name]))
+
+	path = Path(path)
+	tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+	with tmp.open("wb") as f:
+		f.write(header)
+		f.write(_TABLE.pack(*table))
+		for (name, _), off in zip(_SECTIONS, table[::2]):
+			f.write(b"\0" * (off - f.tell()))
+			f.write(sections[name])
+		f.flush()
+		os.fsync(f.fileno())
+	# atomic swap so concurrent readers map either the old or the new file
+	os.replace(tmp, path)
+
+
+def open_index(path: str | Path, repo: FAQRepository, k1: float = 1.5, b: float = 0.75) -> BM25FAQRetriever:
+	with open(path, "rb") as f:
+		mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	if len(mm) < _HEADER.size + _TABLE.size:
+		raise IndexFormatError(f"{path}: truncated index")
+	magic, version, _, n_docs, n_terms, n_postings, file_k1, file_b, avgdl = _HEADER.unpack_from(mm, 0)
+	if magic != MAGIC or version != VERSION:
+		raise IndexFormatError(f"{path}: not a v{VERSION} FAQ index")
+	table = _TABLE.unpack_from(mm, _HEADER.size)
+	buf = memoryview(mm)
+	views = {}
+	for i, (name, fmt) in enumerate(_SECTIONS):
+		off, length = table[2 * i], table[2 * i + 1]
+		if off + length > len(mm):
+			raise IndexFormatError(f"{path}: section {name} out of bounds")
+		views[name] = buf[off:off + length].cast(fmt)
+
+	retriever = BM25FAQRetriever(repo, k1=k1, b=b)
+	retriever._vocab = MappedVocab(views["term_offsets"], views["term_blob"])
+	retriever._faqs = MappedRecords(views["rec_offsets"], views["rec_blob"])
+	retriever._post_ptr = views["post_ptr"]
+	retriever._post_docs = views["post_docs"]
+	retriever._post_tfs = views["post_tfs"]
+	retriever._idf = views["idf"]
+	retriever._doc_len = views["doc_len"]
+	retriever._avgdl = avgdl
+	if (file_k1, file_b) == (k1, b):
+		retriever._norm = views["norm"]
+	else:
+		norm_avgdl = avgdl or 1.0
+		retriever._norm = array("d", (k1 * (1 - b + b * (dl / norm_avgdl)) for dl in views["doc_len"]))
+	retriever._built = n_docs > 0
+	retriever._mmap = mm
+	return retriever
+
+
+def load_retriever(source: str | Path, index_path: str | Path | None = None, crc: int = 0) -> BM25FAQRetriever:
+	# Map the prebuilt index when it was built from the current source JSONL
+	# (same CRC, or at least as new for indexes that don't record one), otherwise
+	# rebuild it; fall back to an in-memory index if it can't be written. A
+	# caller that already hashed the source passes its crc to skip another read.
+	source = Path(source)
+	repo = FAQRepository(source, compact=settings.faq_compact_store)
+	if index_path:
+		index_path = Path(index_path)
+		try:
+			crc = crc or source_crc(source)
+			built_from = index_source_crc(index_path)
+			if built_from == crc or (not built_from and index_path.stat().st_mtime_ns >= source.stat().st_mtime_ns):
+				return open_index(index_path, repo)
+		except (OSError, IndexFormatError):
+			pass
+	retriever = BM25FAQRetriever(repo)
+	retriever.build()
+	if index_path:
+		try:
+			write_index(retriever, index_path, crc)
+			return open_index(index_path, repo)
+		except OSError as e:
+			print(f"[FAQ index not persisted] {type(e).__name__}: {e}", file=sys.stderr)
+	return retriever
+
+
+def _align(n: int) -> int:
+	return (n + 7) & ~7
+
+
+if __name__ == "__main__":
+	# python -m app.index_store [data/faqs.jsonl] [data/faqs.bm25]
+	src = sys.argv[1] if len(sys.argv) > 1 else settings.faq_path
+	dst = sys.argv[2] if len(sys.argv) > 2 else (settings.faq_index_path or f"{src}.bm25")
+	crc = source_crc(src)
+	built = BM25FAQRetriever(FAQRepository(src))
+	built.build()
+	write_index(built, dst, crc)
+	print(f"wrote {dst}: {len(built._faqs)} docs, {len(built._vocab)} terms, {len(built._post_docs)} postings")
@@ -1,19 +1,31 @@
 from __future__ import annotations
-from typing import List
+from contextlib import aclosing
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import functools
+import hashlib
+import importlib.util
+import json
 import os
+import re
 import sys
 
-import httpx
-
+from .admission import llm_admission
 from .config import settings
+from .metrics import LLM_FALLBACKS, record_llm_attempt
+from .provider_health import CircuitBreaker, make_breaker
+from .singleflight import SingleFlight
+
+if TYPE_CHECKING:
+	import httpx
 
-try:
-	from huggingface_hub import InferenceClient  # type: ignore
-except Exception:  # pragma: no cover
-	InferenceClient = None  # type: ignore
 
+# httpx only negotiates HTTP/2 when the optional h2 package is installed
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
 
-HF_API_BASE = "https://api-inference.huggingface.co/models"
+MOCK_PREFIX = "[Mock AI]"
+# cancel message for attempts still running when a turn's deadline expires
+_DEADLINE_EXPIRED = "llm deadline expired"
 FALLBACK_MODELS = [
 	"huggingfaceh4/zephyr-7b-beta",
 	"tinyllama/tinyllama-1.1b-chat-v1.0",
@@ -30,36 +42,262 @@ class LLMClient:
 		# HF fallback
 		self._hf_api_key = settings.hf_api_key or os.getenv("HUGGINGFACE_API_KEY")
 		self._hf_model = (settings.hf_model_name or os.getenv("HF_MODEL_NAME") or "").strip().lower()
-		self._hf_client = None
-		if InferenceClient is not None and self._hf_model:
-			self._hf_client = InferenceClient(model=self._hf_model, token=self._hf_api_key)
+		self._hf_base = settings.hf_api_base.rstrip("/")
+
+		self._pools: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+		self._inflight = SingleFlight()
+		self._breakers: Dict[str, CircuitBreaker] = {}
+		# chat()/chat_stream() calls in progress, so background work can tell when the providers are idle
+		self.active = 0
+
+	def _client(self) -> httpx.AsyncClient:
+		# One keep-alive pool per event loop; connections cannot be shared across loops.
+		# httpx is imported with the first pool rather than at startup (cold starts)
+		loop = asyncio.get_running_loop()
+		client = self._pools.get(loop)
+		if client is None or client.is_closed:
+			import httpx
 
-	async def chat(self, messages: List[dict]) -> str:
-		# 1) OpenRouter (OpenAI-compatible)
+			# the pools of loops that are no longer running are closed first
+			for other in [l for l in self._pools if l is not loop and not l.is_running()]:
+				_close_pool(other, self._pools.pop(other))
+			client = self._pools[loop] = httpx.AsyncClient(
+				timeout=httpx.Timeout(settings.llm_timeout, connect=settings.llm_connect_timeout),
+				limits=httpx.Limits(
+					max_connections=settings.llm_max_connections,
+					max_keepalive_connections=settings.llm_max_keepalive_connections,
+					keepalive_expiry=settings.llm_keepalive_expiry,
+				),
+				http2=settings.llm_http2 and _HTTP2_AVAILABLE,
+			)
+		return client
+
+	async def aclose(self) -> None:
+		# every pool, each on its own loop
+		loop = asyncio.get_running_loop()
+		pools, self._pools = self._pools, {}
+		for pool_loop, client in pools.items():
+			if pool_loop is loop:
+				await client.aclose()
+			else:
+				_close_pool(pool_loop, client)
+
+	async def chat(
+		self,
+		messages: List[dict],
+		queue_timeout: Optional[float] = None,
+		cached: Optional[Callable[[], str | None]] = None,
+	) -> str:
+		# Each upstream call takes an LLM admission slot, waiting at most
+		# queue_timeout (None: in the background queue) or raising Overloaded.
+		# cached() is asked again once a call that had to queue is admitted, in
+		# case the answer was stored meanwhile.
+		self.active += 1
 		try:
-			text = await self._openrouter_chat(messages)
-			if text:
-				return text
-		except Exception as e:
-			print(f"[OpenRouter failed] {type(e).__name__}: {e}", file=sys.stderr)
+			return await self._chat(messages, queue_timeout, cached)
+		finally:
+			self.active -= 1
 
-		# 2) HF models endpoint with fallbacks
-		prompt = self._to_text_prompt(messages)
-		models_to_try = [m for m in [self._hf_model] + FALLBACK_MODELS if m]
-		for model_name in models_to_try:
-			try:
-				text = await self._call_hf_inference_api(prompt, model_name)
+	async def _chat(self, messages: List[dict], queue_timeout: Optional[float], cached) -> str:
+		if not settings.llm_coalesce:
+			return await self._chat_uncoalesced(messages, queue_timeout, cached)
+		# identical concurrent prompts share one upstream call (and one admission
+		# slot); callers only coalesce with others of the same admission priority
+		try:
+			return await self._inflight.do(
+				(self._prompt_key(messages), queue_timeout),
+				lambda: self._chat_uncoalesced(messages, queue_timeout, cached),
+				timeout=settings.llm_coalesce_wait,
+			)
+		except asyncio.TimeoutError:
+			print(f"[LLM call exceeded {settings.llm_coalesce_wait}s coalesced wait]", file=sys.stderr)
+			return self._mock_reply(messages)
+
+	def _prompt_key(self, messages: List[dict]) -> str:
+		body = json.dumps(
+			[self._or_model, self._hf_model, [[m.get("role", "user"), m.get("content", "")] for m in messages]],
+			ensure_ascii=False,
+		)
+		return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+	async def _chat_uncoalesced(self, messages: List[dict], queue_timeout: Optional[float], cached) -> str:
+		async with llm_admission.slot(queue_timeout) as queued:
+			if queued and cached is not None:
+				text = cached()
 				if text:
-					return text.strip()
-			except Exception as e:
-				print(f"[HF models endpoint failed:{model_name}] {type(e).__name__}: {e}", file=sys.stderr)
+					return text
+			# 1) OpenRouter (OpenAI-compatible), 2) HF models endpoint with fallbacks
+			attempts = []
+			if self._or_model:
+				attempts.append(("openrouter", lambda: self._openrouter_chat(messages)))
+			attempts += self._hf_attempts(messages)
+			text = await self._route(attempts)
+		if text:
+			return text
 
 		# 3) Mock
 		return self._mock_reply(messages)
 
-	async def _openrouter_chat(self, messages: List[dict]) -> str | None:
-		if not self._or_model:
+	async def chat_stream(self, messages: List[dict], status: Optional[dict] = None) -> AsyncIterator[str]:
+		# status["complete"] is set once the reply has been streamed in full; it
+		# stays False when the provider failed mid-stream and the reply is partial
+		if status is None:
+			status = {}
+		status["complete"] = False
+		self.active += 1
+		try:
+			async with aclosing(self._chat_stream(messages, status)) as stream:
+				async for delta in stream:
+					yield delta
+		finally:
+			self.active -= 1
+
+	async def _chat_stream(self, messages: List[dict], status: dict) -> AsyncIterator[str]:
+		# Same provider order as chat(); only OpenRouter streams natively, the
+		# HF fallback is yielded as one chunk and the mock reply word by word.
+		started = False
+		breaker = self._breaker("openrouter")
+		if self._or_model and breaker.allow():
+			loop = asyncio.get_running_loop()
+			start = loop.time()
+			stream = self._openrouter_stream(messages)
+			try:
+				# the deadline bounds time to first token; the rest streams as it comes
+				first = await asyncio.wait_for(_first_token(stream), settings.llm_deadline)
+				breaker.record(first is not None, loop.time() - start)
+				record_llm_attempt("openrouter", "ok" if first is not None else "empty", loop.time() - start)
+				if first is not None:
+					started = True
+					yield first
+					async for delta in stream:
+						yield delta
+					status["complete"] = True
+			except Exception as e:
+				if not started:
+					breaker.record(False, loop.time() - start)
+					record_llm_attempt("openrouter", "error", loop.time() - start)
+				print(f"[OpenRouter stream failed] {type(e).__name__}: {e}", file=sys.stderr)
+			finally:
+				breaker.release()
+				await stream.aclose()
+		if started:
+			# tokens already went out; a partial answer beats restarting on another provider
+			return
+
+		text = await self._route(self._hf_attempts(messages), primary="openrouter" if self._or_model else None)
+		if text:
+			yield text
+			status["complete"] = True
+			return
+
+		for word in re.findall(r"\S+\s*", self._mock_reply(messages)):
+			yield word
+			await asyncio.sleep(0)
+		status["complete"] = True
+
+	def _hf_attempts(self, messages: List[dict]) -> List[Tuple[str, Callable[[], Awaitable[str | None]]]]:
+		prompt = self._to_text_prompt(messages)
+		models_to_try = list(dict.fromkeys(m for m in [self._hf_model] + FALLBACK_MODELS if m))
+		return [(f"hf:{m}", functools.partial(self._call_hf_inference_api, prompt, m)) for m in models_to_try]
+
+	def _breaker(self, name: str) -> CircuitBreaker:
+		breaker = self._breakers.get(name)
+		if breaker is None:
+			breaker = self._breakers[name] = make_breaker(name)
+		return breaker
+
+	def provider_health(self) -> List[dict]:
+		return [b.snapshot() for b in self._breakers.values()]
+
+	async def _attempt(self, name: str, call: Callable[[], Awaitable[str | None]], deadline: float) -> str | None:
+		breaker = self._breaker(name)
+		loop = asyncio.get_running_loop()
+		start = loop.time()
+		try:
+			text = await asyncio.wait_for(call(), max(0.0, deadline - start))
+		except asyncio.CancelledError as e:
+			if e.args and e.args[0] == _DEADLINE_EXPIRED:
+				# still running when the turn's deadline passed: a hung provider fails
+				breaker.record(False, loop.time() - start)
+				record_llm_attempt(name, "timeout", loop.time() - start)
+				print(f"[{name} failed] no answer within the deadline", file=sys.stderr)
+				raise
+			# lost a hedge race or the turn was abandoned: no verdict on the provider
+			breaker.release()
+			record_llm_attempt(name, "cancelled", loop.time() - start)
+			raise
+		except Exception as e:
+			breaker.record(False, loop.time() - start)
+			record_llm_attempt(name, "timeout" if isinstance(e, asyncio.TimeoutError) else "error", loop.time() - start)
+			print(f"[{name} failed] {type(e).__name__}: {e}", file=sys.stderr)
 			return None
+		breaker.record(bool(text), loop.time() - start)
+		record_llm_attempt(name, "ok" if text else "empty", loop.time() - start)
+		return text.strip() if text else None
+
+	async def _route(
+		self,
+		attempts: List[Tuple[str, Callable[[], Awaitable[str | None]]]],
+		primary: Optional[str] = None,
+	) -> str | None:
+		# Walk the providers in priority order within one overall deadline, skipping
+		# those whose breaker is open. With hedging on, when the running provider is
+		# slower than its own p95 the next one is started too and the first
+		# non-empty answer wins. An answer from anything but `primary` (default: the
+		# first attempt) counts as a fallback.
+		primary = primary or (attempts[0][0] if attempts else None)
+		loop = asyncio.get_running_loop()
+		deadline = loop.time() + settings.llm_deadline
+		waiting = list(attempts)
+		running: Dict[asyncio.Task, str] = {}
+		expired = False
+
+		def launch() -> bool:
+			while waiting:
+				name, call = waiting.pop(0)
+				if self._breaker(name).allow():
+					running[loop.create_task(self._attempt(name, call, deadline))] = name
+					return True
+			return False
+
+		try:
+			launch()
+			while running:
+				timeout = deadline - loop.time()
+				if timeout <= 0:
+					expired = True
+					break
+				newest = list(running.values())[-1]
+				if settings.llm_hedge and waiting:
+					timeout = min(timeout, self._hedge_delay(newest))
+				done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+				if not done:
+					if settings.llm_hedge:
+						launch()
+					continue
+				for task in done:
+					name = running.pop(task)
+					text = task.result()
+					if text:
+						if name != primary:
+							LLM_FALLBACKS.inc(provider=name)
+						return text
+				# replace the failed attempt; with hedging the others keep running
+				if not running or settings.llm_hedge:
+					launch()
+		finally:
+			# attempts cut off by the deadline are failures, others are just abandoned
+			for task in running:
+				task.cancel(_DEADLINE_EXPIRED if expired else None)
+		return None
+
+	def _hedge_delay(self, name: str) -> float:
+		p95 = self._breaker(name).latency_p95()
+		if p95 is None:
+			return settings.llm_hedge_default_delay
+		return max(settings.llm_hedge_min_delay, p95)
+
+	def _openrouter_request(self, messages: List[dict]) -> tuple[str, dict, dict]:
 		url = f"{self._or_base}/chat/completions"
 		headers = {
 			"Authorization": f"Bearer {self._or_api_key}" if self._or_api_key else "",
@@ -73,17 +311,46 @@ class LLMClient:
 			"temperature": 0.2,
 			"max_tokens": 400,
 		}
-		async with httpx.AsyncClient(timeout=60) as client:
-			resp = await client.post(url, headers=headers, json=payload)
-			if resp.status_code == 200:
-				j = resp.json()
-				return (j["choices"][0]["message"]["content"] or "").strip()
-			# surface error
-			try:
-				err = resp.json()
-				raise RuntimeError(f"{resp.status_code}: {err}")
-			except Exception:
-				raise RuntimeError(f"{resp.status_code}: {resp.text}")
+		return url, headers, payload
+
+	async def _openrouter_stream(self, messages: List[dict]) -> AsyncIterator[str]:
+		if not self._or_model:
+			return
+		url, headers, payload = self._openrouter_request(messages)
+		payload["stream"] = True
+		async with self._client().stream("POST", url, headers=headers, json=payload) as resp:
+			if resp.status_code != 200:
+				body = await resp.aread()
+				raise RuntimeError(f"{resp.status_code}: {body.decode('utf-8', errors='replace')}")
+			async for line in resp.aiter_lines():
+				# SSE: skip comments/keep-alives, stop at the [DONE] sentinel
+				if not line.startswith("data:"):
+					continue
+				data = line[5:].strip()
+				if data == "[DONE]":
+					break
+				chunk = json.loads(data)
+				if "error" in chunk:
+					raise RuntimeError(str(chunk["error"]))
+				choices = chunk.get("choices") or [{}]
+				delta = (choices[0].get("delta") or {}).get("content")
+				if delta:
+					yield delta
+
+	async def _openrouter_chat(self, messages: List[dict]) -> str | None:
+		if not self._or_model:
+			return None
+		url, headers, payload = self._openrouter_request(messages)
+		resp = await self._client().post(url, headers=headers, json=payload)
+		if resp.status_code == 200:
+			j = resp.json()
+			return (j["choices"][0]["message"]["content"] or "").strip()
+		# surface error
+		try:
+			err = resp.json()
+			raise RuntimeError(f"{resp.status_code}: {err}")
+		except Exception:
+			raise RuntimeError(f"{resp.status_code}: {resp.text}")
 
 	async def _call_hf_inference_api(self, prompt: str, model_name: str) -> str | None:
 		model_name = (model_name or "").strip().lower()
@@ -98,25 +365,24 @@ class LLMClient:
 				"return_full_text": False,
 			},
 		}
-		url = f"{HF_API_BASE}/{model_name}"
-		async with httpx.AsyncClient(timeout=60) as client:
-			resp = await client.post(url, headers=headers, json=payload)
-			if resp.status_code == 200:
-				data = resp.json()
-				if isinstance(data, list) and data:
-					item = data[0]
-					if isinstance(item, dict):
-						return item.get("generated_text") or item.get("summary_text") or ""
-					return str(item)
-				if isinstance(data, dict):
-					return data.get("generated_text") or data.get("summary_text") or data.get("text") or ""
-				if isinstance(data, str):
-					return data
-			try:
-				err = resp.json()
-				raise RuntimeError(f"{resp.status_code}: {err}")
-			except Exception:
-				raise RuntimeError(f"{resp.status_code}: {resp.text}")
+		url = f"{self._hf_base}/{model_name}"
+		resp = await self._client().post(url, headers=headers, json=payload)
+		if resp.status_code == 200:
+			data = resp.json()
+			if isinstance(data, list) and data:
+				item = data[0]
+				if isinstance(item, dict):
+					return item.get("generated_text") or item.get("summary_text") or ""
+				return str(item)
+			if isinstance(data, dict):
+				return data.get("generated_text") or data.get("summary_text") or data.get("text") or ""
+			if isinstance(data, str):
+				return data
+		try:
+			err = resp.json()
+			raise RuntimeError(f"{resp.status_code}: {err}")
+		except Exception:
+			raise RuntimeError(f"{resp.status_code}: {resp.text}")
 
 	def _to_text_prompt(self, messages: List[dict]) -> str:
 		lines: List[str] = [
@@ -131,5 +397,37 @@ class LLMClient:
 		return "\n".join(lines)
 
 	def _mock_reply(self, messages: List[dict]) -> str:
+		LLM_FALLBACKS.inc(provider="mock")
 		last_user = next((m for m in reversed(messages) if m.get("role") == "user"), {"content": ""})
-		return f"[Mock AI] I understand your question: '{last_user['content']}'. Here is a helpful answer based on our FAQs."
+		return f"{MOCK_PREFIX} I understand your question: '{last_user['content']}'. Here is a helpful answer based on our FAQs."
+
+
+async def _first_token(stream: AsyncIterator[str]) -> str | None:
+	# skip whitespace-only deltas so an empty completion counts as no answer
+	async for delta in stream:
+		if delta.strip():
+			return delta
+	return None
+
+
+def _close_pool(loop: asyncio.AbstractEventLoop, client: httpx.AsyncClient) -> None:
+	# A pool's connections belong to its loop, so it is closed there: now if that
+	# loop runs in another thread, else when it next runs. Nothing runs on a
+	# closed loop any more; dropping the client is all that is left to do.
+	if not client.is_closed and not loop.is_closed():
+		asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+
+
+def is_mock_reply(text: str) -> bool:
+	return text.startswith(MOCK_PREFIX)
+
+
+_shared_client: Optional[LLMClient] = None
+
+
+def get_llm_client() -> LLMClient:
+	# Process-wide client so the HTTP pool (and its keep-alive connections) is reused
+	global _shared_client
+	if _shared_client is None:
+		_shared_client = LLMClient()
+	return _shared_client
@@ -1,13 +1,56 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from pathlib import Path
+from sqlalchemy.orm import configure_mappers
+import threading
 
 from .config import settings
-from .database import engine, Base
+from .database import ensure_schema, shutdown_db
+from .faq_index import faq_index
+from .llm import get_llm_client
+from .metrics import ServerTimingMiddleware, registry
 from .routers import router as api_router
+from .summarizer import summary_worker
+from .admin import router as admin_router
+from .batch import batch_runner, router as batch_router
+from .startup_profile import step
 
-app = FastAPI(title=settings.app_name)
+
+def _prepare() -> None:
+	with step("schema"):
+		ensure_schema()
+		configure_mappers()
+	with step("faq index"):
+		faq_index.get()
+
+
+def prewarm() -> threading.Thread:
+	# Serverless entry points get no lifespan events: prepare the schema and the
+	# FAQ index in the background right after import, so the first request finds
+	# them ready (or waits on their locks) instead of doing the work itself
+	thread = threading.Thread(target=_prepare, name="prewarm", daemon=True)
+	thread.start()
+	return thread
+
+
+# Create tables and build the FAQ index on startup; stop background work, release pooled connections and DB threads on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+	_prepare()
+	faq_index.start()
+	summary_worker.start()
+	batch_runner.start()
+	yield
+	await batch_runner.stop()
+	await summary_worker.stop()
+	await faq_index.stop()
+	await get_llm_client().aclose()
+	shutdown_db()
+
+
+app = FastAPI(title=settings.app_name, lifespan=lifespan)
 
 app.add_middleware(
 	CORSMiddleware,
@@ -15,14 +58,13 @@ app.add_middleware(
 	allow_credentials=True,
 	allow_methods=["*"],
 	allow_headers=["*"],
+	expose_headers=["Server-Timing", "X-Prompt-Tokens", "X-Prev-Cursor", "X-Next-Cursor", "X-Degraded", "Retry-After"],
 )
-
-# Create tables on startup
-@app.on_event("startup")
-async def on_startup():
-	Base.metadata.create_all(bind=engine)
+app.add_middleware(ServerTimingMiddleware)
 
 app.include_router(api_router)
+app.include_router(admin_router)
+app.include_router(batch_router)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -31,6 +73,12 @@ async def index():
 	return index_path.read_text(encoding="utf-8")
 
 
+# Prometheus text exposition format
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+	return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/health")
 async def health():
 	return {"status": "ok", "app": settings.app_name}
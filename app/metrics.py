@@ -0,0 +1,256 @@
+from __future__ import annotations
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import functools
+import re
+import threading
+import time
+
+from .config import settings
+
+
+# Latency buckets in seconds, from sub-millisecond retrieval up to slow LLM calls
+DEFAULT_BUCKETS = (
+	0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _escape(value: str) -> str:
+	return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+	parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+	if extra:
+		parts.append(extra)
+	return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+	def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+		self.name = name
+		self.help = help
+		self.labelnames = tuple(labelnames)
+		self._values: Dict[Tuple[str, ...], float] = {}
+		self._lock = threading.Lock()
+
+	def inc(self, amount: float = 1.0, **labels: str) -> None:
+		key = tuple(str(labels[n]) for n in self.labelnames)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0.0) + amount
+
+	def value(self, **labels: str) -> float:
+		return self._values.get(tuple(str(labels[n]) for n in self.labelnames), 0.0)
+
+	def render(self) -> List[str]:
+		lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+		with self._lock:
+			items = sorted(self._values.items())
+		for key, value in items:
+			lines.append(f"{self.name}{_labels(self.labelnames, key)} {value:g}")
+		return lines
+
+
+class Histogram:
+	# Cumulative buckets are derived at render time; observe() only bumps one slot
+	def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+		self.name = name
+		self.help = help
+		self.labelnames = tuple(labelnames)
+		self.buckets = tuple(sorted(buckets))
+		self._series: Dict[Tuple[str, ...], list] = {}  # key -> [bucket counts..., +Inf count, sum]
+		self._lock = threading.Lock()
+
+	def observe(self, value: float, **labels: str) -> None:
+		key = tuple(str(labels[n]) for n in self.labelnames)
+		slot = bisect_left(self.buckets, value)
+		with self._lock:
+			series = self._series.get(key)
+			if series is None:
+				series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+			series[slot] += 1
+			series[-1] += value
+
+	def count(self, **labels: str) -> int:
+		series = self._series.get(tuple(str(labels[n]) for n in self.labelnames))
+		return sum(series[:-1]) if series else 0
+
+	def render(self) -> List[str]:
+		lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+		with self._lock:
+			items = sorted((k, list(v)) for k, v in self._series.items())
+		for key, series in items:
+			cumulative = 0
+			for bound, n in zip(self.buckets, series):
+				cumulative += n
+				le = f'le="{bound:g}"'
+				lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+			cumulative += series[len(self.buckets)]
+			le = 'le="+Inf"'
+			lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+			lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {series[-1]:.6f}")
+			lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+		return lines
+
+
+class Gauge:
+	# Value read from a callback at scrape time (sizes of in-process structures)
+	def __init__(self, name: str, help: str, fn: Callable[[], float]):
+		self.name = name
+		self.help = help
+		self.fn = fn
+
+	def render(self) -> List[str]:
+		return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.fn():g}"]
+
+
+class Registry:
+	def __init__(self):
+		self._metrics: List = []
+
+	def register(self, metric):
+		self._metrics.append(metric)
+		return metric
+
+	def render(self) -> str:
+		lines: List[str] = []
+		for metric in self._metrics:
+			lines += metric.render()
+		return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+	"chat_stage_seconds", "Time spent per stage of a chat turn (db.*, retrieve, prompt, cache, llm)", ["stage"],
+))
+HTTP_SECONDS = registry.register(Histogram(
+	"http_request_duration_seconds", "HTTP request duration including streamed bodies", ["method", "route", "status"],
+))
+LLM_PROVIDER_SECONDS = registry.register(Histogram(
+	"llm_provider_seconds", "Duration of each LLM provider attempt", ["provider", "outcome"],
+))
+LLM_FALLBACKS = registry.register(Counter(
+	"llm_fallbacks_total", "Turns answered by a provider other than the first in the chain (mock = no provider answered)", ["provider"],
+))
+CACHE_REQUESTS = registry.register(Counter(
+	"answer_cache_requests_total", "Answer cache lookups", ["result"],
+))
+RETRIEVAL_CACHE_REQUESTS = registry.register(Counter(
+	"retrieval_cache_requests_total", "Retrieval result cache lookups", ["result"],
+))
+SUMMARY_JOBS = registry.register(Counter(
+	"summary_jobs_total", "Background session summary jobs (written, unchanged, stale, coalesced, dropped, error)", ["result"],
+))
+LLM_SHED = registry.register(Counter(
+	"llm_admission_shed_total", "Chat turns not admitted to the LLM stage", ["reason", "action"],
+))
+RATE_LIMITED = registry.register(Counter(
+	"chat_rate_limited_total", "Chat requests rejected by a rate limit", ["scope"],
+))
+ESCALATIONS = registry.register(Counter(
+	"chat_escalations_total", "Assistant replies that suggested escalating to a human",
+))
+
+
+# Stage timings of the current request, for the Server-Timing header. The list
+# is shared by reference, so entries recorded in DB worker threads (run_db copies
+# the context) and in LLM tasks land in the same request.
+_request_timings: ContextVar[Optional[List[Tuple[str, float, str]]]] = ContextVar("request_timings", default=None)
+
+
+def note_timing(name: str, seconds: float, desc: str = "") -> None:
+	# Server-Timing entry only (no histogram)
+	timings = _request_timings.get()
+	if timings is not None:
+		timings.append((name, seconds, desc))
+
+
+def record_stage(stage: str, seconds: float, desc: str = "") -> None:
+	if not settings.metrics_enabled:
+		return
+	STAGE_SECONDS.observe(seconds, stage=stage)
+	note_timing(stage, seconds, desc)
+
+
+def record_llm_attempt(provider: str, outcome: str, seconds: float) -> None:
+	if not settings.metrics_enabled:
+		return
+	LLM_PROVIDER_SECONDS.observe(seconds, provider=provider, outcome=outcome)
+	note_timing("llm.attempt", seconds, f"{provider} {outcome}")
+
+
+@contextmanager
+def timer(stage: str, desc: str = "") -> Iterator[None]:
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		record_stage(stage, time.perf_counter() - start, desc)
+
+
+def timed(stage: str):
+	def decorator(fn):
+		@functools.wraps(fn)
+		def wrapper(*args, **kwargs):
+			start = time.perf_counter()
+			try:
+				return fn(*args, **kwargs)
+			finally:
+				record_stage(stage, time.perf_counter() - start)
+		return wrapper
+	return decorator
+
+
+_TOKEN_RE = re.compile(r"[^A-Za-z0-9!#$%&'*+\-.^_`|~]")
+
+
+def server_timing_header(timings: List[Tuple[str, float, str]], total: float) -> str:
+	parts = []
+	for stage, seconds, desc in timings:
+		part = f"{_TOKEN_RE.sub('_', stage)};dur={seconds * 1000.0:.2f}"
+		if desc:
+			part += f';desc="{_escape(desc)}"'
+		parts.append(part)
+	parts.append(f"total;dur={total * 1000.0:.2f}")
+	return ", ".join(parts)
+
+
+class ServerTimingMiddleware:
+	# Plain ASGI middleware (no BaseHTTPMiddleware) so streaming responses pass
+	# through untouched. Stages finished before the response starts go into the
+	# Server-Timing header; everything feeds the histograms.
+	def __init__(self, app):
+		self.app = app
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http" or not settings.metrics_enabled:
+			await self.app(scope, receive, send)
+			return
+		timings: List[Tuple[str, float, str]] = []
+		token = _request_timings.set(timings)
+		start = time.perf_counter()
+		status = 500
+
+		async def send_with_timing(message):
+			nonlocal status
+			if message["type"] == "http.response.start":
+				status = message["status"]
+				header = server_timing_header(timings, time.perf_counter() - start)
+				message = dict(message)
+				message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode("latin-1"))]
+			await send(message)
+
+		try:
+			await self.app(scope, receive, send_with_timing)
+		finally:
+			_request_timings.reset(token)
+			route = scope.get("route")
+			HTTP_SECONDS.observe(
+				time.perf_counter() - start,
+				method=scope.get("method", ""),
+				route=getattr(route, "path", "unmatched"),
+				status=str(status),
+			)
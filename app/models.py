@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import String, Integer, DateTime, ForeignKey, Text, Float
+from sqlalchemy import String, Integer, DateTime, ForeignKey, Text, Float, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from .database import Base
 
@@ -12,12 +12,16 @@ class ChatSession(Base):
 	created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
 	updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 	user_summary: Mapped[str | None] = mapped_column(Text, nullable=True)
+	# last message folded into user_summary; the next summary starts after it
+	summary_message_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
 
 	messages: Mapped[list["Message"]] = relationship("Message", back_populates="session", cascade="all, delete-orphan")
 
 
 class Message(Base):
 	__tablename__ = "messages"
+	# history reads filter on session_id and page by (created_at, id)
+	__table_args__ = (Index("ix_messages_session_created_id", "session_id", "created_at", "id"),)
 
 	id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
 	session_id: Mapped[int] = mapped_column(ForeignKey("chat_sessions.id", ondelete="CASCADE"))
@@ -28,3 +32,43 @@ class Message(Base):
 	needs_escalation: Mapped[bool | None] = mapped_column(Integer, nullable=True)  # 0/1 for SQLite
 
 	session: Mapped[ChatSession] = relationship("ChatSession", back_populates="messages")
+
+
+class BatchJob(Base):
+	__tablename__ = "batch_jobs"
+
+	id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+	status: Mapped[str] = mapped_column(String(16), default="queued")  # queued | running | completed | cancelled
+	concurrency: Mapped[int] = mapped_column(Integer)
+	rate_limit: Mapped[float | None] = mapped_column(Float, nullable=True)  # items per second
+	total: Mapped[int] = mapped_column(Integer, default=0)
+	done: Mapped[int] = mapped_column(Integer, default=0)
+	failed: Mapped[int] = mapped_column(Integer, default=0)
+	created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+	started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+	finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+	# process running the job; another may take over once the lease runs out
+	owner: Mapped[str | None] = mapped_column(String(64), nullable=True)
+	lease_expires_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class BatchItem(Base):
+	__tablename__ = "batch_items"
+	# the runner takes pending items in order, results are read back in order
+	__table_args__ = (
+		Index("ix_batch_items_job_seq", "job_id", "seq", unique=True),
+		Index("ix_batch_items_job_status_seq", "job_id", "status", "seq"),
+	)
+
+	id: Mapped[int] = mapped_column(Integer, primary_key=True)
+	job_id: Mapped[int] = mapped_column(ForeignKey("batch_jobs.id", ondelete="CASCADE"))
+	seq: Mapped[int] = mapped_column(Integer)
+	ticket_id: Mapped[str | None] = mapped_column(String(128), nullable=True)
+	question: Mapped[str] = mapped_column(Text)
+	status: Mapped[str] = mapped_column(String(16), default="pending")  # pending | done | error
+	answer: Mapped[str | None] = mapped_column(Text, nullable=True)
+	confidence: Mapped[float | None] = mapped_column(Float, nullable=True)
+	needs_escalation: Mapped[bool | None] = mapped_column(Integer, nullable=True)
+	faq_ids: Mapped[str | None] = mapped_column(Text, nullable=True)  # JSON list
+	error: Mapped[str | None] = mapped_column(Text, nullable=True)
+	finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
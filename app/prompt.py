@@ -0,0 +1,86 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import List, Optional
+import re
+
+from .config import settings
+from .escalation import summarize_conversation
+from .retriever import RetrievedFAQ
+
+
+SYSTEM_PROMPT = (
+	"You are a helpful customer support agent. Use the FAQ context when relevant. "
+	"Provide concise, accurate answers. If confidence is low, suggest escalation."
+)
+
+# Rough BPE-like count (words and punctuation) plus per-message framing; close
+# enough for budgeting without shipping a tokenizer.
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+	return len(_TOKEN_RE.findall(text))
+
+
+def count_message_tokens(messages: List[dict]) -> int:
+	return sum(estimate_tokens(m.get("content", "")) + _MESSAGE_OVERHEAD for m in messages)
+
+
+@dataclass
+class BuiltPrompt:
+	messages: List[dict]
+	prompt_tokens: int
+	faqs_used: int
+	history_messages: int
+	summarized: bool
+
+
+class PromptBuilder:
+	# Assembles the LLM messages for a turn within a token budget: the last
+	# `history_turns` user/assistant turns verbatim, the session summary in place
+	# of anything older, and as many FAQs (best score first) as still fit.
+	def __init__(self, max_tokens: int, history_turns: int):
+		self.max_tokens = max_tokens
+		self.history_turns = history_turns
+
+	def build(
+		self,
+		question: str,
+		retrieved: List[RetrievedFAQ],
+		history: List[dict],
+		summary: Optional[str] = None,
+		older_messages: int = 0,
+	) -> BuiltPrompt:
+		window = history[-2 * self.history_turns:] if self.history_turns > 0 else []
+		older = history[:len(history) - len(window)]
+		if older and not summary:
+			summary = summarize_conversation(older)
+		summarized = bool(summary) and (bool(older) or older_messages > 0)
+
+		faqs = sorted(retrieved, key=lambda r: r.score, reverse=True)
+		user = {"role": "user", "content": question}
+		while True:
+			system = {"role": "system", "content": self._system_content(faqs, summary if summarized else None)}
+			messages = [system] + window + [user]
+			tokens = count_message_tokens(messages)
+			if tokens <= self.max_tokens:
+				break
+			# over budget: drop the weakest FAQ first, then the oldest verbatim message
+			if faqs:
+				faqs = faqs[:-1]
+			elif window:
+				window = window[1:]
+			else:
+				break
+		return BuiltPrompt(messages, tokens, len(faqs), len(window), summarized)
+
+	def _system_content(self, faqs: List[RetrievedFAQ], summary: Optional[str]) -> str:
+		content = SYSTEM_PROMPT
+		if summary:
+			content += f"\n\nEarlier in this conversation: {summary}"
+		context = "\n\n".join([f"Q: {r.faq.question}\nA: {r.faq.answer}" for r in faqs])
+		return content + "\n\n" + context
+
+
+prompt_builder = PromptBuilder(settings.prompt_max_tokens, settings.prompt_history_turns)
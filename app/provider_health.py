@@ -0,0 +1,116 @@
+from __future__ import annotations
+from collections import deque
+from typing import Deque, Optional, Tuple
+import time
+
+from .config import settings
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+	# Per-provider breaker over a rolling time window. Errors and calls slower than
+	# slow_call seconds both count as failures; once at least min_calls samples are
+	# in the window and the failure rate reaches error_rate, the breaker opens.
+	# After cooldown a single probe is let through (half open) to decide whether
+	# to close again.
+	def __init__(
+		self,
+		name: str,
+		window: float = 60.0,
+		min_calls: int = 5,
+		error_rate: float = 0.5,
+		slow_call: float = 20.0,
+		cooldown: float = 30.0,
+	):
+		self.name = name
+		self.window = window
+		self.min_calls = min_calls
+		self.error_rate = error_rate
+		self.slow_call = slow_call
+		self.cooldown = cooldown
+		self.state = CLOSED
+		self.opened_at = 0.0
+		self.total_calls = 0
+		self.total_failures = 0
+		self._samples: Deque[Tuple[float, bool, float]] = deque()  # (timestamp, ok, latency)
+		self._probe_in_flight = False
+
+	def allow(self, now: Optional[float] = None) -> bool:
+		now = time.monotonic() if now is None else now
+		if self.state == OPEN and now - self.opened_at >= self.cooldown:
+			self.state = HALF_OPEN
+		if self.state == CLOSED:
+			return True
+		if self.state == HALF_OPEN and not self._probe_in_flight:
+			self._probe_in_flight = True
+			return True
+		return False
+
+	def release(self) -> None:
+		# an allowed call was abandoned without an outcome (e.g. lost a hedge race)
+		self._probe_in_flight = False
+
+	def record(self, ok: bool, latency: float, now: Optional[float] = None) -> None:
+		now = time.monotonic() if now is None else now
+		ok = ok and latency < self.slow_call
+		self.total_calls += 1
+		if not ok:
+			self.total_failures += 1
+		self._samples.append((now, ok, latency))
+		self._trim(now)
+		if self.state == HALF_OPEN:
+			self._probe_in_flight = False
+			if ok:
+				self.state = CLOSED
+				self._samples.clear()
+			else:
+				self._open(now)
+			return
+		if self.state == CLOSED and len(self._samples) >= self.min_calls and self.failure_rate() >= self.error_rate:
+			self._open(now)
+
+	def failure_rate(self) -> float:
+		if not self._samples:
+			return 0.0
+		return sum(1 for _, ok, _ in self._samples if not ok) / len(self._samples)
+
+	def latency_p95(self) -> Optional[float]:
+		latencies = sorted(lat for _, ok, lat in self._samples if ok)
+		if not latencies:
+			return None
+		return latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+
+	def snapshot(self) -> dict:
+		self._trim(time.monotonic())
+		return {
+			"provider": self.name,
+			"state": self.state,
+			"window_calls": len(self._samples),
+			"failure_rate": round(self.failure_rate(), 4),
+			"latency_p95": self.latency_p95(),
+			"total_calls": self.total_calls,
+			"total_failures": self.total_failures,
+		}
+
+	def _open(self, now: float) -> None:
+		self.state = OPEN
+		self.opened_at = now
+
+	def _trim(self, now: float) -> None:
+		while self._samples and now - self._samples[0][0] > self.window:
+			self._samples.popleft()
+
+
+def make_breaker(name: str) -> CircuitBreaker:
+	return CircuitBreaker(
+		name,
+		window=settings.llm_breaker_window,
+		min_calls=settings.llm_breaker_min_calls,
+		error_rate=settings.llm_breaker_error_rate,
+		slow_call=settings.llm_breaker_slow_call,
+		cooldown=settings.llm_breaker_cooldown,
+	)
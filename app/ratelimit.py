@@ -0,0 +1,32 @@
+from __future__ import annotations
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+	# `rate` tokens per second, holding at most `burst`
+	def __init__(self, rate: float, burst: float):
+		self.rate = rate
+		self.burst = burst
+		self._tokens = burst
+		self._updated = time.monotonic()
+		self._lock = threading.Lock()
+
+	def try_acquire(self, tokens: float = 1.0) -> float:
+		# Takes the tokens and returns 0.0, or returns the seconds until they are available
+		with self._lock:
+			now = time.monotonic()
+			self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+			self._updated = now
+			if self._tokens >= tokens:
+				self._tokens -= tokens
+				return 0.0
+			return (tokens - self._tokens) / self.rate
+
+	async def acquire(self, tokens: float = 1.0) -> None:
+		while True:
+			wait = self.try_acquire(tokens)
+			if not wait:
+				return
+			await asyncio.sleep(wait)
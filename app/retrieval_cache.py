@@ -0,0 +1,109 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Optional, Tuple
+import sys
+import threading
+
+from .config import settings
+from .faq_loader import FAQ
+from .metrics import RETRIEVAL_CACHE_REQUESTS, Gauge, registry
+from .retriever import _tokenize_memo
+
+
+# Keys longer than this (normalized query text) are not cached
+_MAX_KEY_CHARS = 512
+
+Entry = Tuple[Tuple[FAQ, float], ...]
+
+
+class RetrievalCache:
+	# LRU of normalized query -> top-k (FAQ, score) for one index snapshot. Keys
+	# carry the snapshot's generation: the first lookup from a newer snapshot
+	# drops every entry of the old one, and lookups from an older snapshot still
+	# finishing a request neither hit nor store. Results hold references to the
+	# snapshot's FAQ records, so only the tuples are counted as cache memory.
+	def __init__(self, max_entries: int):
+		self.max_entries = max_entries
+		self.hits = 0
+		self.misses = 0
+		self._generation = -1
+		self._data: "OrderedDict[Tuple[str, int], Entry]" = OrderedDict()
+		self._bytes = 0
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def _size(key: Tuple[str, int], value: Entry) -> int:
+		return sys.getsizeof(key) + sys.getsizeof(key[0]) + sys.getsizeof(value) + sum(
+			sys.getsizeof(pair) + sys.getsizeof(pair[1]) for pair in value
+		)
+
+	def _current(self, generation: int) -> bool:
+		# under the lock
+		if generation > self._generation:
+			self._data.clear()
+			self._bytes = 0
+			self._generation = generation
+		return generation == self._generation
+
+	def get(self, generation: int, key: Tuple[str, int]) -> Optional[Entry]:
+		with self._lock:
+			value = self._data.get(key) if self._current(generation) else None
+			if value is None:
+				self.misses += 1
+			else:
+				self._data.move_to_end(key)
+				self.hits += 1
+		RETRIEVAL_CACHE_REQUESTS.inc(result="miss" if value is None else "hit")
+		return value
+
+	def set(self, generation: int, key: Tuple[str, int], value: Entry) -> None:
+		if len(key[0]) > _MAX_KEY_CHARS:
+			return
+		with self._lock:
+			if not self._current(generation):
+				return
+			old = self._data.pop(key, None)
+			if old is not None:
+				self._bytes -= self._size(key, old)
+			self._data[key] = value
+			self._bytes += self._size(key, value)
+			while len(self._data) > self.max_entries:
+				k, v = self._data.popitem(last=False)
+				self._bytes -= self._size(k, v)
+
+	def clear(self) -> None:
+		with self._lock:
+			self._data.clear()
+			self._bytes = 0
+
+	def __len__(self) -> int:
+		return len(self._data)
+
+	def stats(self) -> dict:
+		total = self.hits + self.misses
+		memo = _tokenize_memo.cache_info()
+		memo_total = memo.hits + memo.misses
+		return {
+			"entries": len(self._data),
+			"max_entries": self.max_entries,
+			"bytes": self._bytes,
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": (self.hits / total) if total else 0.0,
+			"tokenize": {
+				"entries": memo.currsize,
+				"max_entries": memo.maxsize,
+				"hits": memo.hits,
+				"misses": memo.misses,
+				"hit_rate": (memo.hits / memo_total) if memo_total else 0.0,
+			},
+		}
+
+
+retrieval_cache: Optional[RetrievalCache] = (
+	RetrievalCache(settings.retrieval_cache_max_entries) if settings.retrieval_cache_max_entries > 0 else None
+)
+
+if retrieval_cache is not None:
+	registry.register(Gauge("retrieval_cache_entries", "Entries in the retrieval result cache", lambda: len(retrieval_cache)))
+	registry.register(Gauge("retrieval_cache_bytes", "Approximate memory held by the retrieval result cache", lambda: retrieval_cache._bytes))
@@ -1,20 +1,63 @@
 from __future__ import annotations
+from array import array
+from collections import Counter
 from dataclasses import dataclass
-from typing import List, Dict
+from typing import List, Dict, Sequence, Tuple
+import functools
+import itertools
 import math
 import re
 
 from .faq_loader import FAQ, FAQRepository
 from .config import settings
+from .metrics import timed
+
+# NumPy is imported on first use (pruned or batched scoring), not at startup:
+# it is the slowest import on the cold-start path and small indexes never need it
+np = None
+_np_checked = False
 
 
 _WORD_RE = re.compile(r"\b\w+\b", re.UNICODE)
+# Upper bounds are inflated slightly so float rounding in partial sums can never
+# prune a document whose exact score reaches the threshold
+_UB_SLACK = 1.0 + 1e-9
+# below this many postings across the query terms exhaustive scoring is as fast
+_PRUNE_MIN_POSTINGS = 512
+
+
+def _numpy():
+	global np, _np_checked
+	if not _np_checked:
+		try:
+			import numpy  # type: ignore
+			np = numpy
+		except Exception:  # pragma: no cover
+			pass
+		_np_checked = True
+	return np
 
 
 def _tokenize(text: str) -> List[str]:
 	return [t.lower() for t in _WORD_RE.findall(text)]
 
 
+# Customer questions repeat far more than FAQ texts do, so query tokens are
+# memoized (as tuples: the cached value is shared). Long inputs bypass the memo.
+_QUERY_MEMO_MAX_CHARS = 512
+
+
+@functools.lru_cache(maxsize=settings.tokenize_cache_size)
+def _tokenize_memo(text: str) -> Tuple[str, ...]:
+	return tuple(_tokenize(text))
+
+
+def _tokenize_query(text: str) -> Tuple[str, ...]:
+	if len(text) > _QUERY_MEMO_MAX_CHARS:
+		return tuple(_tokenize(text))
+	return _tokenize_memo(text)
+
+
 @dataclass
 class RetrievedFAQ:
 	faq: FAQ
@@ -26,51 +69,251 @@ class BM25FAQRetriever:
 		self.repo = repo
 		self.k1 = k1
 		self.b = b
-		self._faqs: List[FAQ] = []
-		self._docs: List[List[str]] = []
-		self._df: Dict[str, int] = {}
+		self._built = False
+		self._faqs: Sequence[FAQ] = []
+		# term -> term id; postings for term t live in [_post_ptr[t], _post_ptr[t + 1])
+		self._vocab: Dict[str, int] = {}
+		self._post_ptr = array("q", [0])
+		self._post_docs = array("i")
+		self._post_tfs = array("i")
+		# per-term idf and per-document length normalisation, k1 * (1 - b + b * dl / avgdl)
+		self._idf = array("d")
+		self._doc_len = array("i")
+		self._norm = array("d")
 		self._avgdl: float = 0.0
+		self._post_weights = None  # numpy BM25 weight per posting, built on first batch query
+		self._term_ub = None  # per-term max BM25 weight for top-k pruning, built on first use
+		self._mmap = None  # backing file when opened from an on-disk index (see index_store)
 
 	def build(self):
 		if not self.repo.is_loaded():
 			self.repo.load()
-		self._faqs = list(self.repo.all())
-		self._docs = []
-		self._df.clear()
-		lengths = []
-		for f in self._faqs:
+		self._faqs = self.repo.records()
+		vocab: Dict[str, int] = {}
+		term_docs: List[array] = []
+		term_tfs: List[array] = []
+		doc_len = array("i")
+		for i, f in enumerate(self._faqs):
 			tokens = _tokenize(f"{f.question} {f.answer}")
-			self._docs.append(tokens)
-			lengths.append(len(tokens))
-			for w in set(tokens):
-				self._df[w] = self._df.get(w, 0) + 1
-		self._avgdl = (sum(lengths) / len(lengths)) if lengths else 0.0
-
-	def _score(self, qtokens: List[str], idx: int) -> float:
-		doc = self._docs[idx]
-		dl = len(doc)
-		score = 0.0
-		# term frequency in doc
-		freq: Dict[str, int] = {}
-		for w in doc:
-			freq[w] = freq.get(w, 0) + 1
-		N = len(self._docs) or 1
+			doc_len.append(len(tokens))
+			for w, tf in Counter(tokens).items():
+				tid = vocab.get(w)
+				if tid is None:
+					tid = vocab[w] = len(vocab)
+					term_docs.append(array("i"))
+					term_tfs.append(array("i"))
+				term_docs[tid].append(i)
+				term_tfs[tid].append(tf)
+
+		post_ptr = array("q", [0])
+		post_docs = array("i")
+		post_tfs = array("i")
+		for docs, tfs in zip(term_docs, term_tfs):
+			post_docs.extend(docs)
+			post_tfs.extend(tfs)
+			post_ptr.append(len(post_docs))
+
+		N = len(self._faqs) or 1
+		self._idf = array("d", (math.log(1 + (N - len(d) + 0.5) / (len(d) + 0.5)) for d in term_docs))
+		self._avgdl = (sum(doc_len) / len(doc_len)) if doc_len else 0.0
+		avgdl = self._avgdl or 1.0
+		self._norm = array("d", (self.k1 * (1 - self.b + self.b * (dl / avgdl)) for dl in doc_len))
+		self._vocab = vocab
+		self._post_ptr = post_ptr
+		self._post_docs = post_docs
+		self._post_tfs = post_tfs
+		self._doc_len = doc_len
+		self._post_weights = None
+		self._term_ub = None
+		self._built = bool(self._faqs)
+
+	def _score_postings(self, qtokens: Sequence[str]) -> Dict[int, float]:
+		# Accumulate only over the postings of the query terms; documents sharing
+		# no term with the query score 0. Repeated query terms count repeatedly.
+		scores: Dict[int, float] = {}
+		ptr, docs, tfs, norm = self._post_ptr, self._post_docs, self._post_tfs, self._norm
+		k1p = self.k1 + 1
 		for q in qtokens:
-			df = self._df.get(q, 0)
-			if df == 0:
+			tid = self._vocab.get(q)
+			if tid is None:
 				continue
-			idf = math.log(1 + (N - df + 0.5) / (df + 0.5))
-			fq = freq.get(q, 0)
-			den = fq + self.k1 * (1 - self.b + self.b * (dl / (self._avgdl or 1.0)))
-			score += idf * (fq * (self.k1 + 1)) / (den or 1.0)
-		return score
+			idf = self._idf[tid]
+			for j in range(ptr[tid], ptr[tid + 1]):
+				d = docs[j]
+				fq = tfs[j]
+				scores[d] = scores.get(d, 0.0) + idf * (fq * k1p) / ((fq + norm[d]) or 1.0)
+		return scores
 
+	@timed("retrieve")
 	def retrieve(self, query: str, top_k: int | None = None) -> List[RetrievedFAQ]:
-		if not self._docs:
+		if not self._built:
 			self.build()
-		qtokens = _tokenize(query)
 		k = top_k or settings.retriever_top_k
-		scores = [(i, self._score(qtokens, i)) for i in range(len(self._docs))]
-		scores.sort(key=lambda x: x[1], reverse=True)
-		indices = [i for i, s in scores[:k]]
-		return [RetrievedFAQ(self._faqs[i], float(scores[j][1])) for j, i in enumerate(indices)]
+		qtokens = _tokenize_query(query)
+		if self._should_prune(qtokens, k):
+			ranked = self._top_k_pruned(qtokens, k)
+			matched = {i for i, _ in ranked}
+		else:
+			scores = self._score_postings(qtokens)
+			ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))[:k]
+			matched = scores
+		# pad with unmatched documents in corpus order, as a full stable sort would;
+		# fewer than k results means every matching document is already ranked
+		if len(ranked) < k:
+			for i in range(len(self._faqs)):
+				if i not in matched:
+					ranked.append((i, 0.0))
+					if len(ranked) >= k:
+						break
+		return [RetrievedFAQ(self._faqs[i], float(s)) for i, s in ranked]
+
+	def _should_prune(self, qtokens: Sequence[str], k: int) -> bool:
+		if not settings.retriever_pruning:
+			return False
+		ptr, vocab = self._post_ptr, self._vocab
+		total = 0
+		for q in qtokens:
+			tid = vocab.get(q)
+			if tid is not None:
+				total += ptr[tid + 1] - ptr[tid]
+		return total > max(_PRUNE_MIN_POSTINGS, k) and _numpy() is not None
+
+	def _top_k_pruned(self, qtokens: Sequence[str], k: int) -> List[Tuple[int, float]]:
+		# MaxScore-style dynamic pruning, term at a time with NumPy. Query terms are
+		# taken in decreasing order of their score upper bound (max BM25 weight of
+		# the term times its query multiplicity). Once the k-th best partial score
+		# exceeds the summed bounds of the remaining terms, no document that hasn't
+		# been seen yet can enter the top k: the remaining (long, low-idf) posting
+		# lists are never scanned, only probed by binary search for the surviving
+		# candidates, and candidates whose bound falls below the threshold are
+		# dropped unscored. Survivors get exact scores summed in query order, as
+		# in _score_postings, so scores and ranking match exhaustive scoring.
+		ptr, idf = self._post_ptr, self._idf
+		docs = np.frombuffer(self._post_docs, dtype=np.int32)
+		tfs = np.frombuffer(self._post_tfs, dtype=np.int32)
+		norm = np.frombuffer(self._norm, dtype=np.float64)
+		k1p = self.k1 + 1
+		ub = self._upper_bounds()
+		qtids = [tid for tid in map(self._vocab.get, qtokens) if tid is not None]
+		mult = Counter(qtids)
+		terms = sorted(mult, key=lambda t: (-ub[t] * mult[t], t))
+		bounds = [ub[t] * mult[t] * _UB_SLACK for t in terms]
+		# rest[j]: bound on the score any document can collect from terms[j:]
+		rest = list(itertools.accumulate(reversed(bounds)))[::-1] + [0.0]
+
+		def postings(t):
+			return docs[ptr[t]:ptr[t + 1]], tfs[ptr[t]:ptr[t + 1]]
+
+		cand = np.empty(0, dtype=np.int32)
+		lower = np.empty(0, dtype=np.float64)
+		theta = 0.0
+		j = 0
+		while j < len(terms):
+			t = terms[j]
+			d, f = postings(t)
+			w = idf[t] * (f * k1p) / (f + norm[d]) * mult[t]
+			cand, inv = np.unique(np.concatenate((cand, d)), return_inverse=True)
+			lower = np.bincount(inv, weights=np.concatenate((lower, w)), minlength=cand.size)
+			j += 1
+			if cand.size >= k:
+				theta = np.partition(lower, cand.size - k)[cand.size - k] * (1 - 1e-9)
+				if rest[j] < theta:
+					break
+		if j < len(terms) and cand.size > k:
+			keep = lower * _UB_SLACK + rest[j] >= theta
+			cand = cand[keep]
+
+		# exact scores for the candidates, accumulated in query order
+		weights = {}
+		for t in mult:
+			d, f = postings(t)
+			pos = np.searchsorted(d, cand)
+			hit = pos < d.size
+			hit[hit] = d[pos[hit]] == cand[hit]
+			wt = np.zeros(cand.size, dtype=np.float64)
+			fh = f[pos[hit]]
+			wt[hit] = idf[t] * (fh * k1p) / (fh + norm[cand[hit]])
+			weights[t] = wt
+		scores = np.zeros(cand.size, dtype=np.float64)
+		for t in qtids:
+			scores += weights[t]
+		top = _top_k_indices(scores, min(k, cand.size)) if cand.size else []
+		return [(int(cand[i]), float(scores[i])) for i in top]
+
+	def _upper_bounds(self) -> array:
+		if self._term_ub is None:
+			w = self._post_weights if self._post_weights is not None else self._posting_weights()
+			ptr = np.frombuffer(self._post_ptr, dtype=np.int64)
+			starts = ptr[:-1]
+			nonempty = ptr[1:] > starts
+			ub = np.zeros(len(starts), dtype=np.float64)
+			if w.size:
+				ub[nonempty] = np.maximum.reduceat(w, starts[nonempty])
+			self._term_ub = array("d", ub.tobytes())
+		return self._term_ub
+
+	def _weights(self):
+		# Term-major (CSC) view of the doc-term matrix with the BM25 contribution of
+		# every posting precomputed, using the same arithmetic as _score_postings.
+		if self._post_weights is None:
+			self._post_weights = self._posting_weights()
+		return self._post_weights
+
+	def _posting_weights(self):
+		ptr = np.frombuffer(self._post_ptr, dtype=np.int64)
+		docs = np.frombuffer(self._post_docs, dtype=np.int32)
+		tfs = np.frombuffer(self._post_tfs, dtype=np.int32)
+		idf = np.repeat(np.frombuffer(self._idf, dtype=np.float64), np.diff(ptr))
+		den = tfs + np.frombuffer(self._norm, dtype=np.float64)[docs]
+		return idf * (tfs * (self.k1 + 1)) / den
+
+	@timed("retrieve_many")
+	def retrieve_many(self, queries: List[str], top_k: int | None = None) -> List[List[RetrievedFAQ]]:
+		if not self._built:
+			self.build()
+		if not self._faqs or _numpy() is None:
+			return [self.retrieve(q, top_k) for q in queries]
+		k = min(top_k or settings.retriever_top_k, len(self._faqs))
+		N = len(self._faqs)
+		ptr = np.frombuffer(self._post_ptr, dtype=np.int64)
+		docs = np.frombuffer(self._post_docs, dtype=np.int32)
+		weights = self._weights()
+		vocab = self._vocab
+		term_ids = [[tid for tid in map(vocab.get, _tokenize_query(q)) if tid is not None] for q in queries]
+
+		results: List[List[RetrievedFAQ]] = []
+		# keep the dense score block around 64 MB
+		chunk = max(1, (8 << 20) // N)
+		for c in range(0, len(queries), chunk):
+			block = term_ids[c:c + chunk]
+			scores = np.zeros(len(block) * N, dtype=np.float64)
+			# Scatter term by term position so each document accumulates its
+			# contributions in query order, exactly like retrieve(); within one
+			# position every (query, doc) slot is hit at most once.
+			for pos in range(max((len(t) for t in block), default=0)):
+				rows = np.array([r for r, t in enumerate(block) if len(t) > pos], dtype=np.int64)
+				tids = np.array([t[pos] for t in block if len(t) > pos], dtype=np.int64)
+				starts = ptr[tids]
+				lens = ptr[tids + 1] - starts
+				total = int(lens.sum())
+				if total == 0:
+					continue
+				offs = np.arange(total) - np.repeat(np.cumsum(lens) - lens, lens) + np.repeat(starts, lens)
+				scores[np.repeat(rows, lens) * N + docs[offs]] += weights[offs]
+			scores = scores.reshape(len(block), N)
+			for row in scores:
+				top = _top_k_indices(row, k)
+				results.append([RetrievedFAQ(self._faqs[i], float(row[i])) for i in top])
+		return results
+
+
+def _top_k_indices(row, k: int):
+	# Partial selection with argpartition, then break ties on the boundary by
+	# corpus order so the ranking matches a full stable sort.
+	if k >= row.size:
+		return np.lexsort((np.arange(row.size), -row))
+	kth = row[np.argpartition(-row, k - 1)[:k]].min()
+	above = np.flatnonzero(row > kth)
+	ties = np.flatnonzero(row == kth)[:k - above.size]
+	cand = np.concatenate((above, ties))
+	return cand[np.lexsort((cand, -row[cand]))]
@@ -1,106 +1,422 @@
 from __future__ import annotations
-from fastapi import APIRouter, Depends, HTTPException
+from dataclasses import dataclass
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional, Tuple
+import json
+import math
+import time
 
-from .database import get_db
+from .database import get_db, run_db, run_db_write
 from . import crud, schemas
-from .faq_loader import FAQRepository
-from .retriever import BM25FAQRetriever
-from .llm import LLMClient
+from .admission import Overloaded, ip_limiter, llm_admission, session_limiter
+from .answer_cache import answer_cache
+from .faq_index import faq_index, get_retriever
+from .llm import get_llm_client, is_mock_reply
+from .metrics import ESCALATIONS, LLM_SHED, RATE_LIMITED, record_stage, timer
+from .prompt import BuiltPrompt, prompt_builder
+from .retrieval_cache import retrieval_cache
+from .summarizer import summarize_inline, summary_worker
+from .retriever import RetrievedFAQ
 from .config import settings
-from .escalation import should_escalate, build_escalation_message, summarize_conversation
+from .escalation import should_escalate, build_escalation_message, build_faq_only_answer, summarize_incremental
 
 router = APIRouter(prefix="/api")
 
 
 @router.post("/sessions", response_model=schemas.SessionRead)
-def create_session(payload: schemas.SessionCreate, db: Session = Depends(get_db)):
-	sess = crud.create_session(db, payload.external_id)
-	return sess
+async def create_session(payload: schemas.SessionCreate):
+	# a write like any other: through the single writer queue, so it can't hit SQLITE_BUSY
+	return await run_db_write(crud.create_session, payload.external_id)
 
 
-@router.get("/sessions/{session_id}", response_model=schemas.SessionWithMessages)
-def get_session(session_id: int, db: Session = Depends(get_db)):
+def _message_page(db: Session, session_id: int, before: Optional[int], after: Optional[int], limit: int):
+	try:
+		rows, has_more = crud.list_messages_page(db, session_id, before=before, after=after, limit=limit)
+	except LookupError as e:
+		raise HTTPException(status_code=400, detail=f"Unknown cursor: {e.args[0]}")
+	messages = [
+		{
+			"id": r.id,
+			"role": r.role,
+			"content": r.content,
+			"created_at": r.created_at,
+			"confidence": r.confidence,
+			"needs_escalation": None if r.needs_escalation is None else bool(r.needs_escalation),
+		}
+		for r in rows
+	]
+	# pass X-Next-Cursor as `after` / X-Prev-Cursor as `before` to fetch the adjacent page
+	headers = {}
+	if has_more and messages:
+		name = "X-Next-Cursor" if after is not None else "X-Prev-Cursor"
+		headers[name] = str(messages[-1]["id"] if after is not None else messages[0]["id"])
+	return messages, headers
+
+
+# History endpoints serialize plain rows with orjson instead of ORM objects +
+# pydantic, so the response shape is documented with `responses` rather than
+# enforced with response_model
+_PAGE_HEADERS = {
+	"X-Prev-Cursor": {"description": "pass as `before` for the previous page", "schema": {"type": "integer"}},
+	"X-Next-Cursor": {"description": "pass as `after` for the next page", "schema": {"type": "integer"}},
+}
+
+
+@router.get(
+	"/sessions/{session_id}",
+	response_class=ORJSONResponse,
+	responses={200: {"model": schemas.SessionWithMessages, "headers": _PAGE_HEADERS}},
+)
+def get_session(
+	session_id: int,
+	before: Optional[int] = Query(default=None),
+	after: Optional[int] = Query(default=None),
+	limit: int = Query(default=50, ge=1, le=500),
+	db: Session = Depends(get_db),
+):
 	sess = crud.get_session(db, session_id)
 	if not sess:
 		raise HTTPException(status_code=404, detail="Session not found")
-	messages = crud.list_messages(db, session_id)
-	return schemas.SessionWithMessages(
-		id=sess.id,
-		external_id=sess.external_id,
-		created_at=sess.created_at,
-		updated_at=sess.updated_at,
-		user_summary=sess.user_summary,
-		messages=[schemas.MessageRead.model_validate(m) for m in messages],
+	messages, headers = _message_page(db, session_id, before, after, limit)
+	return ORJSONResponse(
+		{
+			"id": sess.id,
+			"external_id": sess.external_id,
+			"created_at": sess.created_at,
+			"updated_at": sess.updated_at,
+			"user_summary": sess.user_summary,
+			"messages": messages,
+		},
+		headers=headers,
 	)
 
 
-@router.get("/sessions/{session_id}/messages", response_model=List[schemas.MessageRead])
-def list_messages(session_id: int, db: Session = Depends(get_db)):
-	return [schemas.MessageRead.model_validate(m) for m in crud.list_messages(db, session_id)]
+@router.get(
+	"/sessions/{session_id}/messages",
+	response_class=ORJSONResponse,
+	responses={200: {"model": List[schemas.MessageRead], "headers": _PAGE_HEADERS}},
+)
+def list_messages(
+	session_id: int,
+	before: Optional[int] = Query(default=None),
+	after: Optional[int] = Query(default=None),
+	limit: int = Query(default=50, ge=1, le=500),
+	db: Session = Depends(get_db),
+):
+	messages, headers = _message_page(db, session_id, before, after, limit)
+	return ORJSONResponse(messages, headers=headers)
+
+
+@dataclass
+class _Turn:
+	session_id: int
+	question: str
+	received_at: datetime
+	history: List[dict]
+	message_count: int
+	summary: str | None
+	retrieved: List[RetrievedFAQ]
+	prompt: BuiltPrompt
 
 
-@router.post("/sessions/{session_id}/messages", response_model=schemas.MessageRead)
-async def send_message(session_id: int, payload: schemas.MessageCreate, db: Session = Depends(get_db)):
+# newest messages read between the summary watermark and the verbatim window;
+# the extractive summary keeps only the newest summary_max_chars of them anyway
+_GAP_MESSAGES = 20
+
+
+def _load_history(db: Session, session_id: int, payload: schemas.MessageCreate):
 	sess = crud.get_session(db, session_id)
 	if not sess:
 		raise HTTPException(status_code=404, detail="Session not found")
 	if payload.role != "user":
 		raise HTTPException(status_code=400, detail="Only user messages can be sent to this endpoint")
+	# only the verbatim window is read; older turns are covered by the summary
+	recent = crud.list_recent_messages(db, session_id, 2 * settings.prompt_history_turns)
+	history = [{"role": m.role, "content": m.content} for m in recent]
+	message_count = crud.count_messages(db, session_id)
+	summary = sess.user_summary
+	if message_count > len(recent):
+		# messages that left the window but are not in the summary yet (no summary
+		# before summary_after_messages, or the worker hasn't caught up) are
+		# added extractively, so nothing between summary and window is forgotten
+		watermark = sess.summary_message_id or 0
+		rows, _ = crud.list_messages_page(db, session_id, before=recent[0].id, limit=_GAP_MESSAGES)
+		gap = [{"role": r.role, "content": r.content} for r in rows if r.id > watermark]
+		if gap:
+			summary = summarize_incremental(summary, gap, settings.summary_max_chars)
+	return history, message_count, summary
+
 
-	# Save user message
-	crud.add_message(db, session_id, role="user", content=payload.content)
+async def _start_turn(session_id: int, payload: schemas.MessageCreate) -> _Turn:
+	received_at = datetime.utcnow()
+	# History is read once per turn; nothing is written until the turn completes
+	history, message_count, summary = await run_db(_load_history, session_id, payload)
 
 	# Retrieve FAQs
-	repo = FAQRepository(path="data/faqs.jsonl")
-	retriever = BM25FAQRetriever(repo)
-	retrieved = retriever.retrieve(payload.content, top_k=settings.retriever_top_k)
-
-	# Compose system prompt with top FAQs
-	context = "\n\n".join([f"Q: {r.faq.question}\nA: {r.faq.answer}" for r in retrieved])
-	system = {
-		"role": "system",
-		"content": (
-			"You are a helpful customer support agent. Use the FAQ context when relevant. "
-			"Provide concise, accurate answers. If confidence is low, suggest escalation.\n\n" + context
-		),
-	}
+	retrieved = get_retriever().retrieve(payload.content, top_k=settings.retriever_top_k)
+	return _make_turn(session_id, payload.content, received_at, history, message_count, summary, retrieved)
 
-	# Build LLM messages
-	history_models = crud.list_messages(db, session_id)
-	history = [
-		{"role": m.role, "content": m.content} for m in history_models
-	]
-	messages_llm = [system] + history + [{"role": "user", "content": payload.content}]
 
-	# Call LLM
-	llm = LLMClient()
-	answer = await llm.chat(messages_llm)
+def _make_turn(
+	session_id: int,
+	question: str,
+	received_at: datetime,
+	history: List[dict],
+	message_count: int,
+	summary: str | None,
+	retrieved: List[RetrievedFAQ],
+) -> _Turn:
+	# System prompt with top FAQs, recent turns and the summary of older ones, within the token budget
+	with timer("prompt"):
+		prompt = prompt_builder.build(
+			question,
+			retrieved,
+			history,
+			summary=summary,
+			older_messages=message_count - len(history),
+		)
+	return _Turn(session_id, question, received_at, history, message_count, summary, retrieved, prompt)
+
 
+async def _answer(turn: _Turn, shed: bool = True) -> str:
+	# Call LLM unless an identical question over the same FAQs was answered recently.
+	# The upstream call needs an admission slot; with shed=True a turn that can't
+	# get one within llm_queue_timeout raises Overloaded, otherwise it waits its turn.
+	cache_key = _cache_key(turn)
+	answer = _cache_lookup(cache_key)
+	if answer is None:
+		with timer("llm"):
+			answer = await get_llm_client().chat(
+				turn.prompt.messages,
+				queue_timeout=settings.llm_queue_timeout if shed else None,
+				cached=lambda: _cache_lookup(cache_key),
+			)
+		_cache_store(cache_key, answer)
+	return answer
+
+
+def _overloaded(turn: _Turn, e: Overloaded) -> str:
+	# Degrade to the best FAQ's answer when there is one, else fail fast with 503
+	if settings.llm_overload_mode == "faq" and turn.retrieved and turn.retrieved[0].score > 0:
+		LLM_SHED.inc(reason=e.reason, action="faq")
+		top = turn.retrieved[0].faq
+		return build_faq_only_answer(top.question, top.answer)
+	LLM_SHED.inc(reason=e.reason, action="reject")
+	raise HTTPException(
+		status_code=503,
+		detail="The assistant is overloaded, please retry shortly",
+		headers={"Retry-After": str(e.retry_after)},
+	)
+
+
+def _escalate(turn: _Turn, answer: str) -> Tuple[str, float, bool]:
 	# Simple heuristic for confidence using top FAQ score
-	confidence = float(retrieved[0].score) if retrieved else 0.0
+	confidence = float(turn.retrieved[0].score) if turn.retrieved else 0.0
 	needs_escalation = should_escalate(confidence)
-
 	if needs_escalation:
+		ESCALATIONS.inc()
 		answer = f"{answer}\n\n{build_escalation_message()}"
+	return answer, confidence, needs_escalation
+
 
-	assistant_msg = crud.add_message(
-		db,
-		session_id,
+def _finish_turn(db: Session, turn: _Turn, answer: str) -> schemas.MessageRead:
+	answer, confidence, needs_escalation = _escalate(turn, answer)
+
+	new_messages = [
+		{"role": "user", "content": turn.question, "created_at": turn.received_at},
+		{
+			"role": "assistant",
+			"content": answer,
+			"created_at": datetime.utcnow(),
+			"confidence": confidence,
+			"needs_escalation": needs_escalation,
+		},
+	]
+
+	# Periodic summary inline only when no background summary worker runs, of the
+	# messages this turn pushes out of the verbatim window
+	summary, through_id = None, None
+	if _needs_summary(turn) and not summary_worker.enabled:
+		keep = max(0, 2 * settings.prompt_history_turns - len(new_messages))
+		summary, through_id = summarize_inline(db, turn.session_id, keep) or (None, None)
+
+	# user message, assistant message and summary in one transaction
+	(_, (assistant_id, assistant_created_at)) = crud.commit_turn(db, turn.session_id, new_messages, summary, through_id)
+	return schemas.MessageRead(
+		id=assistant_id,
 		role="assistant",
 		content=answer,
+		created_at=assistant_created_at,
 		confidence=confidence,
 		needs_escalation=needs_escalation,
 	)
 
-	# Optional periodic summary
-	if len(history_models) + 2 >= settings.summary_after_messages:  # +2 for user+assistant we just added
-		conv_for_summary = [
-			{"role": m.role, "content": m.content} for m in crud.list_messages(db, session_id)
-		]
-		summary = summarize_conversation(conv_for_summary)
-		if summary:
-			crud.update_session_summary(db, session_id, summary)
 
-	return schemas.MessageRead.model_validate(assistant_msg)
+def _needs_summary(turn: _Turn) -> bool:
+	return turn.message_count + 2 >= settings.summary_after_messages  # +2 for user+assistant of this turn
+
+
+def _schedule_summary(turn: _Turn) -> None:
+	# after the turn is committed, so the worker sees its messages
+	if summary_worker.enabled and _needs_summary(turn):
+		summary_worker.schedule(turn.session_id)
+
+
+def _cache_key(turn: _Turn) -> str | None:
+	if answer_cache is None:
+		return None
+	# key on the conversation the model actually sees: verbatim window plus summary
+	history = turn.prompt.messages[1:-1]
+	if turn.prompt.summarized:
+		history = [{"role": "system", "content": turn.summary or ""}] + history
+	return answer_cache.make_key(turn.question, [r.faq.id for r in turn.retrieved], history, faq_index.digest)
+
+
+def _cache_lookup(key: str | None) -> str | None:
+	if key is None:
+		return None
+	with timer("cache"):
+		return answer_cache.get(key)
+
+
+def _cache_store(key: str | None, answer: str) -> None:
+	# mock replies stand in for an unavailable provider and must not be replayed
+	if key is not None and answer and not is_mock_reply(answer):
+		answer_cache.set(key, answer)
+
+
+def _client_ip(request: Request) -> str:
+	if settings.rate_limit_trust_forwarded:
+		forwarded = request.headers.get("x-forwarded-for")
+		if forwarded:
+			return forwarded.split(",")[0].strip()
+	return request.client.host if request.client else "unknown"
+
+
+async def _check_rate_limits(request: Request, session_id: int) -> None:
+	# per client IP and per session token buckets, before any DB or LLM work
+	for scope, limiter, key in (("ip", ip_limiter, _client_ip(request)), ("session", session_limiter, session_id)):
+		if not limiter.enabled:
+			continue
+		wait = limiter.check(key)
+		if wait:
+			RATE_LIMITED.inc(scope=scope)
+			raise HTTPException(
+				status_code=429,
+				detail=f"Too many messages from this {scope}",
+				headers={"Retry-After": str(max(1, math.ceil(wait)))},
+			)
+
+
+# The chat endpoints are async and spend most of their time awaiting the LLM, so
+# their database work runs in the bounded DB thread pool (run_db, and the
+# single writer queue run_db_write for the commit) rather than on the event loop.
+@router.post(
+	"/sessions/{session_id}/messages",
+	response_model=schemas.MessageRead,
+	dependencies=[Depends(_check_rate_limits)],
+)
+async def send_message(session_id: int, payload: schemas.MessageCreate, response: Response):
+	turn = await _start_turn(session_id, payload)
+	response.headers["X-Prompt-Tokens"] = str(turn.prompt.prompt_tokens)
+	try:
+		answer = await _answer(turn)
+	except Overloaded as e:
+		answer = _overloaded(turn, e)
+		response.headers["X-Degraded"] = "faq-only"
+	assistant_msg = await run_db_write(_finish_turn, turn, answer)
+	_schedule_summary(turn)
+	return assistant_msg
+
+
+def _sse(event: str, data: str) -> str:
+	return f"event: {event}\ndata: {data}\n\n"
+
+
+@router.post("/sessions/{session_id}/messages/stream", dependencies=[Depends(_check_rate_limits)])
+async def send_message_stream(session_id: int, payload: schemas.MessageCreate):
+	# Server-Sent Events: "token" events carry {"delta": ...}; a final "done" event
+	# carries the persisted assistant message, or "error" if the turn failed.
+	turn = await _start_turn(session_id, payload)
+	cache_key = _cache_key(turn)
+	cached = _cache_lookup(cache_key)
+	headers = {
+		"Cache-Control": "no-cache",
+		"X-Accel-Buffering": "no",
+		"X-Prompt-Tokens": str(turn.prompt.prompt_tokens),
+	}
+	# admitted before the response starts, so an overload can still be a 503;
+	# the slot is released when the stream ends (or, failing that, after the response)
+	release = None
+	if cached is None:
+		try:
+			release, queued = await llm_admission.hold(settings.llm_queue_timeout)
+		except Overloaded as e:
+			# degraded answers are streamed like cached ones and never stored
+			cached = _overloaded(turn, e)
+			headers["X-Degraded"] = "faq-only"
+		else:
+			# answered by another turn while this one was queued
+			if queued:
+				cached = _cache_lookup(cache_key)
+			if cached is not None:
+				release()
+				release = None
+
+	# a reply cut short by a provider failure is still delivered, but not cached
+	stream_status = {"complete": False}
+
+	async def events():
+		parts: List[str] = []
+		try:
+			if cached is not None:
+				parts.append(cached)
+				yield _sse("token", json.dumps({"delta": cached}))
+			else:
+				# the response has started, so these only reach /metrics, not Server-Timing
+				start = time.perf_counter()
+				async for delta in get_llm_client().chat_stream(turn.prompt.messages, stream_status):
+					if not parts:
+						record_stage("llm.first_token", time.perf_counter() - start)
+					parts.append(delta)
+					yield _sse("token", json.dumps({"delta": delta}))
+				record_stage("llm", time.perf_counter() - start)
+				release()
+			answer = "".join(parts).strip()
+			if release is not None and stream_status["complete"]:
+				_cache_store(cache_key, answer)
+			assistant_msg = await run_db_write(_finish_turn, turn, answer)
+			_schedule_summary(turn)
+			# escalation text appended on persist is streamed as a last delta
+			if len(assistant_msg.content) > len(answer):
+				yield _sse("token", json.dumps({"delta": assistant_msg.content[len(answer):]}))
+			yield _sse("done", assistant_msg.model_dump_json())
+		except Exception as e:
+			yield _sse("error", json.dumps({"detail": f"{type(e).__name__}: {e}"}))
+		finally:
+			if release is not None:
+				release()
+
+	return StreamingResponse(
+		events(),
+		media_type="text/event-stream",
+		headers=headers,
+		background=BackgroundTask(release) if release is not None else None,
+	)
+
+
+@router.get("/cache/stats")
+def cache_stats():
+	retrieval = {"enabled": False} if retrieval_cache is None else {"enabled": True, **retrieval_cache.stats()}
+	if answer_cache is None:
+		return {"enabled": False, "retrieval": retrieval}
+	return {"enabled": True, **answer_cache.stats(), "retrieval": retrieval}
+
+
+@router.get("/providers/health")
+def providers_health():
+	return {"providers": get_llm_client().provider_health()}
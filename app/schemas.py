@@ -39,3 +39,15 @@ class SessionRead(BaseModel):
 
 class SessionWithMessages(SessionRead):
 	messages: List[MessageRead] = []
+
+
+class FAQItem(BaseModel):
+	id: str = Field(min_length=1)
+	question: str
+	answer: str
+
+
+class FAQBulkRequest(BaseModel):
+	# upserts are applied first, then deletes
+	upsert: List[FAQItem] = Field(default=[], max_length=10000)
+	delete: List[str] = Field(default=[], max_length=10000)
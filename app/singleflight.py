@@ -0,0 +1,36 @@
+from __future__ import annotations
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+import asyncio
+
+
+class SingleFlight:
+	# Concurrent callers with the same key share one in-flight call. The call runs
+	# as its own task, so a caller that gives up (timeout or cancellation) does
+	# not cancel it for the others; its result or exception reaches every waiter.
+	def __init__(self):
+		self._calls: Dict[Tuple[asyncio.AbstractEventLoop, Hashable], asyncio.Task] = {}
+		self.leaders = 0
+		self.coalesced = 0
+
+	async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+		loop = asyncio.get_running_loop()
+		slot = (loop, key)
+		task = self._calls.get(slot)
+		if task is None:
+			task = loop.create_task(fn())
+			self._calls[slot] = task
+			task.add_done_callback(lambda t: self._forget(slot, t))
+			self.leaders += 1
+		else:
+			self.coalesced += 1
+		return await asyncio.wait_for(asyncio.shield(task), timeout)
+
+	def in_flight(self) -> int:
+		return len(self._calls)
+
+	def _forget(self, slot, task: asyncio.Task) -> None:
+		if self._calls.get(slot) is task:
+			del self._calls[slot]
+		# mark the exception retrieved even if every waiter already timed out
+		if not task.cancelled():
+			task.exception()
@@ -0,0 +1,128 @@
+from __future__ import annotations
+from collections import defaultdict
+from contextlib import contextmanager
+from importlib.machinery import ExtensionFileLoader, SourceFileLoader, SourcelessFileLoader
+from typing import Dict, List, Tuple
+import os
+import sys
+import threading
+import time
+
+# Cold-start profiler. With STARTUP_PROFILE=1, install() (called by api/index.py
+# before the app is imported) times every module import and each init step
+# wrapped in step(), and wrap(app) prints the report to stderr when the first
+# response starts. Read straight from the environment: the settings module is
+# itself part of what gets measured.
+ENABLED = os.environ.get("STARTUP_PROFILE", "").strip().lower() in ("1", "true", "yes", "on")
+
+_t0 = time.perf_counter()
+# (module, self seconds, cumulative seconds)
+_imports: List[Tuple[str, float, float]] = []
+# (name, offset from install, seconds)
+_steps: List[Tuple[str, float, float]] = []
+_reported = False
+_FILE_LOADERS = (SourceFileLoader, SourcelessFileLoader, ExtensionFileLoader)
+
+
+class _ImportTimer:
+	# First entry on sys.meta_path: resolves the spec with the finders behind it
+	# and times the loader's exec_module, which includes the module's own imports
+	# (subtracted to get its self time). Only file loaders are timed: they are one
+	# per module, while zip/frozen/builtin loaders are shared and stay untouched.
+	def __init__(self):
+		self._local = threading.local()
+
+	def find_spec(self, name, path=None, target=None):
+		for finder in sys.meta_path:
+			if finder is self or not hasattr(finder, "find_spec"):
+				continue
+			spec = finder.find_spec(name, path, target)
+			if spec is not None:
+				break
+		else:
+			return None
+		if isinstance(spec.loader, _FILE_LOADERS):
+			spec.loader.exec_module = self._timed(name, spec.loader.exec_module)
+		return spec
+
+	def _timed(self, name: str, exec_module):
+		def timed(module):
+			stack = self._local.__dict__.setdefault("stack", [])
+			stack.append(0.0)
+			start = time.perf_counter()
+			try:
+				exec_module(module)
+			finally:
+				total = time.perf_counter() - start
+				children = stack.pop()
+				if stack:
+					stack[-1] += total
+				_imports.append((name, total - children, total))
+		return timed
+
+
+def install() -> None:
+	global _t0
+	if not ENABLED or any(isinstance(f, _ImportTimer) for f in sys.meta_path):
+		return
+	_t0 = time.perf_counter()
+	sys.meta_path.insert(0, _ImportTimer())
+
+
+def mark(name: str) -> None:
+	if ENABLED:
+		_steps.append((name, time.perf_counter() - _t0, 0.0))
+
+
+@contextmanager
+def step(name: str):
+	if not ENABLED:
+		yield
+		return
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		_steps.append((name, start - _t0, time.perf_counter() - start))
+
+
+def report(top: int = 25) -> str:
+	ms = lambda s: f"{s * 1000.0:8.1f}ms"
+	lines = [f"[startup profile] {ms(time.perf_counter() - _t0).strip()} since install"]
+	lines.append("  steps (start, duration):")
+	for name, offset, seconds in sorted(_steps, key=lambda s: s[1]):
+		lines.append(f"    {name:<32} {ms(offset)} {ms(seconds) if seconds else ''}")
+	imports = list(_imports)
+	lines.append(f"  imports: {len(imports)} modules, {ms(sum(i[1] for i in imports)).strip()} total")
+	packages: Dict[str, float] = defaultdict(float)
+	for name, own, _ in imports:
+		packages[name.split(".")[0]] += own
+	lines.append("  by package (self time):")
+	for name, own in sorted(packages.items(), key=lambda p: -p[1])[:top]:
+		lines.append(f"    {name:<32} {ms(own)}")
+	lines.append("  slowest modules (self, cumulative):")
+	for name, own, total in sorted(imports, key=lambda i: -i[1])[:top]:
+		lines.append(f"    {name:<48} {ms(own)} {ms(total)}")
+	return "\n".join(lines)
+
+
+def wrap(app):
+	# ASGI wrapper that reports once, when the first HTTP response starts
+	if not ENABLED:
+		return app
+
+	async def profiled(scope, receive, send):
+		if scope["type"] != "http" or _reported:
+			return await app(scope, receive, send)
+
+		async def send_first(message):
+			global _reported
+			if message["type"] == "http.response.start" and not _reported:
+				_reported = True
+				mark(f"first byte {scope['method']} {scope['path']}")
+				print(report(), file=sys.stderr)
+			await send(message)
+
+		await app(scope, receive, send_first)
+
+	return profiled
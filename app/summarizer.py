@@ -0,0 +1,184 @@
+from __future__ import annotations
+from typing import List, Optional, Set, Tuple
+import asyncio
+import contextvars
+import sys
+import time
+
+from . import crud
+from .admission import Overloaded
+from .config import settings
+from .database import run_db, run_db_write
+from .escalation import summarize_incremental
+from .llm import get_llm_client, is_mock_reply
+from .metrics import SUMMARY_JOBS, Gauge, record_stage, registry
+
+
+SUMMARY_PROMPT = (
+	"You maintain a running summary of a customer support conversation. Update the current summary "
+	"with the new messages. Keep facts the agent will need later (order numbers, the customer's problem, "
+	"what was already tried or promised). Reply with the summary only, in at most {max_chars} characters."
+)
+
+
+def _read_new_messages(db, session_id: int, keep: int) -> Optional[Tuple[Optional[str], Optional[int], List[dict], Optional[int]]]:
+	# (previous summary, its watermark, messages after the watermark, last of those
+	# messages' id), leaving out the newest `keep` messages: the prompt still sends
+	# those verbatim, and the summary only stands in for what is older
+	sess = crud.get_session(db, session_id)
+	if sess is None:
+		return None
+	previous, watermark = sess.user_summary, sess.summary_message_id
+	rows = []
+	cursor = watermark or 0
+	while True:
+		page, has_more = crud.list_messages_page(db, session_id, after=cursor, limit=500)
+		rows += page
+		if page:
+			cursor = page[-1].id
+		if not has_more:
+			break
+	rows = rows[:max(0, len(rows) - keep)]
+	messages = [{"role": r.role, "content": r.content} for r in rows]
+	return previous, watermark, messages, rows[-1].id if rows else None
+
+
+def summarize_inline(db, session_id: int, keep: int) -> Optional[Tuple[str, int]]:
+	# Extractive summary for the turn's own transaction (no background worker):
+	# (summary, through message id), or None when nothing left the verbatim window
+	state = _read_new_messages(db, session_id, keep)
+	if state is None or not state[2]:
+		return None
+	previous, _, messages, through_id = state
+	return summarize_incremental(previous, messages, settings.summary_max_chars), through_id
+
+
+class SummaryWorker:
+	# Session summaries, off the request path. A finished turn calls schedule();
+	# the session waits summary_debounce seconds in a bounded queue, and turns
+	# arriving meanwhile are coalesced into that one job. A worker then reads the
+	# messages after the session's summary watermark, extends the previous summary
+	# with them and stores it with a compare-and-set on the watermark. Nothing is
+	# lost if a job is dropped or the process stops: the next job picks up every
+	# message after the watermark.
+	def __init__(self, workers: int, debounce: float, queue_size: int):
+		self.workers = workers
+		self.debounce = debounce
+		self.queue_size = queue_size
+		self._queue: Optional[asyncio.Queue] = None
+		self._pending: Set[int] = set()
+		self._tasks: List[asyncio.Task] = []
+		self._loop: Optional[asyncio.AbstractEventLoop] = None
+		self._hosted = False
+
+	@property
+	def enabled(self) -> bool:
+		# only under a lifespan: without one (serverless) the process may be frozen
+		# or killed after the response, so turns summarize inline instead
+		return self.workers > 0 and self._hosted
+
+	def start(self) -> None:
+		self._hosted = True
+		if self.workers > 0:
+			self._ensure_started()
+
+	def _ensure_started(self) -> None:
+		loop = asyncio.get_running_loop()
+		if self._loop is loop and self._tasks:
+			return
+		self._loop = loop
+		self._queue = asyncio.Queue(maxsize=self.queue_size)
+		self._pending.clear()
+		# a fresh context: jobs must not report into the request that started them
+		self._tasks = [
+			loop.create_task(self._run(), name=f"summary-worker-{i}", context=contextvars.Context())
+			for i in range(self.workers)
+		]
+
+	def schedule(self, session_id: int) -> None:
+		self._ensure_started()
+		if session_id in self._pending:
+			SUMMARY_JOBS.inc(result="coalesced")
+			return
+		try:
+			self._queue.put_nowait((time.monotonic() + self.debounce, session_id))
+		except asyncio.QueueFull:
+			SUMMARY_JOBS.inc(result="dropped")
+			return
+		self._pending.add(session_id)
+
+	async def _run(self) -> None:
+		while True:
+			due, session_id = await self._queue.get()
+			try:
+				delay = due - time.monotonic()
+				if delay > 0:
+					await asyncio.sleep(delay)
+				# turns committed from here on schedule a new job
+				self._pending.discard(session_id)
+				start = time.perf_counter()
+				SUMMARY_JOBS.inc(result=await self.summarize(session_id))
+				record_stage("summary", time.perf_counter() - start)
+			except asyncio.CancelledError:
+				raise
+			except Exception as e:
+				self._pending.discard(session_id)
+				SUMMARY_JOBS.inc(result="error")
+				print(f"[Summary failed for session {session_id}] {type(e).__name__}: {e}", file=sys.stderr)
+			finally:
+				self._queue.task_done()
+
+	async def summarize(self, session_id: int) -> str:
+		state = await run_db(_read_new_messages, session_id, 2 * settings.prompt_history_turns)
+		if state is None:
+			return "unchanged"
+		previous, watermark, messages, through_id = state
+		if not messages:
+			return "unchanged"
+		summary = await self._llm_summary(previous, messages)
+		if not summary:
+			summary = summarize_incremental(previous, messages, settings.summary_max_chars)
+		written = await run_db_write(crud.commit_summary, session_id, summary, through_id, watermark)
+		return "written" if written else "stale"
+
+	async def _llm_summary(self, previous: Optional[str], messages: List[dict]) -> Optional[str]:
+		# only with spare provider capacity; chat turns always come first
+		client = get_llm_client()
+		if client.active >= settings.summary_llm_max_active:
+			return None
+		# the previous summary already covers older turns; bound the prompt for long backlogs
+		lines = "\n".join(f"{m['role']}: {m['content'][:500]}" for m in messages[-40:])
+		try:
+			# never queues for an admission slot: when none is free the summary is extractive
+			reply = await client.chat([
+				{"role": "system", "content": SUMMARY_PROMPT.format(max_chars=settings.summary_max_chars)},
+				{"role": "user", "content": f"Current summary: {previous or '(none)'}\n\nNew messages:\n{lines}"},
+			], queue_timeout=0)
+		except Overloaded:
+			return None
+		if not reply or is_mock_reply(reply):
+			return None
+		return reply.strip()[:settings.summary_max_chars]
+
+	def stats(self) -> dict:
+		return {
+			"workers": len(self._tasks),
+			"queued": self._queue.qsize() if self._queue is not None else 0,
+			"pending": len(self._pending),
+		}
+
+	async def stop(self) -> None:
+		self._hosted = False
+		for task in self._tasks:
+			task.cancel()
+		for task in self._tasks:
+			try:
+				await task
+			except asyncio.CancelledError:
+				pass
+		self._tasks = []
+		self._pending.clear()
+
+
+summary_worker = SummaryWorker(settings.summary_workers, settings.summary_debounce, settings.summary_queue_size)
+registry.register(Gauge("summary_queue_depth", "Sessions waiting for a background summary", lambda: len(summary_worker._pending)))
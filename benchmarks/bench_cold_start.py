@@ -0,0 +1,150 @@
+"""Serverless cold start: fresh interpreter to first response byte.
+
+Each run starts a new interpreter the way a serverless platform does: it
+imports ``api.index`` and serves the first requests straight through the ASGI
+app, without lifespan events and without an HTTP client library in the
+process, against an empty SQLite database and a FAQ directory copied from a
+fresh checkout (source JSONL newer than the bundled index, as git leaves it).
+Reported per run (milliseconds from process spawn):
+
+* import      - ``api.index`` imported
+* health      - first byte of ``GET /health``
+* session     - first byte of ``POST /api/sessions`` (database ready)
+* chat        - first byte of the first chat turn (FAQ index, LLM client)
+
+The chat turn goes to the local mock LLM server (benchmarks/mock_llm_server.py).
+
+	python -m benchmarks.bench_cold_start --runs 10 --json results/cold_start.json
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+STEPS = ("import", "health", "session", "chat")
+
+
+async def _first_byte(app, method: str, path: str, body: bytes = b"") -> tuple:
+	# minimal ASGI client: returns (status, body) once the response is complete
+	# and records when its first byte (the start message) was sent
+	sent = False
+	first = None
+	status = None
+	chunks = []
+
+	async def receive():
+		nonlocal sent
+		if sent:
+			await asyncio.sleep(3600)
+		sent = True
+		return {"type": "http.request", "body": body, "more_body": False}
+
+	async def send(message):
+		nonlocal first, status
+		if message["type"] == "http.response.start":
+			first = time.time()
+			status = message["status"]
+		elif message["type"] == "http.response.body":
+			chunks.append(message.get("body", b""))
+
+	scope = {
+		"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+		"path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+		"headers": [(b"host", b"localhost"), (b"content-type", b"application/json")],
+		"client": ("127.0.0.1", 50000), "server": ("localhost", 80),
+	}
+	await app(scope, receive, send)
+	return status, b"".join(chunks), first
+
+
+def child(spawned: float) -> dict:
+	marks = {"boot": time.time()}
+	from api.index import app
+	marks["import"] = time.time()
+
+	async def run():
+		status, _, marks["health"] = await _first_byte(app, "GET", "/health")
+		assert status == 200, status
+		status, body, marks["session"] = await _first_byte(app, "POST", "/api/sessions", b"{}")
+		assert status == 200, (status, body)
+		session_id = json.loads(body)["id"]
+		status, body, marks["chat"] = await _first_byte(
+			app, "POST", f"/api/sessions/{session_id}/messages", json.dumps({"role": "user", "content": "How do I reset my password?"}).encode(),
+		)
+		assert status == 200, (status, body)
+
+	asyncio.run(run())
+	return {k: round((v - spawned) * 1000.0, 1) for k, v in marks.items()}
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--runs", type=int, default=10)
+	parser.add_argument("--faqs", default="data/faqs.jsonl")
+	parser.add_argument("--index", default="data/faqs.bm25", help="bundled index copied next to the FAQs (if it exists)")
+	parser.add_argument("--json", help="write results to this file")
+	parser.add_argument("--child", type=float, help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.child:
+		print(json.dumps(child(args.child)))
+		return
+
+	# imported here: the child interpreter should load nothing beyond the app
+	from benchmarks.mock_llm_server import MockLLMOptions, serve_in_thread
+	from benchmarks.stats import summarize, write_results
+
+	_, llm_url = serve_in_thread(MockLLMOptions())
+	runs = []
+	with tempfile.TemporaryDirectory() as tmp:
+		for i in range(args.runs):
+			workdir = Path(tmp) / str(i)
+			workdir.mkdir()
+			index = Path(args.index)
+			if index.exists():
+				shutil.copy(index, workdir / "faqs.bm25")
+				for sidecar in index.parent.glob(index.name + ".*"):
+					shutil.copy(sidecar, workdir / sidecar.name)
+			# checkouts don't preserve mtimes: the source may look newer than its index
+			shutil.copy(args.faqs, workdir / "faqs.jsonl")
+			env = dict(os.environ)
+			env.update({
+				"DATABASE_URL": f"sqlite:///{workdir / 'app.db'}",
+				"ANSWER_CACHE_PATH": str(workdir / "answer_cache.db"),
+				"FAQ_PATH": str(workdir / "faqs.jsonl"),
+				"FAQ_INDEX_PATH": str(workdir / "faqs.bm25"),
+				"FAQ_OPS_PATH": "",
+				"OR_BASE_URL": llm_url,
+				"OR_MODEL_NAME": "mock/chat",
+				"OPENROUTER_API_KEY": "mock",
+				"HF_API_BASE": f"{llm_url}/models",
+			})
+			spawned = time.time()
+			out = subprocess.run(
+				[sys.executable, "-m", "benchmarks.bench_cold_start", "--child", repr(spawned)],
+				capture_output=True, text=True, env=env,
+			)
+			if out.returncode:
+				raise RuntimeError(f"cold start run failed:\n{out.stderr}")
+			runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+	results = []
+	for step in ("boot",) + STEPS:
+		s = summarize([r[step] / 1000.0 for r in runs])
+		results.append({"step": step, **s})
+		print(f"{step:<8} p50={s['p50_ms']:8.1f}ms  max={s['max_ms']:8.1f}ms")
+
+	if args.json:
+		write_results(args.json, "cold_start", {k: v for k, v in vars(args).items() if k != "child"}, results)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,108 @@
+"""Resident memory of the FAQ index per repository mode.
+
+Each mode runs in a fresh interpreter, loads and indexes the same synthetic
+corpus and answers a few queries; RSS is read from /proc before and after,
+split into private memory and file-backed (shared, reclaimable) pages.
+
+* plain   - FAQRepository keeps every FAQ (id, question, answer) in memory
+* compact - FAQRepository(compact=True): byte offsets only, text decoded on demand
+* mmap    - prebuilt binary index opened with index_store.open_index
+
+	python -m benchmarks.bench_faq_memory --docs 200000 --json results/faq_memory.json
+"""
+from __future__ import annotations
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks.bench_retrieve_many import write_corpus
+from benchmarks.stats import write_results
+
+
+MODES = ("plain", "compact", "mmap")
+
+
+def rss_mb() -> dict:
+	# total resident set, split into private (anon) and file-backed pages; mapped
+	# index/JSONL pages are shared across workers and reclaimable by the kernel
+	out = {}
+	with open("/proc/self/status") as f:
+		for line in f:
+			key = line.split(":")[0]
+			if key in ("VmRSS", "RssAnon", "RssFile"):
+				out[key] = int(line.split()[1]) / 1024.0
+	return out
+
+
+def measure(mode: str, source: str, index_path: str) -> dict:
+	import gc
+	import time
+
+	from app.faq_loader import FAQRepository
+	from app.index_store import open_index
+	from app.retriever import BM25FAQRetriever
+
+	gc.collect()
+	before = rss_mb()
+	t0 = time.perf_counter()
+	if mode == "mmap":
+		retriever = open_index(index_path, FAQRepository(source))
+	else:
+		retriever = BM25FAQRetriever(FAQRepository(source, compact=(mode == "compact")))
+		retriever.build()
+	load_s = time.perf_counter() - t0
+	answers = [r.faq.answer for q in ("term1 term2", "term10 term200", "term3") for r in retriever.retrieve(q, 5)]
+	gc.collect()
+	after = rss_mb()
+	return {
+		"mode": mode,
+		"rss_before_mb": round(before["VmRSS"], 1),
+		"rss_after_mb": round(after["VmRSS"], 1),
+		"anon_delta_mb": round(after["RssAnon"] - before["RssAnon"], 1),
+		"file_delta_mb": round(after["RssFile"] - before["RssFile"], 1),
+		"load_s": round(load_s, 3),
+		"answers": len(answers),
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--docs", type=int, default=200000)
+	parser.add_argument("--vocab", type=int, default=20000)
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--json", help="write results to this file")
+	parser.add_argument("--child", nargs=3, metavar=("MODE", "SOURCE", "INDEX"), help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.child:
+		print(json.dumps(measure(*args.child)))
+		return
+
+	results = []
+	with tempfile.TemporaryDirectory() as tmp:
+		source = Path(tmp) / "faqs.jsonl"
+		index_path = Path(tmp) / "faqs.bm25"
+		write_corpus(source, args.docs, args.vocab, args.seed)
+		subprocess.run([sys.executable, "-m", "app.index_store", str(source), str(index_path)], check=True, capture_output=True)
+		print(f"docs={args.docs} jsonl={source.stat().st_size / 1e6:.1f}MB index={index_path.stat().st_size / 1e6:.1f}MB")
+		for mode in MODES:
+			out = subprocess.run(
+				[sys.executable, "-m", "benchmarks.bench_faq_memory", "--child", mode, str(source), str(index_path)],
+				check=True, capture_output=True, text=True,
+			)
+			r = json.loads(out.stdout.strip().splitlines()[-1])
+			results.append(r)
+			print(
+				f"{mode:<8} RSS {r['rss_before_mb']:7.1f}MB -> {r['rss_after_mb']:7.1f}MB "
+				f"(private +{r['anon_delta_mb']:.1f}MB, file-backed +{r['file_delta_mb']:.1f}MB) load={r['load_s']:.2f}s"
+			)
+
+	if args.json:
+		write_results(args.json, "faq_memory", {k: v for k, v in vars(args).items() if k != "child"}, results)
+
+
+if __name__ == "__main__":
+	main()
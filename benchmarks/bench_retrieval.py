@@ -0,0 +1,108 @@
+"""Microbenchmarks for tokenizing, building and querying the BM25 FAQ index.
+
+For each synthetic corpus size, measures:
+
+* tokenize - ``_tokenize`` per FAQ text (latency per call and texts/s)
+* build    - ``BM25FAQRetriever.build`` (load + index, seconds)
+* index    - writing and memory-mapping the binary index (seconds)
+* retrieve - ``retrieve`` per query on the in-memory and the mmap index, and
+  with top-k pruning turned off (``retrieve_exhaustive``)
+
+	python -m benchmarks.bench_retrieval --sizes 1000,10000,100000 --json results/retrieval.json
+	python -m benchmarks.bench_retrieval --sizes 1000000 --queries 200
+"""
+from __future__ import annotations
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from app.config import settings
+from app.faq_loader import FAQRepository
+from app.index_store import open_index, write_index
+from app.retriever import BM25FAQRetriever, _tokenize
+from benchmarks.bench_retrieve_many import write_corpus
+from benchmarks.stats import format_row, summarize, write_results
+
+
+def time_each(fn: Callable, items: List) -> tuple[List[float], float]:
+	latencies = []
+	t_start = time.perf_counter()
+	for item in items:
+		t0 = time.perf_counter()
+		fn(item)
+		latencies.append(time.perf_counter() - t0)
+	return latencies, time.perf_counter() - t_start
+
+
+def bench_size(n_docs: int, args, workdir: Path) -> dict:
+	source = workdir / f"faqs-{n_docs}.jsonl"
+	words = write_corpus(source, n_docs, args.vocab, args.seed)
+	rng = random.Random(args.seed + 1)
+	queries = [" ".join(rng.choices(words, k=rng.randint(2, 8))) for _ in range(args.queries)]
+	result = {"docs": n_docs}
+
+	repo = FAQRepository(source)
+	retriever = BM25FAQRetriever(repo)
+	t0 = time.perf_counter()
+	retriever.build()
+	result["build_s"] = round(time.perf_counter() - t0, 4)
+
+	texts = [f"{f.question} {f.answer}" for f in repo.all()[:args.tokenize_sample]]
+	lat, elapsed = time_each(_tokenize, texts)
+	result["tokenize"] = summarize(lat, elapsed)
+
+	lat, elapsed = time_each(lambda q: retriever.retrieve(q, args.top_k), queries)
+	result["retrieve"] = summarize(lat, elapsed)
+
+	pruning, settings.retriever_pruning = settings.retriever_pruning, False
+	try:
+		lat, elapsed = time_each(lambda q: retriever.retrieve(q, args.top_k), queries)
+	finally:
+		settings.retriever_pruning = pruning
+	result["retrieve_exhaustive"] = summarize(lat, elapsed)
+
+	index_path = workdir / f"faqs-{n_docs}.bm25"
+	t0 = time.perf_counter()
+	write_index(retriever, index_path)
+	result["index_write_s"] = round(time.perf_counter() - t0, 4)
+	result["index_bytes"] = index_path.stat().st_size
+	del retriever, repo
+
+	t0 = time.perf_counter()
+	mapped = open_index(index_path, FAQRepository(source))
+	result["index_open_s"] = round(time.perf_counter() - t0, 4)
+	lat, elapsed = time_each(lambda q: mapped.retrieve(q, args.top_k), queries)
+	result["retrieve_mmap"] = summarize(lat, elapsed)
+	return result
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated corpus sizes, e.g. 1000,10000,100000,1000000")
+	parser.add_argument("--queries", type=int, default=1000)
+	parser.add_argument("--tokenize-sample", type=int, default=10000, help="FAQ texts to tokenize per size")
+	parser.add_argument("--vocab", type=int, default=20000)
+	parser.add_argument("--top-k", type=int, default=5)
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--json", help="write results to this file")
+	args = parser.parse_args()
+	sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+	results = []
+	with tempfile.TemporaryDirectory() as tmp:
+		for n_docs in sizes:
+			r = bench_size(n_docs, args, Path(tmp))
+			results.append(r)
+			print(f"== docs={n_docs} build={r['build_s']:.2f}s index write={r['index_write_s']:.2f}s open={r['index_open_s']:.3f}s size={r['index_bytes'] / 1e6:.1f}MB")
+			for name in ("tokenize", "retrieve", "retrieve_exhaustive", "retrieve_mmap"):
+				print("  " + format_row(name, r[name]))
+
+	if args.json:
+		write_results(args.json, "retrieval", vars(args), results)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,71 @@
+"""Compare BM25FAQRetriever.retrieve in a loop with the batched retrieve_many.
+
+	python -m benchmarks.bench_retrieve_many --docs 20000 --queries 2000
+"""
+from __future__ import annotations
+import argparse
+import itertools
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from app.faq_loader import FAQRepository
+from app.retriever import BM25FAQRetriever
+
+
+def write_corpus(path: Path, n_docs: int, vocab_size: int, seed: int) -> list[str]:
+	rng = random.Random(seed)
+	words = [f"term{i}" for i in range(vocab_size)]
+	# Zipf-ish weights so a few terms are common, like real FAQ text
+	cum_weights = list(itertools.accumulate(1.0 / (i + 1) for i in range(vocab_size)))
+	with path.open("w", encoding="utf-8") as f:
+		for i in range(n_docs):
+			question = " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(4, 12)))
+			answer = " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(10, 40)))
+			f.write(json.dumps({"id": f"faq_{i}", "question": question, "answer": answer}) + "\n")
+	return words
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--docs", type=int, default=20000)
+	parser.add_argument("--queries", type=int, default=2000)
+	parser.add_argument("--vocab", type=int, default=5000)
+	parser.add_argument("--top-k", type=int, default=5)
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		path = Path(tmp) / "faqs.jsonl"
+		words = write_corpus(path, args.docs, args.vocab, args.seed)
+		retriever = BM25FAQRetriever(FAQRepository(path))
+		t0 = time.perf_counter()
+		retriever.build()
+		build_s = time.perf_counter() - t0
+
+	rng = random.Random(args.seed + 1)
+	queries = [" ".join(rng.choices(words, k=rng.randint(2, 8))) for _ in range(args.queries)]
+
+	t0 = time.perf_counter()
+	looped = [retriever.retrieve(q, args.top_k) for q in queries]
+	loop_s = time.perf_counter() - t0
+
+	retriever.retrieve_many(queries[:1], args.top_k)  # warm the posting weights
+	t0 = time.perf_counter()
+	batched = retriever.retrieve_many(queries, args.top_k)
+	batch_s = time.perf_counter() - t0
+
+	same = all(
+		[(r.faq.id, r.score) for r in a] == [(r.faq.id, r.score) for r in b]
+		for a, b in zip(looped, batched)
+	)
+	print(f"docs={args.docs} queries={args.queries} top_k={args.top_k} build={build_s:.2f}s")
+	print(f"retrieve loop : {loop_s:.3f}s ({args.queries / loop_s:,.0f} q/s)")
+	print(f"retrieve_many : {batch_s:.3f}s ({args.queries / batch_s:,.0f} q/s)")
+	print(f"speedup x{loop_s / batch_s:.1f}, identical results: {same}")
+
+
+if __name__ == "__main__":
+	main()
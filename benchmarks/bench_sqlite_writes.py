@@ -0,0 +1,111 @@
+"""Concurrent chat-turn writes against SQLite, default vs production profile.
+
+Each writer thread commits chat turns (user + assistant message in one
+transaction, as the chat endpoint does) while reader threads page through
+history. Reports turns/s, reads/s and "database is locked" failures for:
+
+* default    - SQLite defaults (rollback journal, synchronous=FULL)
+* production - WAL + tuned pragmas, writers contending directly
+* queued     - production profile with writes funneled through one writer thread
+
+	python -m benchmarks.bench_sqlite_writes --writers 16 --turns 200 --readers 4
+"""
+from __future__ import annotations
+import argparse
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app import crud
+from app.database import Base, create_db_engine
+
+
+def run(profile: str, queued: bool, writers: int, turns: int, readers: int, workdir: Path) -> dict:
+	engine = create_db_engine(f"sqlite:///{workdir / f'{profile}-{queued}.db'}", sqlite_profile=profile)
+	Base.metadata.create_all(engine)
+	Session = sessionmaker(bind=engine, autoflush=False)
+	with Session() as db:
+		session_ids = [crud.create_session(db, None).id for _ in range(writers)]
+
+	errors = 0
+	reads = 0
+	lock = threading.Lock()
+	stop = threading.Event()
+	writer_queue = ThreadPoolExecutor(max_workers=1) if queued else None
+
+	def commit(session_id: int, i: int):
+		with Session() as db:
+			crud.commit_turn(db, session_id, [
+				{"role": "user", "content": f"question {i}"},
+				{"role": "assistant", "content": f"answer {i} " * 20, "confidence": 1.0, "needs_escalation": False},
+			])
+
+	def writer(session_id: int):
+		nonlocal errors
+		for i in range(turns):
+			try:
+				if writer_queue is not None:
+					writer_queue.submit(commit, session_id, i).result()
+				else:
+					commit(session_id, i)
+			except OperationalError:
+				with lock:
+					errors += 1
+
+	def reader():
+		nonlocal reads
+		n = 0
+		while not stop.is_set():
+			with Session() as db:
+				crud.list_messages_page(db, session_ids[n % len(session_ids)], limit=50)
+			n += 1
+		with lock:
+			reads += n
+
+	reader_threads = [threading.Thread(target=reader) for _ in range(readers)]
+	writer_threads = [threading.Thread(target=writer, args=(sid,)) for sid in session_ids]
+	t0 = time.perf_counter()
+	for t in reader_threads + writer_threads:
+		t.start()
+	for t in writer_threads:
+		t.join()
+	elapsed = time.perf_counter() - t0
+	stop.set()
+	for t in reader_threads:
+		t.join()
+	if writer_queue is not None:
+		writer_queue.shutdown()
+	engine.dispose()
+	done = writers * turns - errors
+	return {
+		"mode": "queued" if queued else profile,
+		"turns_per_s": done / elapsed,
+		"reads_per_s": reads / elapsed,
+		"locked_errors": errors,
+		"seconds": elapsed,
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--writers", type=int, default=16)
+	parser.add_argument("--turns", type=int, default=200)
+	parser.add_argument("--readers", type=int, default=4)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		for profile, queued in (("default", False), ("production", False), ("production", True)):
+			r = run(profile, queued, args.writers, args.turns, args.readers, Path(tmp))
+			print(
+				f"{r['mode']:<11} {r['turns_per_s']:8.0f} turns/s {r['reads_per_s']:8.0f} reads/s "
+				f"{r['locked_errors']:5d} locked errors ({r['seconds']:.1f}s)"
+			)
+
+
+if __name__ == "__main__":
+	main()
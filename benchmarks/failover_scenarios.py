@@ -0,0 +1,74 @@
+"""Exercise provider routing against local stand-in servers.
+
+Runs a few scenarios through LLMClient.chat and prints turn latency plus the
+circuit-breaker view from LLMClient.provider_health():
+
+* failing primary: OpenRouter returns 503s until its breaker opens and turns go
+  straight to the fallback
+* slow primary: OpenRouter answers after 3s; with hedging the fallback is started
+  after the primary's p95 and wins
+
+	python -m benchmarks.failover_scenarios
+"""
+from __future__ import annotations
+import asyncio
+import json
+import time
+
+from app.config import settings
+from app import llm
+from benchmarks.mock_llm_server import MockLLMOptions, serve_in_thread
+
+
+def make_client(or_url: str, hf_url: str) -> llm.LLMClient:
+	settings.openrouter_base_url = or_url
+	settings.hf_api_base = f"{hf_url}/models"
+	settings.hf_model_name = "stand-in/fallback"
+	settings.llm_coalesce = False
+	llm.FALLBACK_MODELS[:] = []
+	return llm.LLMClient()
+
+
+async def run_turns(client: llm.LLMClient, n: int) -> list[float]:
+	latencies = []
+	for i in range(n):
+		t0 = time.perf_counter()
+		await client.chat([{"role": "user", "content": f"question {i}"}])
+		latencies.append(time.perf_counter() - t0)
+	return latencies
+
+
+async def failing_primary():
+	_, or_url = serve_in_thread(MockLLMOptions(latency=0.2, fail_rate=1.0))
+	_, hf_url = serve_in_thread(MockLLMOptions(latency=0.05))
+	settings.llm_hedge = False
+	settings.llm_breaker_cooldown = 60.0
+	client = make_client(or_url, hf_url)
+	latencies = await run_turns(client, 10)
+	report("failing primary", latencies, client)
+
+
+async def slow_primary(hedge: bool):
+	_, or_url = serve_in_thread(MockLLMOptions(latency=3.0, jitter=0.1))
+	_, hf_url = serve_in_thread(MockLLMOptions(latency=0.1))
+	settings.llm_hedge = hedge
+	settings.llm_hedge_default_delay = 0.5
+	settings.llm_breaker_slow_call = 10.0
+	client = make_client(or_url, hf_url)
+	latencies = await run_turns(client, 5)
+	report(f"slow primary, hedge={hedge}", latencies, client)
+
+
+def report(name: str, latencies: list[float], client: llm.LLMClient):
+	print(f"== {name}: turn latency " + " ".join(f"{x:.2f}s" for x in latencies))
+	print(json.dumps(client.provider_health(), indent=2))
+
+
+async def main():
+	await failing_primary()
+	await slow_primary(hedge=False)
+	await slow_primary(hedge=True)
+
+
+if __name__ == "__main__":
+	asyncio.run(main())
@@ -0,0 +1,254 @@
+"""Drive the chat endpoint at fixed concurrency and report latency per stage.
+
+Each stage runs ``concurrency`` workers until ``requests`` chat turns have been
+sent. A worker opens a session, sends ``--turns-per-session`` questions into it
+and then starts a new one, so prompts carry realistic history. Per stage it
+reports p50/p95/p99 latency and RPS of the full answers, errors (plus time to
+first token with ``--stream``) and, apart from those, the turns the app shed:
+rate limited (429), rejected as overloaded (503) and degraded to an FAQ-only
+answer (``X-Degraded``).
+
+Without ``--url`` the app is started under uvicorn on a free port with a
+temporary SQLite database and ``OR_BASE_URL``/``HF_API_BASE`` pointed at the
+local mock LLM server (benchmarks/mock_llm_server.py). Its per-client rate
+limits are off unless ``--rate-limit-*`` is given, since every worker shares one
+IP; ``--llm-max-active`` etc. override the admission settings:
+
+	python -m benchmarks.load_test --stages 1x50,8x200,32x400 --llm-latency 0.3 --json results/load.json
+	python -m benchmarks.load_test --url http://127.0.0.1:8000 --stages 16x500 --stream
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import httpx
+
+from benchmarks.mock_llm_server import MockLLMOptions, serve_in_thread
+from benchmarks.stats import format_row, summarize, write_results
+
+
+OFF_TOPIC = [
+	"Can you help me plan a birthday party?",
+	"What's the weather like on Mars?",
+	"My order arrived damaged and the box was wet, what now?",
+]
+
+
+def parse_stages(spec: str) -> List[Tuple[int, int]]:
+	stages = []
+	for part in spec.split(","):
+		concurrency, requests = part.lower().split("x")
+		stages.append((int(concurrency), int(requests)))
+	return stages
+
+
+def load_questions(path: str) -> List[str]:
+	questions = list(OFF_TOPIC)
+	try:
+		with open(path, "r", encoding="utf-8") as f:
+			questions += [json.loads(line)["question"] for line in f if line.strip()]
+	except OSError:
+		pass
+	return questions
+
+
+class Stage:
+	def __init__(self, total: int):
+		self.remaining = total
+		self.latencies: List[float] = []
+		self.ttft: List[float] = []
+		self.statuses: Counter = Counter()
+		self.errors = 0
+		self.degraded = 0
+
+	def take(self) -> bool:
+		if self.remaining <= 0:
+			return False
+		self.remaining -= 1
+		return True
+
+
+async def send_turn(client: httpx.AsyncClient, session_id: int, question: str, stream: bool, stage: Stage) -> None:
+	path = f"/api/sessions/{session_id}/messages" + ("/stream" if stream else "")
+	body = {"role": "user", "content": question}
+	t0 = time.perf_counter()
+	try:
+		if stream:
+			async with client.stream("POST", path, json=body) as resp:
+				status = resp.status_code
+				first = None
+				ok = False
+				degraded = "x-degraded" in resp.headers
+				async for line in resp.aiter_lines():
+					if first is None and line.startswith("event: token"):
+						first = time.perf_counter() - t0
+					if line.startswith("event: done"):
+						ok = True
+				if first is not None:
+					stage.ttft.append(first)
+				if not ok:
+					status = status if status >= 400 else 599
+		else:
+			resp = await client.post(path, json=body)
+			status = resp.status_code
+			degraded = "x-degraded" in resp.headers
+	except httpx.HTTPError:
+		status = 0
+	stage.statuses[status] += 1
+	if status == 200 and degraded:
+		# shed to an FAQ-only answer: counted apart, not in the latency stats
+		stage.degraded += 1
+	elif status == 200:
+		stage.latencies.append(time.perf_counter() - t0)
+	elif status not in (429, 503):
+		stage.errors += 1
+
+
+async def worker(client: httpx.AsyncClient, stage: Stage, questions: List[str], args, rng: random.Random) -> None:
+	session_id: Optional[int] = None
+	turns = 0
+	while stage.take():
+		if session_id is None or turns >= args.turns_per_session:
+			try:
+				resp = await client.post("/api/sessions", json={})
+				resp.raise_for_status()
+				session_id = resp.json()["id"]
+			except httpx.HTTPError:
+				stage.errors += 1
+				stage.statuses[0] += 1
+				continue
+			turns = 0
+		question = rng.choice(questions)
+		if not args.repeat:
+			# vary the text so the answer cache doesn't turn the run into a cache benchmark
+			question = f"{question} (ref {rng.randrange(1_000_000)})"
+		await send_turn(client, session_id, question, args.stream, stage)
+		turns += 1
+
+
+async def run_stage(base_url: str, concurrency: int, total: int, questions: List[str], args, seed: int) -> dict:
+	limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+	async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+		stage = Stage(total)
+		t0 = time.perf_counter()
+		await asyncio.gather(*[
+			worker(client, stage, questions, args, random.Random(seed * 1000 + i)) for i in range(concurrency)
+		])
+		elapsed = time.perf_counter() - t0
+	result = {"concurrency": concurrency, "requests": total}
+	result.update(summarize(stage.latencies, elapsed, stage.errors))
+	result["statuses"] = {str(k): v for k, v in sorted(stage.statuses.items())}
+	result["shed"] = {"rate_limited": stage.statuses[429], "overloaded": stage.statuses[503], "degraded": stage.degraded}
+	if args.stream:
+		result["ttft"] = summarize(stage.ttft)
+	return result
+
+
+def _free_port() -> int:
+	with socket.socket() as s:
+		s.bind(("127.0.0.1", 0))
+		return s.getsockname()[1]
+
+
+def start_app(args, workdir: Path) -> Tuple[subprocess.Popen, str]:
+	_, llm_url = serve_in_thread(MockLLMOptions(
+		latency=args.llm_latency, jitter=args.llm_jitter, fail_rate=args.llm_fail_rate, token_delay=args.llm_token_delay,
+	))
+	port = _free_port()
+	env = dict(os.environ)
+	env.update({
+		"DATABASE_URL": f"sqlite:///{workdir / 'load.db'}",
+		"OR_BASE_URL": llm_url,
+		"OR_MODEL_NAME": "mock/chat",
+		"OPENROUTER_API_KEY": "mock",
+		"HF_API_BASE": f"{llm_url}/models",
+		"ANSWER_CACHE_PATH": str(workdir / "answer_cache.db"),
+		"RATE_LIMIT_IP_PER_MINUTE": str(args.rate_limit_ip),
+		"RATE_LIMIT_SESSION_PER_MINUTE": str(args.rate_limit_session),
+	})
+	for name in ("llm_max_active", "llm_max_queue", "llm_queue_timeout", "llm_overload_mode"):
+		if getattr(args, name) is not None:
+			env[name.upper()] = str(getattr(args, name))
+	proc = subprocess.Popen(
+		[sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+		env=env,
+	)
+	base_url = f"http://127.0.0.1:{port}"
+	deadline = time.monotonic() + 30
+	while time.monotonic() < deadline:
+		if proc.poll() is not None:
+			raise RuntimeError(f"app exited with code {proc.returncode}")
+		try:
+			if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+				return proc, base_url
+		except httpx.HTTPError:
+			pass
+		time.sleep(0.2)
+	proc.terminate()
+	raise RuntimeError("app did not become healthy within 30s")
+
+
+async def run(base_url: str, args) -> List[dict]:
+	questions = load_questions(args.faqs)
+	results = []
+	for i, (concurrency, total) in enumerate(parse_stages(args.stages)):
+		r = await run_stage(base_url, concurrency, total, questions, args, args.seed + i)
+		results.append(r)
+		print(format_row(f"c={concurrency}", r))
+		print("  shed: " + " ".join(f"{k}={v}" for k, v in r["shed"].items()))
+		if args.stream:
+			print("  " + format_row("time to first token", r["ttft"]))
+	return results
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--url", help="target an already running app instead of starting one")
+	parser.add_argument("--stages", default="1x50,8x200,32x400", help="comma-separated CONCURRENCYxREQUESTS")
+	parser.add_argument("--turns-per-session", type=int, default=6)
+	parser.add_argument("--stream", action="store_true", help="use the SSE stream endpoint")
+	parser.add_argument("--repeat", action="store_true", help="send FAQ questions verbatim (lets the answer cache hit)")
+	parser.add_argument("--timeout", type=float, default=120.0)
+	parser.add_argument("--faqs", default="data/faqs.jsonl")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--llm-latency", type=float, default=0.3, help="mock LLM latency (spawned app only)")
+	parser.add_argument("--llm-jitter", type=float, default=0.05)
+	parser.add_argument("--llm-fail-rate", type=float, default=0.0)
+	parser.add_argument("--llm-token-delay", type=float, default=0.01)
+	parser.add_argument("--rate-limit-ip", type=float, default=0.0, help="per-IP turns per minute, 0 for off (spawned app only)")
+	parser.add_argument("--rate-limit-session", type=float, default=0.0, help="per-session turns per minute, 0 for off (spawned app only)")
+	parser.add_argument("--llm-max-active", type=int, help="admission: LLM calls in flight (spawned app only)")
+	parser.add_argument("--llm-max-queue", type=int, help="admission: turns waiting for a slot (spawned app only)")
+	parser.add_argument("--llm-queue-timeout", type=float, help="admission: seconds a turn may wait (spawned app only)")
+	parser.add_argument("--llm-overload-mode", choices=("faq", "reject"), help="admission: answer shed turns from FAQs or with 503 (spawned app only)")
+	parser.add_argument("--json", help="write results to this file")
+	args = parser.parse_args()
+
+	if args.url:
+		results = asyncio.run(run(args.url.rstrip("/"), args))
+	else:
+		with tempfile.TemporaryDirectory() as tmp:
+			proc, base_url = start_app(args, Path(tmp))
+			try:
+				results = asyncio.run(run(base_url, args))
+			finally:
+				proc.terminate()
+				proc.wait(timeout=30)
+
+	if args.json:
+		write_results(args.json, "load", vars(args), results)
+
+
+if __name__ == "__main__":
+	main()
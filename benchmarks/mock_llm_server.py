@@ -0,0 +1,132 @@
+"""Local stand-in for the LLM providers, for load and failover testing.
+
+Serves an OpenAI-compatible ``POST /chat/completions`` (point ``OR_BASE_URL`` at
+it) and the Hugging Face style ``POST /models/<name>`` (point ``HF_API_BASE`` at
+``<url>/models``), with configurable latency and failure injection.
+
+	python -m benchmarks.mock_llm_server --port 8900 --latency 0.5 --fail-rate 0.1
+"""
+from __future__ import annotations
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+
+class MockLLMOptions:
+	def __init__(
+		self,
+		latency: float = 0.0,
+		jitter: float = 0.0,
+		fail_rate: float = 0.0,
+		fail_status: int = 503,
+		token_delay: float = 0.0,
+		reply: str = "This is a stand-in answer from the local mock LLM server.",
+	):
+		self.latency = latency
+		self.jitter = jitter
+		self.fail_rate = fail_rate
+		self.fail_status = fail_status
+		self.token_delay = token_delay
+		self.reply = reply
+		self.requests = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+	options: MockLLMOptions
+
+	def log_message(self, format, *args):  # keep benchmark output clean
+		pass
+
+	def do_GET(self):
+		if self.path.rstrip("/").endswith("/health"):
+			self._json(200, {"status": "ok", "requests": self.options.requests})
+		else:
+			self._json(404, {"error": "not found"})
+
+	def do_POST(self):
+		opts = self.options
+		opts.requests += 1
+		length = int(self.headers.get("Content-Length") or 0)
+		body = json.loads(self.rfile.read(length) or b"{}")
+		time.sleep(max(0.0, opts.latency + random.uniform(-opts.jitter, opts.jitter)))
+		if random.random() < opts.fail_rate:
+			self._json(opts.fail_status, {"error": {"message": "injected failure", "code": opts.fail_status}})
+			return
+		if self.path.rstrip("/").endswith("/chat/completions"):
+			if body.get("stream"):
+				self._stream_chat(body)
+			else:
+				self._json(200, {
+					"id": "mock",
+					"object": "chat.completion",
+					"model": body.get("model", "mock"),
+					"choices": [{"index": 0, "message": {"role": "assistant", "content": opts.reply}, "finish_reason": "stop"}],
+				})
+		elif "/models/" in self.path:
+			self._json(200, [{"generated_text": opts.reply}])
+		else:
+			self._json(404, {"error": "not found"})
+
+	def _stream_chat(self, body: dict):
+		self.send_response(200)
+		self.send_header("Content-Type", "text/event-stream")
+		self.send_header("Transfer-Encoding", "chunked")
+		self.end_headers()
+		self._chunk(b": mock processing\n\n")
+		for word in self.options.reply.split(" "):
+			chunk = {"choices": [{"index": 0, "delta": {"content": word + " "}}]}
+			self._chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+			if self.options.token_delay:
+				time.sleep(self.options.token_delay)
+		self._chunk(b"data: [DONE]\n\n")
+		self._chunk(b"")
+
+	def _chunk(self, data: bytes):
+		self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+		self.wfile.flush()
+
+	def _json(self, status: int, obj):
+		data = json.dumps(obj).encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+
+def make_server(host: str = "127.0.0.1", port: int = 0, options: MockLLMOptions | None = None) -> ThreadingHTTPServer:
+	handler = type("MockLLMHandler", (_Handler,), {"options": options or MockLLMOptions()})
+	server = ThreadingHTTPServer((host, port), handler)
+	server.daemon_threads = True
+	return server
+
+
+def serve_in_thread(options: MockLLMOptions | None = None, host: str = "127.0.0.1", port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+	server = make_server(host, port, options)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8900)
+	parser.add_argument("--latency", type=float, default=0.0, help="seconds before responding")
+	parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds added to latency")
+	parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests that fail")
+	parser.add_argument("--fail-status", type=int, default=503)
+	parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed tokens")
+	args = parser.parse_args()
+	options = MockLLMOptions(args.latency, args.jitter, args.fail_rate, args.fail_status, args.token_delay)
+	server = make_server(args.host, args.port, options)
+	print(f"mock LLM server on http://{args.host}:{server.server_address[1]}")
+	server.serve_forever()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,70 @@
+"""Latency summaries and machine-readable result files shared by the benchmarks."""
+from __future__ import annotations
+import json
+import math
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+
+def percentile(sorted_samples: List[float], q: float) -> Optional[float]:
+	if not sorted_samples:
+		return None
+	# nearest rank
+	idx = min(len(sorted_samples) - 1, max(0, math.ceil(q * len(sorted_samples)) - 1))
+	return sorted_samples[idx]
+
+
+def summarize(samples: List[float], elapsed: Optional[float] = None, errors: int = 0) -> dict:
+	# samples are seconds; latencies are reported in milliseconds
+	s = sorted(samples)
+	ms = lambda v: None if v is None else round(v * 1000.0, 3)
+	out = {
+		"count": len(s),
+		"errors": errors,
+		"p50_ms": ms(percentile(s, 0.50)),
+		"p95_ms": ms(percentile(s, 0.95)),
+		"p99_ms": ms(percentile(s, 0.99)),
+		"mean_ms": ms(sum(s) / len(s)) if s else None,
+		"max_ms": ms(s[-1]) if s else None,
+	}
+	if elapsed is not None:
+		out["seconds"] = round(elapsed, 4)
+		out["rps"] = round(len(s) / elapsed, 2) if elapsed > 0 else None
+	return out
+
+
+def format_row(name: str, summary: dict) -> str:
+	fmt = lambda v: "-" if v is None else f"{v:.2f}"
+	row = f"{name:<24} n={summary['count']:<7} p50={fmt(summary['p50_ms'])}ms p95={fmt(summary['p95_ms'])}ms p99={fmt(summary['p99_ms'])}ms"
+	if "rps" in summary:
+		row += f" rps={fmt(summary['rps'])}"
+	if summary.get("errors"):
+		row += f" errors={summary['errors']}"
+	return row
+
+
+def _git_rev() -> Optional[str]:
+	try:
+		out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+		return out.stdout.strip() or None
+	except Exception:
+		return None
+
+
+def write_results(path: str | Path, benchmark: str, params: dict, results) -> None:
+	payload = {
+		"benchmark": benchmark,
+		"timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+		"git_rev": _git_rev(),
+		"python": sys.version.split()[0],
+		"platform": platform.platform(),
+		"params": params,
+		"results": results,
+	}
+	path = Path(path)
+	path.parent.mkdir(parents=True, exist_ok=True)
+	path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
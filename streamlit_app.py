@@ -1,8 +1,10 @@
+import asyncio
 import os
+import queue
+import threading
 import streamlit as st
 
-from app.faq_loader import FAQRepository
-from app.retriever import BM25FAQRetriever
+from app.index_store import load_retriever
 from app.llm import LLMClient
 from app.config import settings
 
@@ -20,17 +22,60 @@ if "OR_BASE_URL" in st.secrets:
 if "messages" not in st.session_state:
 	st.session_state.messages = []
 
-repo = FAQRepository(path="data/faqs.jsonl")
-retriever = BM25FAQRetriever(repo)
-llm = LLMClient()
+
+# The script re-runs on every interaction; the index, the LLM client and its
+# event loop are built once per process and shared by every user session.
+@st.cache_resource
+def get_retriever():
+	# memory-mapped binary index when available (see app.index_store)
+	return load_retriever(settings.faq_path, settings.faq_index_path or None)
+
+
+@st.cache_resource
+def get_llm_loop() -> asyncio.AbstractEventLoop:
+	# LLM calls run on one long-lived loop, so its keep-alive connection pool is reused
+	loop = asyncio.new_event_loop()
+	threading.Thread(target=loop.run_forever, name="llm-loop", daemon=True).start()
+	return loop
+
+
+@st.cache_resource
+def get_llm(model: str) -> LLMClient:
+	client = LLMClient()
+	if model:
+		client._or_model = model.strip()
+	return client
+
+
+def stream_answer(llm: LLMClient, messages: list):
+	# Bridges LLMClient.chat_stream on the shared loop to the script thread, for st.write_stream
+	deltas: queue.Queue = queue.Queue()
+
+	async def pump():
+		try:
+			async for delta in llm.chat_stream(messages):
+				deltas.put(delta)
+		finally:
+			deltas.put(None)
+
+	future = asyncio.run_coroutine_threadsafe(pump(), get_llm_loop())
+	try:
+		while (delta := deltas.get()) is not None:
+			yield delta
+		future.result()
+	finally:
+		# the rerun was interrupted (new input or the user left): stop the upstream call
+		future.cancel()
+
 
 with st.sidebar:
 	st.markdown("### Settings")
 	model = st.text_input("Model", os.getenv("OR_MODEL_NAME", settings.openrouter_model_name))
-	if model:
-		os.environ["OR_MODEL_NAME"] = model
 	st.caption("OpenRouter key is read from secrets or env.")
 
+retriever = get_retriever()
+llm = get_llm(model)
+
 for m in st.session_state.messages:
 	role = m.get("role", "assistant")
 	with st.chat_message(role):
@@ -55,16 +100,5 @@ if prompt:
 	messages_llm = [system] + st.session_state.messages
 
 	with st.chat_message("assistant"):
-		with st.spinner("Thinking…"):
-			answer = st.session_state.get("_last_answer")
-			try:
-				answer = st.session_state.get("_last_answer") or st.run_async(llm.chat(messages_llm))
-			except Exception:
-				# Fallback to sync call (Streamlit Cloud may not support experimental async)
-				answer = st.session_state.get("_last_answer")
-				if not answer:
-					import asyncio
-					answer = asyncio.run(llm.chat(messages_llm))
-			st.markdown(answer)
-			st.session_state.messages.append({"role": "assistant", "content": answer})
-			st.session_state["_last_answer"] = answer
+		answer = st.write_stream(stream_answer(llm, messages_llm))
+		st.session_state.messages.append({"role": "assistant", "content": answer})